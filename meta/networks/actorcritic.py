@@ -18,6 +18,7 @@ from meta.networks.splitting import (
     MultiTaskSplittingNetworkV2,
     MetaSplittingNetwork,
 )
+from meta.networks.normalize import RunningNormalizer
 from meta.utils.utils import AddBias, get_space_size, get_space_shape
 
 
@@ -32,6 +33,8 @@ class ActorCriticNetwork(nn.Module):
         rollout_length: int,
         architecture_config: Dict[str, Any],
         device: torch.device = None,
+        normalize_obs: bool = False,
+        normalize_first_n: int = None,
     ) -> None:
 
         super(ActorCriticNetwork, self).__init__()
@@ -53,6 +56,14 @@ class ActorCriticNetwork(nn.Module):
         # Initialize network.
         self.initialize_network(architecture_config)
 
+        # Initialize observation normalization, if necessary. The statistics are only
+        # updated by `PPOPolicy.update_obs_normalization()`.
+        self.obs_normalizer = None
+        if normalize_obs:
+            self.obs_normalizer = RunningNormalizer(
+                get_space_shape(observation_space, "obs"), first_n=normalize_first_n
+            )
+
         # Move to device.
         self.to(device)
 
@@ -161,13 +172,13 @@ class ActorCriticNetwork(nn.Module):
                 **critic_kwargs,
             )
 
-            # Extra parameter vectors (one for each task) for standard deviations in the
-            # case that the policy distribution is Gaussian.
+            # Extra parameter vectors (one for each task, stored as the rows of a
+            # single tensor) for standard deviations in the case that the policy
+            # distribution is Gaussian.
             if isinstance(self.action_space, Box):
-                logstd_list = []
-                for _ in range(architecture_config["num_tasks"]):
-                    logstd_list.append(AddBias(torch.zeros(self.output_size)))
-                self.output_logstd = nn.ModuleList(logstd_list)
+                self.output_logstd = nn.Parameter(
+                    torch.zeros(architecture_config["num_tasks"], self.output_size)
+                )
 
         else:
             raise ValueError(
@@ -175,7 +186,12 @@ class ActorCriticNetwork(nn.Module):
             )
 
     def forward(
-        self, obs: torch.Tensor, hidden_state: torch.Tensor, done: torch.Tensor,
+        self,
+        obs: torch.Tensor,
+        hidden_state: torch.Tensor,
+        done: torch.Tensor,
+        task_indices: torch.Tensor = None,
+        heads: Tuple[str, ...] = ("actor", "critic"),
     ) -> Tuple[torch.Tensor, Distribution, torch.Tensor]:
         """
         Forward pass definition for ActorCriticNetwork.
@@ -184,45 +200,52 @@ class ActorCriticNetwork(nn.Module):
         ---------
         obs : torch.Tensor
             Observation to be used as input to policy network. If the observation space
-            is discrete, this function expects ``obs`` to be a one-hot vector.
+            is discrete, this function expects ``obs`` to be a one-hot vector. If the
+            network normalizes observations, ``obs`` should be unnormalized.
         hidden_state : torch.Tensor
             Hidden state to use for recurrent layer, if necessary.
         done : torch.Tensor
             Whether or not the last step was a terminal step. We use this to clear the
             hidden state of the network when necessary, if it is recurrent.
+        task_indices : torch.Tensor
+            Task index for each observation in `obs` as an integer. Only used by
+            multi-task architectures. If None, the task indices are recovered from the
+            one-hot task vector at the end of each observation.
+        heads : Tuple[str, ...]
+            Which outputs of the network to compute, a subset of ("actor", "critic").
+            The actor or critic network (and for the actor, the construction of the
+            action distribution) is skipped if it isn't included, and the corresponding
+            output is None. The recurrent layer is shared, so it is run once either way.
 
         Returns
         -------
         value_pred : torch.Tensor
-            Predicted value output from critic.
+            Predicted value output from critic, or None if "critic" isn't in ``heads``.
         action_dist : torch.distributions.Distribution
-            Distribution over action space to sample from.
+            Distribution over action space to sample from, or None if "actor" isn't in
+            ``heads``.
         hidden_state : torch.Tensor
             New hidden state after forward pass.
         """
 
-        x = obs
-
-        # Exclude task index from obs, if necessary.
-        if (
-            self.architecture_type
-            in ["trunk", "splitting_v1", "splitting_v2", "meta_splitting"]
-            and not self.include_task_index
-        ):
-            task_index_pos = self.input_size - self.num_tasks
-            x = x[:, :task_index_pos]
+        for head in heads:
+            if head not in ["actor", "critic"]:
+                raise ValueError("Unrecognized network head: %s" % head)
 
-        # Pass through recurrent layer, if necessary.
-        if self.recurrent:
-            x, hidden_state = self.recurrent_block(x, hidden_state, done)
+        x, task_indices, hidden_state = self.encode(
+            obs, hidden_state, done, task_indices
+        )
 
-        # Pass through actor and critic networks. We do this separately depending on the
-        # architecture type, since the multi-task networks need the task index info
-        # included in obs in order to feed each observation to the correct output head,
-        # and this information isn't present in `x`.
+        # Pass through actor and critic networks, if necessary. We do this separately
+        # depending on the architecture type, since the multi-task networks need the
+        # task index of each observation in order to feed it to the correct output head.
+        value_pred = None
+        action_dist = None
         if self.architecture_type == "mlp":
-            value_pred = self.critic(x)
-            actor_output = self.actor(x)
+            if "critic" in heads:
+                value_pred = self.critic(x)
+            if "actor" in heads:
+                actor_output = self.actor(x)
 
         elif self.architecture_type in [
             "trunk",
@@ -230,15 +253,105 @@ class ActorCriticNetwork(nn.Module):
             "splitting_v2",
             "meta_splitting",
         ]:
-            task_index_pos = self.input_size - self.num_tasks
-            task_indices = obs[:, task_index_pos:].nonzero()[:, 1]
-            value_pred = self.critic(x, task_indices)
-            actor_output = self.actor(x, task_indices)
+            if "critic" in heads:
+                value_pred = self.critic(x, task_indices)
+            if "actor" in heads:
+                actor_output = self.actor(x, task_indices)
 
         else:
             raise NotImplementedError
 
-        # Construct action distribution from actor output.
+        if "actor" in heads:
+            action_dist = self.get_action_dist(actor_output, task_indices)
+
+        return value_pred, action_dist, hidden_state
+
+    def value(
+        self,
+        obs: torch.Tensor,
+        hidden_state: torch.Tensor,
+        done: torch.Tensor,
+        task_indices: torch.Tensor = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Compute only the value prediction of the critic, skipping the actor. The
+        arguments are the same as those of `forward()`. Returns the value prediction and
+        the new hidden state.
+        """
+
+        value_pred, _, hidden_state = self(
+            obs, hidden_state, done, task_indices, heads=("critic",)
+        )
+        return value_pred, hidden_state
+
+    def action_dist(
+        self,
+        obs: torch.Tensor,
+        hidden_state: torch.Tensor,
+        done: torch.Tensor,
+        task_indices: torch.Tensor = None,
+    ) -> Tuple[Distribution, torch.Tensor]:
+        """
+        Compute only the action distribution of the actor, skipping the critic. The
+        arguments are the same as those of `forward()`. Returns the action distribution
+        and the new hidden state.
+        """
+
+        _, action_dist, hidden_state = self(
+            obs, hidden_state, done, task_indices, heads=("actor",)
+        )
+        return action_dist, hidden_state
+
+    def encode(
+        self,
+        obs: torch.Tensor,
+        hidden_state: torch.Tensor,
+        done: torch.Tensor,
+        task_indices: torch.Tensor = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Compute the input shared by the actor and critic networks, by normalizing the
+        observation, excluding the task index, and passing through the recurrent layer,
+        as necessary. The arguments are the same as those of `forward()`. Returns the
+        shared input, the task indices (recovered from `obs` if `task_indices` is None
+        and the architecture is multi-task), and the new hidden state.
+        """
+
+        x = obs
+
+        # Normalize obs, if necessary. The task indices are still recovered from the
+        # unnormalized obs below.
+        if self.obs_normalizer is not None:
+            x = self.obs_normalizer(x)
+
+        # Recover task indices from obs and exclude task index from obs, if necessary.
+        if self.architecture_type in [
+            "trunk",
+            "splitting_v1",
+            "splitting_v2",
+            "meta_splitting",
+        ]:
+            task_index_pos = self.input_size - self.num_tasks
+            if task_indices is None:
+                task_indices = obs[:, task_index_pos:].nonzero()[:, 1]
+            if not self.include_task_index:
+                x = x[:, :task_index_pos]
+
+        # Pass through recurrent layer, if necessary.
+        if self.recurrent:
+            x, hidden_state = self.recurrent_block(x, hidden_state, done)
+
+        return x, task_indices, hidden_state
+
+    def get_action_dist(
+        self, actor_output: torch.Tensor, task_indices: torch.Tensor = None
+    ) -> Distribution:
+        """
+        Construct the distribution over the action space from the output of the actor
+        network. `task_indices` is only used by multi-task architectures with continuous
+        action spaces.
+        """
+
         if isinstance(self.action_space, Discrete):
             action_dist = Categorical(logits=actor_output)
         elif isinstance(self.action_space, Box):
@@ -257,17 +370,9 @@ class ActorCriticNetwork(nn.Module):
             ]:
 
                 # In the multi-task case, we have to do account for the fact that each
-                # output head has its own copy of `logstd`.
-                action_logstds = []
-                logstd_shape = actor_output.shape[1:]
-                for i in range(len(task_indices)):
-                    task_index = task_indices[i]
-                    action_logstds.append(
-                        self.output_logstd[task_index](
-                            torch.zeros(logstd_shape, device=self.device)
-                        )
-                    )
-                action_logstd = torch.stack(action_logstds)
+                # output head has its own copy of `logstd`, so we gather the row of
+                # `self.output_logstd` corresponding to the task of each input.
+                action_logstd = self.output_logstd[task_indices]
 
             else:
                 raise NotImplementedError
@@ -277,7 +382,7 @@ class ActorCriticNetwork(nn.Module):
         else:
             raise NotImplementedError
 
-        return value_pred, action_dist, hidden_state
+        return action_dist
 
     def meta_conversion(self, num_test_tasks: int) -> None:
         """
@@ -301,14 +406,79 @@ class ActorCriticNetwork(nn.Module):
             self.critic = MetaSplittingNetwork(
                 self.critic, num_test_tasks, device=self.device
             )
-            logstd_list = []
-            for _ in range(self.num_tasks):
-                logstd_list.append(
-                    AddBias(torch.zeros(self.output_size, device=self.device))
-                )
-            self.output_logstd = nn.ModuleList(logstd_list)
+            self.output_logstd = nn.Parameter(
+                torch.zeros(self.num_tasks, self.output_size, device=self.device)
+            )
 
             self.architecture_type = "meta_splitting"
 
         else:
             raise NotImplementedError
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """
+        Restore the network from a pickled state. Networks pickled before the per-task
+        log standard deviations were stored as a single tensor hold them as an
+        `nn.ModuleList` of `AddBias` modules named `output_logstd`, which is converted
+        into a single parameter of shape `(num_tasks, action_dim)`.
+        """
+
+        super(ActorCriticNetwork, self).__setstate__(state)
+
+        legacy_logstd = self._modules.get("output_logstd")
+        if isinstance(legacy_logstd, nn.ModuleList):
+            del self._modules["output_logstd"]
+            self.output_logstd = nn.Parameter(
+                torch.stack([module._bias.data for module in legacy_logstd])
+            )
+
+    def _load_from_state_dict(
+        self,
+        state_dict: Dict[str, torch.Tensor],
+        prefix: str,
+        *args: Any,
+        **kwargs: Any,
+    ) -> None:
+        """
+        Load the parameters and buffers of this module (not including submodules) from
+        a state dict. Overridden from nn.Module so that we can load state dicts saved
+        before the per-task log standard deviations were stored as a single tensor,
+        which hold one `output_logstd.<task>._bias` entry for each task. This is also
+        called when the network is loaded as a submodule of another module.
+        """
+
+        convert_logstd_state_dict(state_dict, prefix)
+        super(ActorCriticNetwork, self)._load_from_state_dict(
+            state_dict, prefix, *args, **kwargs
+        )
+
+
+def convert_logstd_state_dict(
+    state_dict: Dict[str, torch.Tensor], prefix: str = ""
+) -> None:
+    """
+    Convert the per-task log standard deviations in a state dict of an
+    ActorCriticNetwork whose entries start with `prefix` from the legacy format, where
+    each task had its own `AddBias` module in an `nn.ModuleList` named `output_logstd`,
+    to a single tensor of shape `(num_tasks, action_dim)`. `state_dict` is modified in
+    place, and state dicts that don't contain legacy entries are left unchanged.
+    """
+
+    legacy_prefix = prefix + "output_logstd."
+    legacy_keys = [
+        key
+        for key in state_dict
+        if key.startswith(legacy_prefix)
+        and key.endswith("._bias")
+        and key[len(legacy_prefix) : -len("._bias")].isdigit()
+    ]
+    if len(legacy_keys) == 0:
+        return
+
+    # Stack the legacy biases in order of task index.
+    num_tasks = len(legacy_keys)
+    state_dict[prefix + "output_logstd"] = torch.stack(
+        [state_dict["%s%d._bias" % (legacy_prefix, i)] for i in range(num_tasks)]
+    )
+    for key in legacy_keys:
+        del state_dict[key]
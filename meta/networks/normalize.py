@@ -0,0 +1,97 @@
+"""
+Definition of RunningNormalizer, a module to normalize inputs with running estimates of
+their mean and variance.
+"""
+
+from typing import Tuple
+
+import torch
+import torch.nn as nn
+
+
+class RunningNormalizer(nn.Module):
+    """
+    Module which normalizes inputs with running estimates of the mean and variance of
+    the inputs seen so far. This is a torch port of RunningMeanStd and the normalization
+    of VecNormalize from baselines, so that normalization runs on the device of the
+    network holding the module, and the statistics are buffers which are saved and
+    restored with the network. The statistics only change when `update()` is called.
+    If `first_n` is not None, only the first `first_n` elements of the last dimension
+    of each input are normalized, and inputs must be flat vectors.
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, ...],
+        first_n: int = None,
+        clip: float = 10.0,
+        epsilon: float = 1e-8,
+        device: torch.device = None,
+    ) -> None:
+        """ Init function for RunningNormalizer. """
+
+        super(RunningNormalizer, self).__init__()
+
+        if first_n is not None:
+            if len(shape) != 1:
+                raise NotImplementedError
+            shape = (first_n,)
+
+        self.first_n = first_n
+        self.clip = clip
+        self.epsilon = epsilon
+
+        # The statistics are stored in double precision, and the initial count matches
+        # RunningMeanStd.
+        self.register_buffer("mean", torch.zeros(shape, dtype=torch.float64))
+        self.register_buffer("var", torch.ones(shape, dtype=torch.float64))
+        self.register_buffer("count", torch.tensor(1e-4, dtype=torch.float64))
+        self.to(device)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        """ Normalize `x` with the current statistics and clip the result. """
+
+        mean = self.mean.to(x.dtype)
+        std = torch.sqrt(self.var + self.epsilon).to(x.dtype)
+        normalized = torch.clamp((self.select(x) - mean) / std, -self.clip, self.clip)
+        if self.first_n is None:
+            return normalized
+        return torch.cat([normalized, x[..., self.first_n :]], dim=-1)
+
+    def scale(self, x: torch.Tensor) -> torch.Tensor:
+        """
+        Divide `x` by the current standard deviation without centering, and clip the
+        result. This is how VecNormalize normalizes rewards with return statistics.
+        """
+
+        std = torch.sqrt(self.var + self.epsilon).to(x.dtype)
+        return torch.clamp(x / std, -self.clip, self.clip)
+
+    def update(self, x: torch.Tensor) -> None:
+        """
+        Update the running statistics with a batch of inputs, where every dimension of
+        `x` before the dimensions of a single input is treated as a batch dimension.
+        """
+
+        x = self.select(x).reshape(-1, *self.mean.shape).to(torch.float64)
+        batch_mean = x.mean(dim=0)
+        batch_var = x.var(dim=0, unbiased=False)
+        batch_count = x.shape[0]
+
+        # Combine the batch statistics with the running statistics, as in
+        # RunningMeanStd.
+        delta = batch_mean - self.mean
+        total_count = self.count + batch_count
+        m2 = (
+            self.var * self.count
+            + batch_var * batch_count
+            + delta.pow(2) * self.count * batch_count / total_count
+        )
+        self.mean += delta * batch_count / total_count
+        self.var.copy_(m2 / total_count)
+        self.count.copy_(total_count)
+
+    def select(self, x: torch.Tensor) -> torch.Tensor:
+        """ Select the elements of `x` which are normalized. """
+
+        return x if self.first_n is None else x[..., : self.first_n]
@@ -70,10 +70,14 @@ class RecurrentBlock(nn.Module):
         # dimension has length greater than 1. ``inputs`` holds a sequence of
         # observations, though if the sequence has length 1 then there is simply no
         # temporal dimension. To test for this then, we have to test the size of inputs
-        # against the size of a single batch of observations. If a sequence is given,
-        # the first two dimensions will be combined (this happens in the recurrent
-        # minibatch generator).
-        if inputs.shape == (self.num_processes, *self.observation_shape):
+        # against the size of a batch of hidden states, which holds one hidden state
+        # for each sequence. This way a single step can be taken for any number of
+        # processes. If a sequence is given, the first two dimensions will be combined
+        # (this happens in the recurrent minibatch generator).
+        if (
+            inputs.shape[0] == hidden_state.shape[0]
+            and inputs.shape[1:] == self.observation_shape
+        ):
 
             # Clear the hidden state for any processes for which the environment just
             # finished.
@@ -4,13 +4,18 @@ multi-task splitting network.
 """
 
 from copy import deepcopy
-from typing import List
+from typing import List, Optional
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from meta.networks.utils import get_layer, init_base, init_downscale
+from meta.networks.utils import (
+    get_layer,
+    init_base,
+    init_downscale,
+    accumulate_flat_grad,
+)
 from meta.utils.estimate import RunningStats
 from meta.utils.logger import logger
 
@@ -35,6 +40,8 @@ class BaseMultiTaskSplittingNetwork(nn.Module):
         cap_sample_size: bool = True,
         ema_alpha: float = 0.999,
         downscale_last_layer: bool = False,
+        task_grads_backend: str = "loop",
+        forward_backend: str = "loop",
         device: torch.device = None,
     ) -> None:
         """
@@ -62,6 +69,14 @@ class BaseMultiTaskSplittingNetwork(nn.Module):
             Whether or not to stop increasing the sample size when we switch to EMA.
         ema_alpha : float
             Coefficient used to compute exponential moving averages.
+        task_grads_backend : str
+            Method used to compute task-specific gradients in `get_task_grads()`. Either
+            "loop", which performs one backward pass per task, or "batched", which
+            computes the gradients of all tasks with a single batched backward pass.
+        forward_backend : str
+            Method used to compute the forward pass in `forward()`. Either "loop", which
+            performs one forward pass per copy at each region, or "batched", which
+            evaluates all copies of a region with a single batched matrix multiply.
         device : torch.device
             Device to perform computation on, either `torch.device("cpu")` or
             `torch.device("cuda:0")`.
@@ -75,6 +90,12 @@ class BaseMultiTaskSplittingNetwork(nn.Module):
                 "Number of layers in network should be at least 1. Given value is: %d"
                 % num_layers
             )
+        if task_grads_backend not in ["loop", "batched"]:
+            raise ValueError(
+                "Unsupported task gradient backend: %s" % str(task_grads_backend)
+            )
+        if forward_backend not in ["loop", "batched"]:
+            raise ValueError("Unsupported forward backend: %s" % str(forward_backend))
 
         # Set state.
         self.input_size = input_size
@@ -88,6 +109,8 @@ class BaseMultiTaskSplittingNetwork(nn.Module):
         self.cap_sample_size = cap_sample_size
         self.ema_alpha = ema_alpha
         self.downscale_last_layer = downscale_last_layer
+        self.task_grads_backend = task_grads_backend
+        self.forward_backend = forward_backend
 
         # Set device.
         self.device = device if device is not None else torch.device("cpu")
@@ -165,11 +188,46 @@ class BaseMultiTaskSplittingNetwork(nn.Module):
         self.max_region_size = int(max(self.region_sizes))
         self.total_region_size = int(sum(self.region_sizes))
 
+        # Initialize routing plan used by the batched forward pass. The plan is built
+        # lazily and rebuilt whenever the version of the splitting map changes.
+        self.routing_plan: List[Optional[torch.Tensor]] = []
+        self.routing_plan_version = -1
+
     def forward(self, inputs: torch.Tensor, task_indices: torch.Tensor) -> torch.Tensor:
         """
         Forward pass definition for BaseMultiTaskSplittingNetwork. For each layer of the
-        network, we aggregate the inputs by their assigned copy of each region, and pass
-        the inputs through the corresponding copy.
+        network, each input is passed through the copy of the region which is assigned
+        to the input's task, using the method given by `self.forward_backend`.
+
+        Arguments
+        ---------
+        inputs : torch.Tensor
+            Input to splitting MLP network.
+        task_indices : torch.Tensor
+            Task index for each input in `inputs` as a integer.
+
+        Returns
+        -------
+        outputs : torch.Tensor
+            Output of splitting MLP network when given `inputs` as input.
+        """
+
+        if self.forward_backend == "loop":
+            outputs = self.forward_loop(inputs, task_indices)
+        elif self.forward_backend == "batched":
+            outputs = self.forward_batched(inputs, task_indices)
+        else:
+            raise NotImplementedError
+
+        return outputs
+
+    def forward_loop(
+        self, inputs: torch.Tensor, task_indices: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Compute the forward pass by aggregating the inputs at each layer by their
+        assigned copy of each region, and passing the inputs through the corresponding
+        copy. See `forward()` for a description of the inputs and outputs.
 
         Implementation note: As I see it, there are two ways that we can reasonably
         implement this function. The first is, at each region, sorting the inputs by
@@ -184,18 +242,6 @@ class BaseMultiTaskSplittingNetwork(nn.Module):
         here, in the name of minimizing the number of forward passes (which are likely
         going to add more computational burden than sorting), but I could see an
         argument for the second implementation.
-
-        Arguments
-        ---------
-        inputs : torch.Tensor
-            Input to splitting MLP network.
-        task_indices : torch.Tensor
-            Task index for each input in `inputs` as a integer.
-
-        Returns
-        -------
-        outputs : torch.Tensor
-            Output of splitting MLP network when given `inputs` as input.
         """
 
         assert len(inputs) == len(task_indices)
@@ -224,23 +270,109 @@ class BaseMultiTaskSplittingNetwork(nn.Module):
 
         return x
 
-    def check_for_split(self, task_losses: torch.Tensor) -> bool:
+    def forward_batched(
+        self, inputs: torch.Tensor, task_indices: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        Compute the forward pass by stacking the weights of all copies of each split
+        region and evaluating every copy with a single batched matrix multiplication,
+        then selecting the output of the assigned copy for each input. Regions that are
+        shared by all tasks are evaluated directly. The parameters of a copy only
+        receive gradients from the inputs whose tasks are assigned to that copy, so the
+        outputs and gradients are the same as those of `forward_loop()`. See
+        `forward()` for a description of the inputs and outputs.
+        """
+
+        assert len(inputs) == len(task_indices)
+
+        routing_plan = self.get_routing_plan()
+        batch_range = torch.arange(len(inputs), device=inputs.device)
+
+        # Pass through each splitting layer.
+        x = inputs
+        for layer in range(self.num_layers):
+
+            # Shared regions have a single copy, so no routing is necessary.
+            if routing_plan[layer] is None:
+                x = self.regions[layer][0](x)
+                continue
+
+            # Evaluate each copy of the region on the entire batch at once.
+            linears = [copy[0] for copy in self.regions[layer]]
+            weights = torch.stack([linear.weight for linear in linears])
+            biases = torch.stack([linear.bias for linear in linears]).unsqueeze(1)
+            copy_outputs = torch.baddbmm(
+                biases,
+                x.unsqueeze(0).expand(len(linears), -1, -1),
+                weights.transpose(1, 2),
+            )
+
+            # Select the output of the assigned copy for each input and apply the
+            # activation function, which is shared by all copies of a region.
+            copy_indices = routing_plan[layer][task_indices]
+            x = copy_outputs[copy_indices, batch_range]
+            x = self.regions[layer][0][1:](x)
+
+        return x
+
+    def get_routing_plan(self) -> List[Optional[torch.Tensor]]:
+        """
+        Return the routing plan used by `forward_batched()`, rebuilding it only if the
+        splitting map has changed since the plan was last built. The plan holds one
+        element for each layer, which is None if the layer is shared by all tasks, and
+        otherwise is a tensor of shape `(self.num_tasks,)` holding the index of the copy
+        assigned to each task at that layer.
+        """
+
+        if self.routing_plan_version != self.splitting_map.version:
+            self.routing_plan = []
+            for layer in range(self.num_layers):
+                if int(self.splitting_map.num_copies[layer]) == 1:
+                    self.routing_plan.append(None)
+                else:
+                    self.routing_plan.append(self.splitting_map.copy[layer].clone())
+            self.routing_plan_version = self.splitting_map.version
+
+        return self.routing_plan
+
+    def check_for_split(
+        self, task_losses: torch.Tensor, accumulate_grads: bool = False
+    ) -> bool:
         """
         Determine whether any splits should occur based on the task-specific losses from
         the current batch. To do this, we compute task-specific gradients for each task,
         update our running statistics measuring these gradients, then determine which
         regions should be split (if any) by calling self.determine_splits(), which is
         implemented differently for each subclass.
+
+        If `accumulate_grads` is True, the gradient of the summed task losses with
+        respect to the parameters of each region is added into the `.grad` attribute of
+        those parameters. This gradient is computed from the task-specific gradients
+        before any splits are performed, so that the caller doesn't need another
+        backward pass through this network to compute the gradient of the total loss.
         """
 
         self.num_steps += 1
 
         # Stop splitting when the sharing score is sufficiently low.
         if self.get_sharing_score() <= self.sharing_threshold:
+            if accumulate_grads:
+                params = list(self.regions.parameters())
+                param_grads = torch.autograd.grad(
+                    torch.sum(task_losses),
+                    params,
+                    retain_graph=True,
+                    allow_unused=True,
+                )
+                for param, param_grad in zip(params, param_grads):
+                    if param_grad is not None:
+                        accumulate_flat_grad([param], param_grad.view(-1))
             return False
 
         # Compute task-specific gradients.
         task_grads = self.get_task_grads(task_losses)
+        if accumulate_grads:
+            self.accumulate_task_grads(task_grads)
 
         # Update running estimates of gradient statistics.
         self.update_grad_stats(task_grads)
@@ -260,7 +392,8 @@ class BaseMultiTaskSplittingNetwork(nn.Module):
 
     def get_task_grads(self, task_losses: torch.Tensor) -> torch.Tensor:
         """
-        Compute the task-specific gradients for each task at each region.
+        Compute the task-specific gradients for each task at each region, using the
+        method given by `self.task_grads_backend`.
 
         Arguments
         ---------
@@ -276,6 +409,21 @@ class BaseMultiTaskSplittingNetwork(nn.Module):
             region `j` padded with zeros to fit the size of the tensor.
         """
 
+        if self.task_grads_backend == "loop":
+            task_grads = self.get_task_grads_loop(task_losses)
+        elif self.task_grads_backend == "batched":
+            task_grads = self.get_task_grads_batched(task_losses)
+        else:
+            raise NotImplementedError
+
+        return task_grads
+
+    def get_task_grads_loop(self, task_losses: torch.Tensor) -> torch.Tensor:
+        """
+        Compute the task-specific gradients by performing one backward pass for each
+        task loss. See `get_task_grads()` for a description of the inputs and outputs.
+        """
+
         task_grads = torch.zeros(
             (self.num_tasks, self.num_regions, self.max_region_size),
             device=self.device,
@@ -283,19 +431,117 @@ class BaseMultiTaskSplittingNetwork(nn.Module):
 
         for task in range(self.num_tasks):
 
-            self.zero_grad()
-            task_losses[task].backward(retain_graph=True)
+            # Compute gradient of task loss with respect to the copies of each region
+            # that are assigned to the current task. We use `torch.autograd.grad()`
+            # instead of `backward()` so that the `.grad` attribute of parameters isn't
+            # modified.
+            params = []
+            for region in range(self.num_regions):
+                copy = int(self.splitting_map.copy[region, task])
+                params.append(list(self.regions[region][copy].parameters()))
+            param_grads = torch.autograd.grad(
+                task_losses[task],
+                [param for region_params in params for param in region_params],
+                retain_graph=True,
+                allow_unused=True,
+            )
 
+            pos = 0
             for region in range(self.num_regions):
                 param_grad_list = []
-                copy = int(self.splitting_map.copy[region, task])
-                for param in self.regions[region][copy].parameters():
-                    param_grad_list.append(param.grad.view(-1))
+                for param in params[region]:
+                    param_grad = param_grads[pos]
+                    if param_grad is None:
+                        param_grad = torch.zeros_like(param)
+                    param_grad_list.append(param_grad.view(-1))
+                    pos += 1
                 region_grad = torch.cat(param_grad_list)
                 task_grads[task, region, : len(region_grad)] = region_grad
 
         return task_grads
 
+    def get_task_grads_batched(self, task_losses: torch.Tensor) -> torch.Tensor:
+        """
+        Compute the task-specific gradients with a single batched backward pass. We
+        compute a vector-Jacobian product of `task_losses` with each row of the identity
+        matrix at once, which yields the gradient of each task loss with respect to each
+        copy of each region. The gradient of each task is then gathered from the copy
+        that the task is assigned to at each region. See `get_task_grads()` for a
+        description of the inputs and outputs.
+        """
+
+        task_grads = torch.zeros(
+            (self.num_tasks, self.num_regions, self.max_region_size),
+            device=self.device,
+        )
+
+        # Compute gradient of each task loss with respect to every parameter. Each
+        # element of `param_grads` has shape `(self.num_tasks, *param.shape)`, or is
+        # None if the corresponding parameter wasn't used to compute the losses.
+        params = list(self.regions.parameters())
+        grad_outputs = torch.eye(self.num_tasks, device=task_losses.device)
+        param_grads = torch.autograd.grad(
+            task_losses,
+            params,
+            grad_outputs=grad_outputs,
+            retain_graph=True,
+            allow_unused=True,
+            is_grads_batched=True,
+        )
+
+        # Flatten the gradients for each copy of each region, and select the gradient
+        # of each task from the copy which it is assigned to. Note that the order of
+        # `params` matches the order in which we iterate over regions and copies here.
+        pos = 0
+        task_range = torch.arange(self.num_tasks, device=self.device)
+        for region in range(self.num_regions):
+            copy_grad_list = []
+            for copy in self.regions[region]:
+                param_grad_list = []
+                for param in copy.parameters():
+                    param_grad = param_grads[pos]
+                    if param_grad is None:
+                        param_grad = torch.zeros(
+                            self.num_tasks, *param.shape, device=self.device
+                        )
+                    param_grad_list.append(param_grad.view(self.num_tasks, -1))
+                    pos += 1
+                copy_grad_list.append(torch.cat(param_grad_list, dim=1))
+            copy_grads = torch.stack(copy_grad_list)
+
+            region_grads = copy_grads[self.splitting_map.copy[region], task_range]
+            task_grads[:, region, : region_grads.shape[1]] = region_grads
+
+        return task_grads
+
+    def accumulate_task_grads(self, task_grads: torch.Tensor) -> None:
+        """
+        Add the gradient of the summed task losses into the `.grad` attribute of the
+        parameters of each copy of each region, where the gradient for each copy is the
+        sum of the task-specific gradients of the tasks assigned to that copy.
+
+        Arguments
+        ---------
+        task_grads : torch.Tensor
+            A tensor of size `(self.num_tasks, self.num_regions, self.max_region_size)`.
+            `task_grads[i, j]` that holds the gradient of task loss `i` with respect to
+            region `j` padded with zeros to fit the size of the tensor.
+        """
+
+        for region in range(self.num_regions):
+            num_copies = int(self.splitting_map.num_copies[region])
+            region_size = int(self.region_sizes[region])
+            copy_grads = torch.zeros(num_copies, region_size, device=self.device)
+            copy_grads.index_add_(
+                0,
+                self.splitting_map.copy[region],
+                task_grads[:, region, :region_size],
+            )
+            for copy in range(num_copies):
+                accumulate_flat_grad(
+                    self.regions[region][copy].parameters(), copy_grads[copy]
+                )
+
     def update_grad_stats(self, task_grads: torch.Tensor) -> None:
         """ Update our running estimates of pairwise gradient statistics. """
 
@@ -494,6 +740,10 @@ class SplittingMap:
             self.num_regions, self.num_tasks, dtype=torch.long, device=self.device
         )
 
+        # Version counter of the map, incremented whenever the map changes. This allows
+        # networks to cache information computed from the map.
+        self.version = 0
+
     def split(
         self, region: int, copy: int, group_1: List[int], group_2: List[int]
     ) -> None:
@@ -512,6 +762,7 @@ class SplittingMap:
         self.num_copies[region] += 1
         for task in group_2:
             self.copy[region, task] = self.num_copies[region] - 1
+        self.version += 1
 
     def shared_regions(self) -> torch.Tensor:
         """
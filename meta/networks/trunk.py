@@ -9,7 +9,12 @@ from itertools import product
 import torch
 import torch.nn as nn
 
-from meta.networks.utils import get_layer, init_downscale, init_base
+from meta.networks.utils import (
+    get_layer,
+    init_downscale,
+    init_base,
+    accumulate_flat_grad,
+)
 from meta.utils.estimate import RunningStats
 
 
@@ -164,63 +169,75 @@ class MultiTaskTrunkNetwork(nn.Module):
         # Pass input through shared trunk.
         trunk_output = self.trunk(inputs)
 
-        # To forward pass through the output heads, we first partition the inputs by
-        # their task, so that we can perform only one forward pass through each
-        # task-specific output head.
-        task_batch_indices = [
-            (task_indices == task).nonzero().squeeze(-1)
-            for task in range(self.num_tasks)
-        ]
+        # To forward pass through the output heads, we first sort the inputs by their
+        # task, so that the inputs for each task form a contiguous block and we can
+        # perform only one forward pass through each task-specific output head. The sort
+        # is stable, so the inputs for each task stay in their original order.
+        _, task_permutation = torch.sort(task_indices, stable=True)
+        task_counts = torch.bincount(task_indices, minlength=self.num_tasks).tolist()
+        task_batches = torch.split(trunk_output[task_permutation], task_counts)
         batch_outputs = []
         for task in range(self.num_tasks):
 
-            # Construct the batch of trunk outputs for a given task head.
-            single_batch_indices = task_batch_indices[task]
-
             # Don't perform forward pass if there are no inputs for the current task.
-            if len(single_batch_indices) == 0:
-                batch_outputs.append(torch.Tensor([0.0]))
+            if task_counts[task] == 0:
                 continue
 
             # Pass batch of trunk outputs through task head.
-            task_batch = trunk_output[single_batch_indices]
-            batch_outputs.append(self.output_heads[task](task_batch))
-
-        # Reconstruct batched outputs into a single tensor.
-        outputs_list = []
-        batch_counters = [0 for _ in range(self.num_tasks)]
-        for task in task_indices:
-            batch_counter = batch_counters[task]
-            outputs_list.append(batch_outputs[task][batch_counter])
-            batch_counters[task] += 1
-        outputs = torch.stack(outputs_list)
+            batch_outputs.append(self.output_heads[task](task_batches[task]))
+
+        # Restore the original order of the outputs with a single scatter.
+        sorted_outputs = torch.cat(batch_outputs)
+        outputs = torch.zeros_like(sorted_outputs).index_copy(
+            0, task_permutation, sorted_outputs
+        )
 
         return outputs
 
-    def check_conflicting_grads(self, task_losses: torch.Tensor) -> None:
+    def check_conflicting_grads(
+        self, task_losses: torch.Tensor, accumulate_grads: bool = False
+    ) -> None:
         """
         Determine whether there are conflicting gradients between the task losses at
         each shared layer. This is purely for observation and investigating the
-        multi-task training dynamics.
+        multi-task training dynamics. If `accumulate_grads` is True, the sum of the
+        task-specific gradients is added into the `.grad` attribute of the parameters of
+        the shared layers, so that the caller doesn't need another backward pass through
+        the trunk to compute the gradient of the total loss.
         """
 
-        # Compute task-specific gradients for the shared layers.
+        # Compute task-specific gradients for the shared layers. We use
+        # `torch.autograd.grad()` instead of `backward()` so that the `.grad` attribute
+        # of parameters isn't modified.
         task_grads = torch.zeros(
             (self.num_tasks, self.num_shared_layers, self.max_shared_layer_size),
             device=self.device,
         )
+        params = list(self.trunk.parameters())
         for task in range(self.num_tasks):
 
-            self.zero_grad()
-            task_losses[task].backward(retain_graph=True)
+            param_grads = torch.autograd.grad(
+                task_losses[task], params, retain_graph=True, allow_unused=True
+            )
 
+            pos = 0
             for layer in range(self.num_shared_layers):
                 param_grad_list = []
                 for param in self.trunk[layer].parameters():
-                    param_grad_list.append(param.grad.view(-1))
+                    param_grad = param_grads[pos]
+                    if param_grad is None:
+                        param_grad = torch.zeros_like(param)
+                    param_grad_list.append(param_grad.view(-1))
+                    pos += 1
                 layer_grad = torch.cat(param_grad_list)
                 task_grads[task, layer, : len(layer_grad)] = layer_grad
 
+        # Accumulate total gradient of shared layers.
+        if accumulate_grads:
+            total_grads = torch.sum(task_grads, dim=0)
+            for layer in range(self.num_shared_layers):
+                accumulate_flat_grad(self.trunk[layer].parameters(), total_grads[layer])
+
         self.measure_conflicts_from_grads(task_grads)
 
     def measure_conflicts_from_grads(self, task_grads: torch.Tensor) -> None:
@@ -1,8 +1,9 @@
 """ Misc functionality for meta/networks. """
 
-from typing import Any, Union, Callable
+from typing import Any, Union, Callable, Iterable
 
 import numpy as np
+import torch
 import torch.nn as nn
 
 
@@ -50,6 +51,27 @@ def get_layer(
     return nn.Sequential(*layer)
 
 
+def accumulate_flat_grad(
+    params: Iterable[nn.Parameter], flat_grad: torch.Tensor
+) -> None:
+    """
+    Add a flattened gradient into the `.grad` attribute of each parameter in `params`.
+    `flat_grad` should hold the concatenation of the flattened gradients for each
+    parameter in `params`, in order. Any entries of `flat_grad` past the total number of
+    elements in `params` (such as zero padding) are ignored.
+    """
+
+    pos = 0
+    for param in params:
+        param_size = param.nelement()
+        param_grad = flat_grad[pos : pos + param_size].view_as(param)
+        if param.grad is None:
+            param.grad = param_grad.clone()
+        else:
+            param.grad += param_grad
+        pos += param_size
+
+
 # Initialization functions for network weights. `init_downscale` is usually only used for
 # the last layer of the actor network, `init_recurrent` is used for the recurrent block,
 # and `init_base` is used for all other layers in actor/critic networks. We initialize
@@ -1,20 +1,59 @@
 """ Environment wrappers + functionality. """
 
-from typing import Dict, Tuple, List, Any, Callable
+import os
+import atexit
+import ctypes
+import warnings
+import multiprocessing as mp
+from multiprocessing.connection import Connection, wait
+from typing import Dict, Tuple, List, Any, Callable, Iterable, Set
 
 import numpy as np
 import torch
 import gym
 from gym import Env
-from gym.spaces import Box, Discrete
+from gym.spaces import Space, Box, Discrete
 from baselines import bench
 from baselines.common.running_mean_std import RunningMeanStd
 from baselines.common.vec_env import (
     ShmemVecEnv,
     DummyVecEnv,
+    VecEnv,
     VecEnvWrapper,
     VecNormalize,
 )
+from baselines.common.vec_env.vec_env import CloudpickleWrapper, clear_mpi_env_vars
+from baselines.common.vec_env.shmem_vec_env import _NP_TO_CT
+from baselines.common.vec_env.util import obs_space_info, obs_to_dict, dict_to_obs
+
+
+# Environment templates built with `build_env_template()`, mapping the key of each
+# template to the id of the process that built it and the template itself, and the keys
+# of the templates claimed by this process with `claim_env_template()`.
+ENV_TEMPLATES: Dict[Tuple[str, int, Tuple], Tuple[int, Env]] = {}
+CLAIMED_TEMPLATES: Set[Tuple[str, int, Tuple]] = set()
+
+# Environment pool used by `acquire_env()` and `release_env()`, mapping the arguments
+# of `get_env()` to idle vectorized environments, and the environments which are
+# currently borrowed from the pool, keyed by id.
+ENV_POOL: Dict[Tuple, List[VecEnv]] = {}
+BORROWED_ENVS: Dict[int, Tuple[Tuple, Env]] = {}
+
+# Statistics of each completed episode that are passed from environment processes
+# through shared memory, with their types. `success` is NaN for environments which
+# don't define success, and `time_limit_hit` is True when the episode was ended by
+# TimeLimitEnv.
+EPISODE_INFO_DTYPES = {
+    "episode_return": np.float64,
+    "episode_length": np.int64,
+    "success": np.float64,
+    "time_limit_hit": np.bool_,
+}
+EPISODE_INFO_CTYPES = {
+    np.float64: ctypes.c_double,
+    np.int64: ctypes.c_int64,
+    np.bool_: ctypes.c_bool,
+}
 
 
 def get_env(
@@ -25,17 +64,27 @@ def get_env(
     normalize_transition: bool = True,
     normalize_first_n: int = None,
     allow_early_resets: bool = False,
+    return_infos: bool = False,
+    envs_per_worker: int = 1,
+    task_assignment: str = None,
+    env_templates: bool = False,
+    batched: bool = False,
+    shared_obs: bool = False,
 ) -> Env:
     """
     Return environment object from environment name, with wrappers for added
-    functionality, such as multiprocessing and observation/reward normalization.
+    functionality, such as multiprocessing and observation/reward normalization. The
+    statistics of completed episodes (return, length, success, and whether the time
+    limit was hit) are available after each step through `env.episode_info`, and the
+    integer task index of each process (for multi-task benchmarks) through
+    `env.task_indices`.
 
     Parameters
     ----------
     env_name : str
         Name of environment to create.
     num_processes: int
-        Number of asynchronous copies of the environment to run simultaneously.
+        Number of copies of the environment to run simultaneously.
     seed : int
         Random seed for environment.
     time_limit : int
@@ -48,6 +97,42 @@ def get_env(
         ignored.
     allow_early_resets: bool
         Whether or not to allow environments before done=True is returned.
+    return_infos: bool
+        Whether or not `env.step()` should return the info dictionary of each process.
+        If False, an empty dictionary is returned for each process, which avoids
+        sending the info dictionaries between processes.
+    envs_per_worker: int
+        Number of copies of the environment run sequentially by each worker process
+        when `num_processes` > 1. Note that environments run by the same worker share
+        the global NumPy random state of that process.
+    task_assignment: str
+        For multi-task benchmarks (Meta-World or synthetic), either None,
+        "round_robin", or "contiguous". If None, each copy of the environment
+        constructs every task of the benchmark and samples a task at random on each
+        reset. Otherwise, each copy is pinned to a subset of the tasks (see
+        `get_task_assignment()`), constructs only those tasks, and rotates among them
+        on each reset.
+    env_templates: bool
+        Whether or not to construct each environment once in the current process as a
+        template (see `build_env_template()`), which is kept between calls until
+        `shutdown_env_pool()` and inherited by the worker processes, instead of
+        constructing the environment from scratch in each worker. Only used when
+        `num_processes` > 1. Since a
+        template can only be used by one environment in each process, the remaining
+        environments of a worker are constructed from scratch when
+        `envs_per_worker` > 1.
+    batched: bool
+        Whether or not to use the batched implementation of the environment (see
+        `BatchEnv`), which holds the state of all `num_processes` copies in arrays and
+        steps them together in the current process, in place of a multi-process
+        vectorized environment. Only supported for environments in `BATCH_ENVS`.
+    shared_obs: bool
+        Whether or not observations are returned as float32 tensors which are views of
+        the shared memory that the worker processes write observations into, instead
+        of copies (see ShmemInfoVecEnv), so that they are only copied once, into
+        rollout storage. These observations are only valid until the environment is
+        stepped or reset again. Only used when `num_processes` > 1 and
+        `normalize_transition` is False.
 
     Returns
     -------
@@ -55,33 +140,239 @@ def get_env(
         Environment object.
     """
 
+    # Assign tasks to each copy of the environment, if necessary.
+    process_task_ids = [None] * num_processes
+    if task_assignment is not None:
+        if env_name not in get_mt_benchmark_names():
+            raise NotImplementedError(
+                "Task assignment is only supported for multi-task benchmarks, not"
+                " '%s'." % env_name
+            )
+        process_task_ids = get_task_assignment(
+            get_num_tasks(env_name), num_processes, task_assignment
+        )
+
+    # Build environment templates for the worker processes to inherit, if necessary,
+    # and take the observation and action spaces from the template of the first
+    # process. The spaces of every template must match.
+    use_templates = env_templates and num_processes > 1 and not batched
+    spaces = None
+    if use_templates:
+        for task_ids in process_task_ids:
+            template = build_env_template(env_name, time_limit, task_ids)
+            template_spaces = (template.observation_space, template.action_space)
+            if spaces is None:
+                spaces = template_spaces
+            elif template_spaces != spaces:
+                raise ValueError(
+                    "Environment templates for tasks %s have spaces %s, which differ"
+                    " from the spaces %s of the first process."
+                    % (task_ids, template_spaces, spaces)
+                )
+
     # Create vectorized environment.
     env_creators = [
-        get_single_env_creator(env_name, seed + i, time_limit, allow_early_resets)
+        get_single_env_creator(
+            env_name,
+            seed + i,
+            time_limit,
+            allow_early_resets,
+            process_task_ids[i],
+            use_template=use_templates,
+        )
         for i in range(num_processes)
     ]
-    if num_processes > 1:
-        env = ShmemVecEnv(env_creators, context="fork")
+    if batched:
+        if env_name not in BATCH_ENVS:
+            raise NotImplementedError(
+                "No batched implementation of environment '%s'." % env_name
+            )
+        env = BatchInfoVecEnv(
+            BATCH_ENVS[env_name](num_processes),
+            time_limit=time_limit,
+            reward_threshold=REWARD_THRESHOLDS.get(env_name),
+            return_infos=return_infos,
+        )
+        env.reseed(seed)
+    elif num_processes > 1:
+        env = ShmemInfoVecEnv(
+            env_creators,
+            context="fork",
+            return_infos=return_infos,
+            envs_per_worker=envs_per_worker,
+            spaces=spaces,
+            shared_obs=shared_obs and not normalize_transition,
+        )
     elif num_processes == 1:
         # Use DummyVecEnv if num_processes is 1 to avoid multiprocessing overhead.
-        env = DummyVecEnv(env_creators)
+        env = DummyInfoVecEnv(env_creators, return_infos=return_infos)
     else:
         raise ValueError("Invalid num_processes value: %s" % num_processes)
 
-    # Add environment wrappers to normalize observations/rewards and convert between
-    # numpy arrays and torch.Tensors.
+    return wrap_vec_env(env, env_name, normalize_transition, normalize_first_n)
+
+
+def wrap_vec_env(
+    env: VecEnv,
+    env_name: str,
+    normalize_transition: bool = True,
+    normalize_first_n: int = None,
+) -> Env:
+    """
+    Add environment wrappers to a vectorized environment created by `get_env()` to
+    normalize observations/rewards and convert between numpy arrays and torch.Tensors.
+    """
+
     if normalize_transition:
         env = VecNormalizeEnv(env, first_n=normalize_first_n)
-    env = VecPyTorchEnv(env)
+    env = VecPyTorchEnv(env, num_tasks=get_num_tasks(env_name))
+
+    return env
+
+
+def acquire_env(
+    env_name: str,
+    num_processes: int = 1,
+    seed: int = 1,
+    time_limit: int = None,
+    normalize_transition: bool = True,
+    normalize_first_n: int = None,
+    allow_early_resets: bool = False,
+    return_infos: bool = False,
+    envs_per_worker: int = 1,
+    task_assignment: str = None,
+    env_templates: bool = False,
+    batched: bool = False,
+    shared_obs: bool = False,
+) -> Env:
+    """
+    Borrow an environment from the environment pool of this process, which must be
+    returned with `release_env()` instead of being closed. The arguments are the same
+    as those of `get_env()`. If the pool holds an environment created with the same
+    arguments (other than the seed and normalization settings) whose workers are still
+    alive, it is reseeded with `seed` and reused, so that the worker processes don't
+    have to be started again. Otherwise, a new environment is created with `get_env()`.
+    The normalization and conversion wrappers are always constructed anew, so that
+    normalization statistics aren't carried over. The returned environment should be
+    reset before it is used.
+    """
 
+    key = (
+        env_name,
+        num_processes,
+        time_limit,
+        allow_early_resets,
+        return_infos,
+        envs_per_worker,
+        task_assignment,
+        batched,
+        shared_obs and not normalize_transition,
+    )
+
+    # Find a pooled environment whose workers are still alive.
+    venv = None
+    pooled_envs = ENV_POOL.get(key, [])
+    while venv is None and len(pooled_envs) > 0:
+        venv = pooled_envs.pop()
+        if not all(proc.is_alive() for proc in getattr(venv, "procs", [])):
+            venv.close()
+            venv = None
+
+    if venv is not None:
+        venv.reseed(seed)
+        env = wrap_vec_env(venv, env_name, normalize_transition, normalize_first_n)
+    else:
+        env = get_env(
+            env_name,
+            num_processes,
+            seed,
+            time_limit,
+            normalize_transition,
+            normalize_first_n,
+            allow_early_resets,
+            return_infos,
+            envs_per_worker,
+            task_assignment,
+            env_templates,
+            batched,
+            shared_obs,
+        )
+
+    BORROWED_ENVS[id(env)] = (key, env)
     return env
 
 
+def release_env(env: Env) -> None:
+    """
+    Return an environment borrowed with `acquire_env()` to the environment pool, so
+    that it can be reused by a later call to `acquire_env()`. Environments created
+    with `allow_early_resets` = False are closed instead, since their episodes can't be
+    restarted by a reset before they are finished.
+    """
+
+    if id(env) not in BORROWED_ENVS:
+        raise ValueError("Environment %r wasn't borrowed from the pool." % env)
+    key, _ = BORROWED_ENVS.pop(id(env))
+
+    # Unwrap the vectorized environment created by `get_env()`.
+    venv = env
+    while not isinstance(venv, (ShmemInfoVecEnv, DummyInfoVecEnv, BatchInfoVecEnv)):
+        venv = venv.venv
+
+    allow_early_resets = key[3]
+    if allow_early_resets:
+        ENV_POOL.setdefault(key, []).append(venv)
+    else:
+        venv.close()
+
+
+def shutdown_env_pool(raise_on_leak: bool = True) -> None:
+    """
+    Close every environment in the environment pool, along with any environments which
+    were borrowed with `acquire_env()` but never returned, and discard every environment
+    template (see `build_env_template()`), closing those built by this process.
+    Borrowed environments which weren't returned are leaks, and a RuntimeError is
+    raised if there were any and `raise_on_leak` is True (otherwise a warning is
+    given). This is called when the process exits, but should be called explicitly once
+    the pool and templates are no longer needed.
+    """
+
+    for pid, template in ENV_TEMPLATES.values():
+        if pid == os.getpid():
+            template.close()
+    ENV_TEMPLATES.clear()
+    CLAIMED_TEMPLATES.clear()
+
+    for pooled_envs in ENV_POOL.values():
+        for venv in pooled_envs:
+            venv.close()
+    ENV_POOL.clear()
+
+    leaked = [key for key, _ in BORROWED_ENVS.values()]
+    for _, env in BORROWED_ENVS.values():
+        env.close()
+    BORROWED_ENVS.clear()
+
+    if len(leaked) > 0:
+        message = "%d environment(s) borrowed from the pool were never returned: %s" % (
+            len(leaked),
+            leaked,
+        )
+        if raise_on_leak:
+            raise RuntimeError(message)
+        warnings.warn(message)
+
+
+atexit.register(shutdown_env_pool, raise_on_leak=False)
+
+
 def get_single_env_creator(
     env_name: str,
     seed: int = 1,
     time_limit: int = None,
     allow_early_resets: bool = False,
+    task_ids: List[int] = None,
+    use_template: bool = False,
 ) -> Callable[..., Env]:
     """
     Return a function that returns environment object with given env name. Used to
@@ -98,6 +389,13 @@ def get_single_env_creator(
         Limit on number of steps for environment.
     allow_early_resets: bool
         Whether or not to allow environments before done=True is returned.
+    task_ids: List[int]
+        Indices of the tasks to construct, for Meta-World multi-task benchmarks. If
+        None, all tasks of the benchmark are constructed.
+    use_template: bool
+        Whether or not to use the environment template built with
+        `build_env_template()` for these arguments, if one was inherited from a parent
+        process, instead of constructing the environment from scratch.
 
     Returns
     -------
@@ -107,48 +405,11 @@ def get_single_env_creator(
 
     def env_creator() -> Env:
 
-        # Make environment object from either MetaWorld or Gym.
-        metaworld_env_names = get_metaworld_env_names()
-        metaworld_benchmark_names = get_metaworld_benchmark_names()
-        metaworld_ml_benchmark_names = get_metaworld_ml_benchmark_names()
-        if env_name in metaworld_env_names:
-
-            # We import here so that we avoid importing metaworld if possible, since it is
-            # dependent on mujoco.
-            from metaworld.benchmarks import ML1
-
-            env = ML1.get_train_tasks(env_name)
-            tasks = env.sample_tasks(1)
-            env.set_task(tasks[0])
-
-        elif env_name in metaworld_benchmark_names:
-
-            # Again, import here so that we avoid importing metaworld if possible.
-            from metaworld.benchmarks import MT10, MT50, ML10, ML45
-
-            if env_name == "MT10":
-                env = MT10.get_train_tasks()
-            elif env_name == "MT50":
-                env = MT50.get_train_tasks()
-            elif env_name == "ML10_train":
-                env = ML10.get_train_tasks()
-            elif env_name == "ML45_train":
-                env = ML45.get_train_tasks()
-            elif env_name == "ML10_test":
-                env = ML10.get_test_tasks()
-            elif env_name == "ML45_test":
-                env = ML45.get_test_tasks()
-            else:
-                raise NotImplementedError
-
-        elif env_name == "unique-env":
-            env = UniqueEnv()
-
-        elif env_name == "parity-env":
-            env = ParityEnv()
-
+        # Get environment object, either from an environment template or from scratch.
+        if use_template:
+            env = claim_env_template(env_name, time_limit, task_ids)
         else:
-            env = gym.make(env_name)
+            env = build_env(env_name, time_limit, task_ids)
 
         # Set environment seed. Note that we have to set np.random.seed here despite
         # having already set it in main.py, so that the seeds are different between
@@ -156,18 +417,6 @@ def get_single_env_creator(
         np.random.seed(seed)
         env.seed(seed)
 
-        # Add environment wrapper to reset at time limit.
-        if time_limit is not None:
-            env = TimeLimitEnv(env, time_limit)
-
-        # Add environment wrapper to change task when done for multi-task environments.
-        if env_name in metaworld_benchmark_names:
-            env = MultiTaskEnv(env)
-
-        # Add environment wrapper to append one-hot task vector to observation.
-        if env_name in metaworld_ml_benchmark_names:
-            env = MetaEnv(env, env_name)
-
         # Add environment wrapper to monitor rewards.
         env = bench.Monitor(env, None, allow_early_resets=allow_early_resets)
 
@@ -182,10 +431,221 @@ def get_single_env_creator(
     return env_creator
 
 
+def get_task_assignment(
+    num_tasks: int, num_processes: int, task_assignment: str
+) -> List[List[int]]:
+    """
+    Assign tasks to each of `num_processes` copies of a multi-task environment with
+    `num_tasks` tasks. Returns a list holding the task indices assigned to each copy.
+    With "round_robin" assignment, task i is assigned to copy i % num_processes, so
+    that each copy holds tasks spread over the whole benchmark. With "contiguous"
+    assignment, the tasks are split into contiguous blocks of nearly equal size, one
+    for each copy. If there are more copies than tasks, each copy is assigned a single
+    task, and each task is assigned to nearly the same number of copies: in order of
+    copies with "round_robin" assignment, and in contiguous blocks of copies with
+    "contiguous" assignment.
+    """
+
+    if task_assignment == "round_robin":
+        if num_processes <= num_tasks:
+            return [
+                list(range(process, num_tasks, num_processes))
+                for process in range(num_processes)
+            ]
+        return [[process % num_tasks] for process in range(num_processes)]
+
+    elif task_assignment == "contiguous":
+        if num_processes <= num_tasks:
+            return [
+                block.tolist()
+                for block in np.array_split(np.arange(num_tasks), num_processes)
+            ]
+        return [
+            [process * num_tasks // num_processes] for process in range(num_processes)
+        ]
+
+    else:
+        raise ValueError("Unsupported task assignment: %s" % task_assignment)
+
+
+def get_metaworld_task_subset(env_name: str, task_ids: List[int]) -> Env:
+    """
+    Construct a Meta-World multi-task environment holding only the tasks of benchmark
+    `env_name` with indices `task_ids`, mirroring the construction of the benchmark's
+    own environment for the remaining tasks.
+    """
+
+    # Import here so that we avoid importing metaworld if possible.
+    from metaworld.envs.mujoco.env_dict import (
+        EASY_MODE_CLS_DICT,
+        EASY_MODE_ARGS_KWARGS,
+        HARD_MODE_CLS_DICT as METAWORLD_HARD_MODE_CLS_DICT,
+        HARD_MODE_ARGS_KWARGS,
+    )
+    from metaworld.envs.mujoco.multitask_env import MultiClassMultiTaskEnv
+
+    if env_name == "MT10":
+        cls_dict = EASY_MODE_CLS_DICT
+        args_kwargs = EASY_MODE_ARGS_KWARGS
+    elif env_name == "MT50":
+        cls_dict = {
+            **METAWORLD_HARD_MODE_CLS_DICT["train"],
+            **METAWORLD_HARD_MODE_CLS_DICT["test"],
+        }
+        args_kwargs = {
+            **HARD_MODE_ARGS_KWARGS["train"],
+            **HARD_MODE_ARGS_KWARGS["test"],
+        }
+    else:
+        raise NotImplementedError
+
+    task_names = [list(cls_dict.keys())[task_id] for task_id in task_ids]
+    return MultiClassMultiTaskEnv(
+        task_env_cls_dict={name: cls_dict[name] for name in task_names},
+        task_args_kwargs={name: args_kwargs[name] for name in task_names},
+        sample_goals=False,
+        obs_type="plain",
+        sample_all=False,
+    )
+
+
+def build_env(env_name: str, time_limit: int = None, task_ids: List[int] = None) -> Env:
+    """
+    Construct an environment object from an environment name, along with the wrappers
+    which don't keep statistics of each episode, i.e. everything returned by
+    environment creators from `get_single_env_creator()` except for the monitoring
+    wrappers. The arguments are as in `get_single_env_creator()`.
+    """
+
+    # Make environment object from either MetaWorld or Gym.
+    metaworld_env_names = get_metaworld_env_names()
+    metaworld_benchmark_names = get_metaworld_benchmark_names()
+    metaworld_ml_benchmark_names = get_metaworld_ml_benchmark_names()
+    if env_name in metaworld_env_names:
+
+        # We import here so that we avoid importing metaworld if possible, since it is
+        # dependent on mujoco.
+        from metaworld.benchmarks import ML1
+
+        env = ML1.get_train_tasks(env_name)
+        tasks = env.sample_tasks(1)
+        env.set_task(tasks[0])
+
+    elif env_name in metaworld_benchmark_names and task_ids is not None:
+        env = get_metaworld_task_subset(env_name, task_ids)
+
+    elif env_name in metaworld_benchmark_names:
+
+        # Again, import here so that we avoid importing metaworld if possible.
+        from metaworld.benchmarks import MT10, MT50, ML10, ML45
+
+        if env_name == "MT10":
+            env = MT10.get_train_tasks()
+        elif env_name == "MT50":
+            env = MT50.get_train_tasks()
+        elif env_name == "ML10_train":
+            env = ML10.get_train_tasks()
+        elif env_name == "ML45_train":
+            env = ML45.get_train_tasks()
+        elif env_name == "ML10_test":
+            env = ML10.get_test_tasks()
+        elif env_name == "ML45_test":
+            env = ML45.get_test_tasks()
+        else:
+            raise NotImplementedError
+
+    elif env_name in SYNTHETIC_BENCHMARKS:
+        env = SyntheticMultiTaskEnv(task_ids=task_ids, **SYNTHETIC_BENCHMARKS[env_name])
+
+    elif env_name == "unique-env":
+        env = UniqueEnv()
+
+    elif env_name == "parity-env":
+        env = ParityEnv()
+
+    else:
+        env = gym.make(env_name)
+
+    # Add environment wrapper to reset at time limit.
+    if time_limit is not None:
+        env = TimeLimitEnv(env, time_limit)
+
+    # Add environment wrapper to change task when done for multi-task environments.
+    multi_task = (
+        env_name in metaworld_benchmark_names or env_name in SYNTHETIC_BENCHMARKS
+    )
+    if multi_task and task_ids is not None:
+        plain_obs_dim = SYNTHETIC_BENCHMARKS.get(env_name, {}).get("obs_dim", 9)
+        env = TaskPinnedEnv(env, task_ids, get_num_tasks(env_name), plain_obs_dim)
+    elif multi_task:
+        env = MultiTaskEnv(env)
+
+    # Add environment wrapper to append one-hot task vector to observation.
+    if env_name in metaworld_ml_benchmark_names:
+        env = MetaEnv(env, env_name)
+
+    return env
+
+
+def get_template_key(
+    env_name: str, time_limit: int = None, task_ids: List[int] = None
+) -> Tuple[str, int, Tuple]:
+    """
+    Return the key of the environment template for the given arguments of
+    `build_env()`, which is (env_name, time_limit, wrappers). `wrappers` holds the
+    settings of the wrappers added by `build_env()` beyond the time limit.
+    """
+
+    wrappers = (tuple(task_ids) if task_ids is not None else None,)
+    return (env_name, time_limit, wrappers)
+
+
+def build_env_template(
+    env_name: str, time_limit: int = None, task_ids: List[int] = None
+) -> Env:
+    """
+    Construct an environment template with `build_env()` in the current process, if
+    one doesn't already exist for the given arguments, and return it. Templates are
+    kept until `shutdown_env_pool()` is called, so that processes forked from this one
+    later (such as the workers of ShmemInfoVecEnv) inherit them copy-on-write, and can
+    claim them with `claim_env_template()` instead of constructing the environment from
+    scratch. The global NumPy random state is left unchanged.
+    """
+
+    key = get_template_key(env_name, time_limit, task_ids)
+    if key not in ENV_TEMPLATES:
+        random_state = np.random.get_state()
+        ENV_TEMPLATES[key] = (os.getpid(), build_env(env_name, time_limit, task_ids))
+        np.random.set_state(random_state)
+
+    return ENV_TEMPLATES[key][1]
+
+
+def claim_env_template(
+    env_name: str, time_limit: int = None, task_ids: List[int] = None
+) -> Env:
+    """
+    Return the environment template for the given arguments of `build_env()`, if it
+    was inherited from the process which built it and hasn't been claimed in this
+    process yet. Otherwise, construct a new environment with `build_env()`, since the
+    template is either missing or already in use.
+    """
+
+    key = get_template_key(env_name, time_limit, task_ids)
+    if key in ENV_TEMPLATES and key not in CLAIMED_TEMPLATES:
+        pid, template = ENV_TEMPLATES[key]
+        if pid != os.getpid():
+            CLAIMED_TEMPLATES.add(key)
+            return template
+
+    return build_env(env_name, time_limit, task_ids)
+
+
 def get_num_tasks(env_name: str) -> int:
     """
     Compute number of tasks to simultaneously handle. This will be 1 unless we are
-    training on a multi-task benchmark such as MetaWorld's MT10.
+    training on a multi-task benchmark such as MetaWorld's MT10 or a synthetic
+    multi-task benchmark.
     """
 
     num_tasks = 1
@@ -205,10 +665,676 @@ def get_num_tasks(env_name: str) -> int:
             num_tasks = 5
         else:
             raise NotImplementedError
+    elif env_name in SYNTHETIC_BENCHMARKS:
+        num_tasks = SYNTHETIC_BENCHMARKS[env_name]["num_tasks"]
 
     return num_tasks
 
 
+class ShmemInfoVecEnv(ShmemVecEnv):
+    """
+    Vectorized environment which runs copies of the environment in separate processes
+    and passes observations through shared memory, like ShmemVecEnv. Each process
+    (worker) can run a batch of `envs_per_worker` copies of the environment, stepping
+    them sequentially and returning the results for the whole batch at once, so that
+    each step only requires one round trip between processes per worker instead of one
+    per environment. The statistics of completed episodes are also written by each
+    worker into shared arrays, which are stored in `self.episode_info` as a dictionary
+    mapping each field of EPISODE_INFO_DTYPES to an array with one element per
+    environment. After each step, the elements for environments whose episode ended at
+    that step hold the statistics of that episode. Similarly, the index of the active
+    task of each environment (see `get_task_index()`) is written into a shared array
+    after each reset and step, which is stored in `self.task_index`. The info
+    dictionaries are only sent back from each worker when `return_infos` is True.
+
+    The workers can also be split into groups with `set_groups()`, each of which can be
+    stepped independently with `step_async_group()` and `step_wait_group()`, so that one
+    group of environments can step while the results of another are being processed.
+    Lastly, `step_async_envs()` and `step_wait_ready()` step the environments without
+    waiting for the slowest worker: each call of `step_wait_ready()` returns the results
+    of the first workers to finish their step, together with the indices of their
+    environments, and only those workers are sent new actions.
+
+    The observations of all environments are held in one contiguous shared array (for
+    each observation key), which the workers write into directly. If `shared_obs` is
+    True, floating point observations are stored as float32, and the observations
+    returned by `reset()` and `step_wait()` are views of the shared array instead of
+    copies. These are only valid until the environments are stepped or reset again, so
+    they must be copied before then.
+    """
+
+    def __init__(
+        self,
+        env_fns: List[Callable[..., Env]],
+        context: str = "fork",
+        return_infos: bool = False,
+        envs_per_worker: int = 1,
+        spaces: Tuple[Space, Space] = None,
+        shared_obs: bool = False,
+    ) -> None:
+        """
+        Init function for ShmemInfoVecEnv. This mirrors the init function of
+        ShmemVecEnv, except that we allocate the shared episode statistics and task
+        indices and launch
+        processes running `_info_worker()`, each with a batch of environments. If
+        `spaces` (the observation and action spaces) is None, a copy of the environment
+        is constructed to find them.
+        """
+
+        if envs_per_worker < 1:
+            raise ValueError("Invalid envs_per_worker value: %s" % envs_per_worker)
+
+        ctx = mp.get_context(context)
+        if spaces is None:
+            dummy = env_fns[0]()
+            spaces = (dummy.observation_space, dummy.action_space)
+            dummy.close()
+            del dummy
+        observation_space, action_space = spaces
+        VecEnv.__init__(self, len(env_fns), observation_space, action_space)
+        self.return_infos = return_infos
+        self.shared_obs = shared_obs
+
+        # Allocate shared memory for observations and episode statistics.
+        self.obs_keys, self.obs_shapes, self.obs_dtypes = obs_space_info(
+            observation_space
+        )
+        if shared_obs:
+            self.obs_dtypes = {
+                k: np.dtype(np.float32) if np.issubdtype(dtype, np.floating) else dtype
+                for k, dtype in self.obs_dtypes.items()
+            }
+        self.obs_bufs = {
+            k: ctx.RawArray(
+                _NP_TO_CT[self.obs_dtypes[k].type],
+                self.num_envs * int(np.prod(self.obs_shapes[k])),
+            )
+            for k in self.obs_keys
+        }
+        self.obs_arrays = get_obs_arrays(
+            self.obs_bufs, self.obs_shapes, self.obs_dtypes
+        )
+        self.episode_info_bufs = {
+            key: ctx.RawArray(EPISODE_INFO_CTYPES[dtype], self.num_envs)
+            for key, dtype in EPISODE_INFO_DTYPES.items()
+        }
+        self.episode_info = get_episode_info_arrays(self.episode_info_bufs)
+        self.task_index_buf = ctx.RawArray(ctypes.c_int64, self.num_envs)
+        self.task_index = np.frombuffer(self.task_index_buf, dtype=np.int64)
+
+        # Launch worker processes. `self.worker_envs[i]` holds the indices of the
+        # environments run by worker i.
+        self.worker_envs = [
+            list(range(start, min(start + envs_per_worker, self.num_envs)))
+            for start in range(0, self.num_envs, envs_per_worker)
+        ]
+        self.parent_pipes = []
+        self.procs = []
+        with clear_mpi_env_vars():
+            for env_indices in self.worker_envs:
+                parent_pipe, child_pipe = ctx.Pipe()
+                proc = ctx.Process(
+                    target=_info_worker,
+                    args=(
+                        child_pipe,
+                        parent_pipe,
+                        CloudpickleWrapper([env_fns[i] for i in env_indices]),
+                        self.obs_bufs,
+                        self.obs_shapes,
+                        self.obs_dtypes,
+                        self.obs_keys,
+                        self.episode_info_bufs,
+                        self.task_index_buf,
+                        env_indices,
+                        return_infos,
+                    ),
+                )
+                proc.daemon = True
+                self.procs.append(proc)
+                self.parent_pipes.append(parent_pipe)
+                proc.start()
+                child_pipe.close()
+        self.waiting_step = False
+        self.viewer = None
+        self.group_workers: List[List[int]] = []
+        self.group_slices: List[slice] = []
+        self.waiting_groups: List[int] = []
+        self.env_workers = np.array(
+            [worker for worker, envs in enumerate(self.worker_envs) for _ in envs]
+        )
+        self.waiting_workers: List[int] = []
+        self.ready_workers: List[int] = []
+
+    def reset(self) -> np.ndarray:
+        """ Reset all environments. """
+
+        self.wait_groups()
+        self.wait_workers()
+        if self.waiting_step:
+            self.step_wait()
+        for pipe in self.parent_pipes:
+            pipe.send(("reset", None))
+        for pipe in self.parent_pipes:
+            pipe.recv()
+        return self._decode_env_obses(slice(None), copy=not self.shared_obs)
+
+    def step_async(self, actions: np.ndarray) -> None:
+        """ Send the actions for each batch of environments to its worker. """
+
+        assert len(actions) == self.num_envs
+        for pipe, env_indices in zip(self.parent_pipes, self.worker_envs):
+            pipe.send(("step", actions[env_indices[0] : env_indices[-1] + 1]))
+        self.waiting_step = True
+
+    def step_wait(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict]]:
+        """ Wait for each worker to finish its step and collect results. """
+
+        rews, dones, infos = self._recv_steps(range(len(self.parent_pipes)))
+        self.waiting_step = False
+        obs = self._decode_env_obses(slice(None), copy=not self.shared_obs)
+        return obs, rews, dones, infos
+
+    def get_images(self, mode: str = "human") -> List[np.ndarray]:
+        """ Render each environment. """
+
+        for pipe in self.parent_pipes:
+            pipe.send(("render", None))
+        return [image for pipe in self.parent_pipes for image in pipe.recv()]
+
+    def reseed(self, seed: int) -> None:
+        """
+        Seed each environment as it was seeded at construction by the environment
+        creators of `get_env()` with seed `seed`, after waiting for any steps in
+        progress. The environments should be reset afterwards.
+        """
+
+        self.wait_groups()
+        self.wait_workers()
+        if self.waiting_step:
+            self.step_wait()
+        for pipe, env_indices in zip(self.parent_pipes, self.worker_envs):
+            pipe.send(("seed", [seed + i for i in env_indices]))
+        for pipe in self.parent_pipes:
+            pipe.recv()
+
+    def close_extras(self) -> None:
+        """ Wait for any stepping groups, then shut down the workers. """
+
+        self.wait_groups()
+        self.wait_workers()
+        super(ShmemInfoVecEnv, self).close_extras()
+
+    def set_groups(self, num_groups: int) -> List[slice]:
+        """
+        Split the workers into `num_groups` groups of consecutive workers, which can
+        then be stepped independently. Returns the slice of environment indices covered
+        by each group.
+        """
+
+        num_workers = len(self.parent_pipes)
+        if not 1 <= num_groups <= num_workers:
+            raise ValueError(
+                "The number of groups (%d) is required to be between 1 and the number"
+                " of workers (%d)." % (num_groups, num_workers)
+            )
+        self.wait_groups()
+
+        self.group_workers = [
+            list(workers)
+            for workers in np.array_split(np.arange(num_workers), num_groups)
+        ]
+        self.group_slices = [
+            slice(
+                self.worker_envs[workers[0]][0], self.worker_envs[workers[-1]][-1] + 1
+            )
+            for workers in self.group_workers
+        ]
+        return list(self.group_slices)
+
+    def step_async_group(self, actions: np.ndarray, group: int) -> None:
+        """
+        Send actions to the workers of group `group`, where `actions` holds one action
+        for each environment in the group.
+        """
+
+        assert group not in self.waiting_groups
+        start = self.group_slices[group].start
+        assert len(actions) == self.group_slices[group].stop - start
+        for worker in self.group_workers[group]:
+            env_indices = self.worker_envs[worker]
+            first = env_indices[0] - start
+            worker_actions = actions[first : first + len(env_indices)]
+            self.parent_pipes[worker].send(("step", worker_actions))
+        self.waiting_groups.append(group)
+
+    def step_wait_group(
+        self, group: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict]]:
+        """
+        Wait for the workers of group `group` to finish their step, and return results
+        for the environments in the group.
+        """
+
+        rews, dones, infos = self._recv_steps(self.group_workers[group])
+        self.waiting_groups.remove(group)
+        env_slice = self.group_slices[group]
+        obs = self._decode_env_obses(env_slice)
+        return obs, rews, dones, infos
+
+    def wait_groups(self) -> None:
+        """ Wait for any groups that are still stepping, discarding their results. """
+
+        for group in list(self.waiting_groups):
+            self.step_wait_group(group)
+
+    def step_async_envs(self, actions: np.ndarray, env_ids: np.ndarray) -> None:
+        """
+        Send actions to the environments with indices `env_ids`, where `actions[i]` is
+        the action for environment `env_ids[i]`. Since each worker steps all of its
+        environments at once, `env_ids` must contain every environment of each worker
+        that it touches, in order, and none of these workers can be stepping already.
+        """
+
+        env_ids = np.asarray(env_ids)
+        assert len(actions) == len(env_ids)
+        pos = 0
+        while pos < len(env_ids):
+            worker = self.env_workers[env_ids[pos]]
+            env_indices = self.worker_envs[worker]
+            end = pos + len(env_indices)
+            if list(env_ids[pos:end]) != env_indices:
+                raise ValueError(
+                    "Environments must be stepped together with the other environments"
+                    " of their worker (%s)." % env_indices
+                )
+            assert worker not in self.waiting_workers
+            self.parent_pipes[worker].send(("step", actions[pos:end]))
+            self.waiting_workers.append(worker)
+            pos = end
+
+    def step_wait_ready(
+        self, num_workers: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict], np.ndarray]:
+        """
+        Wait until `num_workers` of the workers stepped by `step_async_envs()` have
+        finished their step (or all of them, if fewer are stepping), and return the
+        results for the environments of these workers along with the environment
+        indices. Workers are returned in the order that they are found to be finished,
+        so that a worker isn't passed over in favor of workers which finished later.
+        Which workers are returned therefore depends on timing.
+        """
+
+        num_workers = min(num_workers, len(self.waiting_workers))
+        while len(self.ready_workers) < num_workers:
+            pending = [
+                worker
+                for worker in self.waiting_workers
+                if worker not in self.ready_workers
+            ]
+            ready_pipes = wait([self.parent_pipes[worker] for worker in pending])
+            self.ready_workers += [
+                worker for worker in pending if self.parent_pipes[worker] in ready_pipes
+            ]
+
+        workers = self.ready_workers[:num_workers]
+        self.ready_workers = self.ready_workers[num_workers:]
+        for worker in workers:
+            self.waiting_workers.remove(worker)
+        rews, dones, infos = self._recv_steps(workers)
+        env_ids = np.array(
+            [env for worker in workers for env in self.worker_envs[worker]], dtype=int
+        )
+        obs = self._decode_env_obses(env_ids)
+        return obs, rews, dones, infos, env_ids
+
+    def get_worker_envs(self, env_ids: np.ndarray) -> np.ndarray:
+        """
+        Return the indices of all environments of the workers which step the
+        environments with indices `env_ids`, in the order expected by
+        `step_async_envs()`.
+        """
+
+        workers = sorted(set(self.env_workers[env_id] for env_id in env_ids))
+        return np.array(
+            [env for worker in workers for env in self.worker_envs[worker]], dtype=int
+        )
+
+    def wait_workers(self) -> None:
+        """ Wait for any workers that are still stepping, discarding their results. """
+
+        if len(self.waiting_workers) > 0:
+            self.step_wait_ready(len(self.waiting_workers))
+
+    def _recv_steps(
+        self, workers: Iterable[int]
+    ) -> Tuple[np.ndarray, np.ndarray, List[Dict]]:
+        """ Receive the rewards, dones, and infos of a step from each worker. """
+
+        rews = []
+        dones = []
+        infos = []
+        for worker in workers:
+            worker_rews, worker_dones, worker_infos = self.parent_pipes[worker].recv()
+            rews += worker_rews
+            dones += worker_dones
+            if self.return_infos:
+                infos += worker_infos
+        if not self.return_infos:
+            infos = [{} for _ in range(len(dones))]
+        return np.array(rews), np.array(dones), infos
+
+    def _decode_env_obses(self, env_ids: Any, copy: bool = True) -> np.ndarray:
+        """
+        Decode the observations of the environments with indices `env_ids`, either a
+        slice or an array of indices. If `copy` is False and `env_ids` is a slice, the
+        observations are a view of the shared array instead of a copy.
+        """
+
+        result = {}
+        for k in self.obs_keys:
+            result[k] = self.obs_arrays[k][env_ids]
+            if isinstance(env_ids, slice) and copy:
+                result[k] = result[k].copy()
+        return dict_to_obs(result)
+
+
+def _info_worker(
+    pipe: Connection,
+    parent_pipe: Connection,
+    env_fns_wrapper: CloudpickleWrapper,
+    obs_bufs: Dict[Any, Any],
+    obs_shapes: Dict[Any, Tuple[int, ...]],
+    obs_dtypes: Dict[Any, np.dtype],
+    keys: List[Any],
+    episode_info_bufs: Dict[str, Any],
+    task_index_buf: Any,
+    env_indices: List[int],
+    return_infos: bool,
+) -> None:
+    """
+    Function run by each worker of ShmemInfoVecEnv. Handles the same commands as the
+    worker of ShmemVecEnv, but for a batch of environments which are stepped
+    sequentially. Observations, the index of the active task, and the statistics of
+    each completed episode are written into the shared arrays at the index of the
+    corresponding environment, and the info dictionaries are only sent through `pipe`
+    if `return_infos` is True.
+    """
+
+    def write_obs(env_pos: int, maybe_dict_obs: Any) -> None:
+        flatdict = obs_to_dict(maybe_dict_obs)
+        for k in keys:
+            np.copyto(obs_arrays[k][env_indices[env_pos]], flatdict[k])
+        task_index[env_indices[env_pos]] = get_task_index(envs[env_pos])
+
+    envs = [env_fn() for env_fn in env_fns_wrapper.x]
+    obs_arrays = get_obs_arrays(obs_bufs, obs_shapes, obs_dtypes)
+    episode_info = get_episode_info_arrays(episode_info_bufs)
+    task_index = np.frombuffer(task_index_buf, dtype=np.int64)
+    parent_pipe.close()
+    try:
+        while True:
+            cmd, data = pipe.recv()
+            if cmd == "reset":
+                for env_pos, env in enumerate(envs):
+                    write_obs(env_pos, env.reset())
+                pipe.send(None)
+            elif cmd == "step":
+                rews = []
+                dones = []
+                infos = []
+                for env_pos, (env, action) in enumerate(zip(envs, data)):
+                    obs, reward, done, info = env.step(action)
+                    if done:
+                        write_episode_info(episode_info, env_indices[env_pos], info)
+                        obs = env.reset()
+                    write_obs(env_pos, obs)
+                    rews.append(reward)
+                    dones.append(done)
+                    infos.append(info)
+                pipe.send((rews, dones, infos if return_infos else None))
+            elif cmd == "render":
+                pipe.send([env.render(mode="rgb_array") for env in envs])
+            elif cmd == "seed":
+                for env, seed in zip(envs, data):
+                    np.random.seed(seed)
+                    env.seed(seed)
+                pipe.send(None)
+            elif cmd == "close":
+                pipe.send(None)
+                break
+            else:
+                raise RuntimeError("Got unrecognized cmd %s" % cmd)
+    except KeyboardInterrupt:
+        print("ShmemInfoVecEnv worker: got KeyboardInterrupt")
+    finally:
+        for env in envs:
+            env.close()
+
+
+class DummyInfoVecEnv(DummyVecEnv):
+    """
+    Vectorized environment which runs each copy of the environment sequentially in the
+    current process, like DummyVecEnv, and which stores the statistics of completed
+    episodes in `self.episode_info` and the index of the active task of each
+    environment in `self.task_index`, in the same format as ShmemInfoVecEnv.
+    """
+
+    def __init__(
+        self, env_fns: List[Callable[..., Env]], return_infos: bool = False
+    ) -> None:
+        """ Init function for DummyInfoVecEnv. """
+
+        super(DummyInfoVecEnv, self).__init__(env_fns)
+        self.return_infos = return_infos
+        self.episode_info = {
+            key: np.zeros(self.num_envs, dtype=dtype)
+            for key, dtype in EPISODE_INFO_DTYPES.items()
+        }
+        self.task_index = np.zeros(self.num_envs, dtype=np.int64)
+
+    def reset(self) -> np.ndarray:
+        """ Reset each environment and record the index of its active task. """
+
+        obs = super(DummyInfoVecEnv, self).reset()
+        for index, env in enumerate(self.envs):
+            self.task_index[index] = get_task_index(env)
+        return obs
+
+    def step_wait(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict]]:
+        """
+        Step each environment and record statistics of completed episodes and the
+        index of the active task of each environment.
+        """
+
+        obs, rews, dones, infos = super(DummyInfoVecEnv, self).step_wait()
+        for index in np.nonzero(dones)[0]:
+            write_episode_info(self.episode_info, index, infos[index])
+        for index, env in enumerate(self.envs):
+            self.task_index[index] = get_task_index(env)
+        if not self.return_infos:
+            infos = [{} for _ in range(self.num_envs)]
+        return obs, rews, dones, infos
+
+    def reseed(self, seed: int) -> None:
+        """
+        Seed each environment as it was seeded at construction by the environment
+        creators of `get_env()` with seed `seed`. The environments should be reset
+        afterwards.
+        """
+
+        for i, env in enumerate(self.envs):
+            np.random.seed(seed + i)
+            env.seed(seed + i)
+
+
+class BatchInfoVecEnv(VecEnv):
+    """
+    Vectorized environment which runs a batched environment (see BatchEnv) in the
+    current process, so that all copies of the environment are stepped at once with
+    array operations instead of one at a time. Copies are reset automatically when
+    done, and the statistics of completed episodes are stored in `self.episode_info`
+    in the same format as ShmemInfoVecEnv. Batched environments are single-task, so the
+    task index of every copy in `self.task_index` is always zero. The time limit,
+    episode statistics, and
+    success of each episode are computed here with array operations, with the same
+    values as the wrappers added by `build_env()` and `get_single_env_creator()`.
+    """
+
+    def __init__(
+        self,
+        batch_env: "BatchEnv",
+        time_limit: int = None,
+        reward_threshold: float = None,
+        return_infos: bool = False,
+    ) -> None:
+        """ Init function for BatchInfoVecEnv. """
+
+        super(BatchInfoVecEnv, self).__init__(
+            batch_env.num_envs, batch_env.observation_space, batch_env.action_space
+        )
+        self.batch_env = batch_env
+        self.time_limit = time_limit
+        self.reward_threshold = reward_threshold
+        self.return_infos = return_infos
+        self.actions = None
+
+        self.episode_info = {
+            key: np.zeros(self.num_envs, dtype=dtype)
+            for key, dtype in EPISODE_INFO_DTYPES.items()
+        }
+        self.episode_returns = np.zeros(self.num_envs, dtype=np.float64)
+        self.episode_lengths = np.zeros(self.num_envs, dtype=np.int64)
+        self.task_index = np.zeros(self.num_envs, dtype=np.int64)
+
+    def reset(self) -> np.ndarray:
+        """ Reset every copy of the environment. """
+
+        self.episode_returns[:] = 0
+        self.episode_lengths[:] = 0
+        return self.batch_env.reset()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        """ Asynchronous portion of step. """
+
+        self.actions = actions
+
+    def step_wait(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Dict]]:
+        """
+        Step each copy of the environment, record statistics of completed episodes,
+        and reset the copies which are done.
+        """
+
+        obs, rews, dones = self.batch_env.step(self.actions)
+        self.actions = None
+        self.episode_returns += rews
+        self.episode_lengths += 1
+
+        # End episodes which hit the time limit.
+        time_limit_hits = np.zeros(self.num_envs, dtype=bool)
+        if self.time_limit is not None:
+            time_limit_hits = self.episode_lengths >= self.time_limit
+            dones = dones | time_limit_hits
+
+        # Record statistics of completed episodes. Returns are rounded as in
+        # bench.Monitor.
+        done_ids = np.nonzero(dones)[0]
+        returns = np.round(self.episode_returns[done_ids], 6)
+        if self.reward_threshold is not None:
+            successes = (returns >= self.reward_threshold).astype(np.float64)
+        else:
+            successes = np.full(len(done_ids), np.nan)
+        self.episode_info["episode_return"][done_ids] = returns
+        self.episode_info["episode_length"][done_ids] = self.episode_lengths[done_ids]
+        self.episode_info["success"][done_ids] = successes
+        self.episode_info["time_limit_hit"][done_ids] = time_limit_hits[done_ids]
+
+        # Construct info dictionaries, if necessary.
+        infos = [{} for _ in range(self.num_envs)]
+        if self.return_infos:
+            for i, env_id in enumerate(done_ids):
+                infos[env_id]["episode"] = {
+                    "r": returns[i],
+                    "l": self.episode_lengths[env_id],
+                }
+                if time_limit_hits[env_id]:
+                    infos[env_id]["time_limit_hit"] = True
+            if self.reward_threshold is not None:
+                for info in infos:
+                    info["success"] = 0.0
+                for i, env_id in enumerate(done_ids):
+                    infos[env_id]["success"] = successes[i]
+
+        # Reset copies which are done.
+        if len(done_ids) > 0:
+            obs[done_ids] = self.batch_env.reset_envs(done_ids)
+            self.episode_returns[done_ids] = 0
+            self.episode_lengths[done_ids] = 0
+
+        return obs, rews, dones, infos
+
+    def reseed(self, seed: int) -> None:
+        """
+        Seed the batched environment with `seed`. Note that this is a single seed for
+        every copy, so the random streams differ from those of the copies of a
+        non-batched environment. The environment should be reset afterwards.
+        """
+
+        self.batch_env.seed(seed)
+
+
+def get_obs_arrays(
+    obs_bufs: Dict[Any, Any],
+    obs_shapes: Dict[Any, Tuple[int, ...]],
+    obs_dtypes: Dict[Any, np.dtype],
+) -> Dict[Any, np.ndarray]:
+    """
+    Construct NumPy views of shared arrays holding the observations of every
+    environment, with the environment index as the first dimension.
+    """
+
+    return {
+        k: np.frombuffer(buf, dtype=obs_dtypes[k]).reshape(-1, *obs_shapes[k])
+        for k, buf in obs_bufs.items()
+    }
+
+
+def get_episode_info_arrays(episode_info_bufs: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """ Construct NumPy views of shared arrays holding episode statistics. """
+
+    return {
+        key: np.frombuffer(buf, dtype=EPISODE_INFO_DTYPES[key])
+        for key, buf in episode_info_bufs.items()
+    }
+
+
+def write_episode_info(
+    episode_info: Dict[str, np.ndarray], index: int, info: Dict[str, Any]
+) -> None:
+    """
+    Write the statistics of a completed episode into position `index` of the arrays in
+    `episode_info`, given the info dictionary returned by the last step of the episode.
+    The episode return is NaN if the environment isn't wrapped in a bench.Monitor.
+    """
+
+    episode = info.get("episode", {})
+    episode_info["episode_return"][index] = episode.get("r", np.nan)
+    episode_info["episode_length"][index] = episode.get("l", 0)
+    episode_info["success"][index] = info.get("success", np.nan)
+    episode_info["time_limit_hit"][index] = info.get("time_limit_hit", False)
+
+
+def get_task_index(env: Env) -> int:
+    """
+    Return the index of the active task of an environment in its full multi-task
+    benchmark, i.e. the position of the set bit of the one-hot task vector at the end
+    of its observations. This is the `task_index` attribute of the outermost wrapper
+    which defines it (see MultiTaskEnv, TaskPinnedEnv, MetaEnv, and
+    SyntheticMultiTaskEnv), and zero for single-task environments.
+    """
+
+    return getattr(env, "task_index", 0)
+
+
 class VecNormalizeEnv(VecNormalize):
     """
     Environment wrapper to normalize observations and rewards. We modify VecNormalize
@@ -287,13 +1413,32 @@ class VecNormalizeEnv(VecNormalize):
 class VecPyTorchEnv(VecEnvWrapper):
     """
     Environment wrapper to convert observations, actions and rewards to torch.Tensors,
-    given a vectorized environment.
+    given a vectorized environment. For multi-task environments, the wrapper also
+    converts the integer task index of each process, which is written by the wrapped
+    environment into its `task_index` array on each step, so that the task indices
+    never have to be recovered from the one-hot task vectors of the observations. These
+    are stored in `self.task_indices`, which holds the task indices corresponding to
+    the most recent observations returned from `reset()` or `step()`, and is None for
+    single-task environments. Groups of environments can also be stepped
+    independently with `step_async_group()` and `step_wait_group()`, or without waiting
+    for the slowest worker with `step_async_envs()` and `step_wait_ready()`, if the
+    wrapped environment is a ShmemInfoVecEnv. Float32 observations are converted
+    without a copy, so observations which are views of shared memory (see
+    ShmemInfoVecEnv) stay views.
     """
 
+    def __init__(self, venv: Env, num_tasks: int = 1) -> None:
+        """ Init function for VecPyTorchEnv. """
+
+        super(VecPyTorchEnv, self).__init__(venv)
+        self.num_tasks = num_tasks
+        self.task_indices = None
+
     def reset(self) -> torch.Tensor:
         """ Environment reset function. """
 
         obs = self.venv.reset()
+        self.update_task_indices()
         obs = torch.from_numpy(obs).float()
         return obs
 
@@ -307,10 +1452,110 @@ class VecPyTorchEnv(VecEnvWrapper):
         """ Synchronous portion of step. """
 
         obs, reward, done, info = self.venv.step_wait()
+        self.update_task_indices()
+        obs = torch.from_numpy(obs).float()
+        reward = torch.Tensor(reward).float().unsqueeze(-1)
+        return obs, reward, done, info
+
+    def set_groups(self, num_groups: int) -> List[slice]:
+        """
+        Split the environments into groups which can be stepped independently, and
+        return the slice of environment indices covered by each group.
+        """
+
+        self.check_partial_steps()
+        return self.venv.set_groups(num_groups)
+
+    def step_async_group(self, actions: torch.Tensor, group: int) -> None:
+        """ Asynchronous portion of step for a group of environments. """
+
+        actions = actions.cpu().numpy()
+        self.venv.step_async_group(actions, group)
+
+    def step_wait_group(
+        self, group: int
+    ) -> Tuple[torch.Tensor, torch.Tensor, bool, Dict[str, Any]]:
+        """
+        Synchronous portion of step for a group of environments. Only the task indices
+        of the environments in the group are updated in `self.task_indices`.
+        """
+
+        obs, reward, done, info = self.venv.step_wait_group(group)
+        self.update_task_indices(self.venv.group_slices[group])
         obs = torch.from_numpy(obs).float()
         reward = torch.Tensor(reward).float().unsqueeze(-1)
         return obs, reward, done, info
 
+    def step_async_envs(self, actions: torch.Tensor, env_ids: np.ndarray) -> None:
+        """
+        Asynchronous portion of step for the environments with indices `env_ids`. See
+        `ShmemInfoVecEnv.step_async_envs()`.
+        """
+
+        self.check_partial_steps()
+        actions = actions.cpu().numpy()
+        self.venv.step_async_envs(actions, env_ids)
+
+    def step_wait_ready(
+        self, num_workers: int
+    ) -> Tuple[torch.Tensor, torch.Tensor, bool, Dict[str, Any], np.ndarray]:
+        """
+        Synchronous portion of step for the first `num_workers` workers to finish. See
+        `ShmemInfoVecEnv.step_wait_ready()`. Only the task indices of the returned
+        environments are updated in `self.task_indices`.
+        """
+
+        obs, reward, done, info, env_ids = self.venv.step_wait_ready(num_workers)
+        self.update_task_indices(env_ids)
+        obs = torch.from_numpy(obs).float()
+        reward = torch.Tensor(reward).float().unsqueeze(-1)
+        return obs, reward, done, info, env_ids
+
+    def get_worker_envs(self, env_ids: np.ndarray) -> np.ndarray:
+        """
+        Return the indices of all environments of the workers which step the
+        environments with indices `env_ids`. See `ShmemInfoVecEnv.get_worker_envs()`.
+        """
+
+        self.check_partial_steps()
+        return self.venv.get_worker_envs(env_ids)
+
+    def supports_partial_steps(self) -> bool:
+        """
+        Whether or not the wrapped environment supports stepping a subset of
+        environments. This isn't supported when transitions are normalized (by
+        VecNormalizeEnv), since normalization statistics are computed over all
+        environments at once.
+        """
+
+        return isinstance(self.venv, ShmemInfoVecEnv)
+
+    def check_partial_steps(self) -> None:
+        """
+        Check that the wrapped environment supports stepping a subset of environments.
+        See `supports_partial_steps()`.
+        """
+
+        if not self.supports_partial_steps():
+            raise NotImplementedError(
+                "Stepping a subset of environments is only supported for multi-process"
+                " environments without transition normalization."
+            )
+
+    def update_task_indices(self, env_ids: Any = None) -> None:
+        """
+        Copy the task indices of the environments with indices `env_ids` (either a
+        slice or an array of indices, or None for every environment) from the wrapped
+        environment, if necessary.
+        """
+
+        if self.num_tasks == 1:
+            return
+        if env_ids is None:
+            self.task_indices = torch.from_numpy(np.array(self.venv.task_index))
+        else:
+            self.task_indices[env_ids] = torch.from_numpy(self.venv.task_index[env_ids])
+
 
 class TimeLimitEnv(gym.Wrapper):
     """ Environment wrapper to reset environment when it hits time limit. """
@@ -353,6 +1598,84 @@ class MultiTaskEnv(gym.Wrapper):
         self.set_task(new_task)
         return self.env.reset(**kwargs)
 
+    @property
+    def task_index(self) -> int:
+        """ Index of the active task. """
+
+        return self.env.active_task
+
+
+class TaskPinnedEnv(gym.Wrapper):
+    """
+    Environment wrapper for a multi-task environment which only holds a subset of the
+    tasks of a benchmark (see `get_metaworld_task_subset()` and
+    SyntheticMultiTaskEnv). The wrapper rotates through the tasks on each reset, and
+    appends to each observation the one-hot vector of the task's index in the full
+    benchmark, so that observations have the same format as those of the full
+    benchmark. The first `plain_obs_dim` dimensions of each observation are kept.
+    """
+
+    def __init__(
+        self, env: Env, task_ids: List[int], num_tasks: int, plain_obs_dim: int = 9
+    ) -> None:
+        """ Init function for environment wrapper. """
+
+        super().__init__(env)
+        self.task_ids = list(task_ids)
+        self.num_tasks = num_tasks
+        self.task_pos = -1
+
+        # Task passed to `set_task()` on each reset, of which only the index of the
+        # task is changed. A task is sampled once here only for its format, so that
+        # resets don't consume random numbers of the wrapped environment.
+        self.task = dict(self.sample_tasks(1)[0])
+
+        # Plain Meta-World observations are padded to 9 dimensions, as in the
+        # observations of the full benchmark.
+        self.plain_obs_dim = plain_obs_dim
+        obs_dim = self.plain_obs_dim + self.num_tasks
+        self.observation_space = Box(low=-np.inf, high=np.inf, shape=(obs_dim,))
+
+    def seed(self, seed: int = None) -> Any:
+        """ Seed function for environment wrapper, which restarts the task rotation. """
+
+        self.task_pos = -1
+        return self.env.seed(seed)
+
+    def reset(self, **kwargs: Dict[str, Any]) -> Any:
+        """ Reset function for environment wrapper. """
+
+        # Move to the next assigned task.
+        self.task_pos = (self.task_pos + 1) % len(self.task_ids)
+        self.task["task"] = self.task_pos
+        self.set_task(self.task)
+
+        obs = self.env.reset(**kwargs)
+        return self.augment_with_task(obs)
+
+    def step(self, action: Any) -> Any:
+        """ Step function for environment wrapper. """
+
+        observation, reward, done, info = self.env.step(action)
+        return self.augment_with_task(observation), reward, done, info
+
+    def augment_with_task(self, obs: Any) -> Any:
+        """ Augment an observation with the one-hot index of the current task. """
+
+        assert len(obs.shape) == 1
+        obs_len = min(obs.shape[0], self.plain_obs_dim)
+        new_obs = np.zeros(self.plain_obs_dim + self.num_tasks)
+        new_obs[:obs_len] = obs[:obs_len]
+        new_obs[self.plain_obs_dim + self.task_index] = 1.0
+
+        return new_obs
+
+    @property
+    def task_index(self) -> int:
+        """ Index of the current task in the full benchmark. """
+
+        return self.task_ids[self.task_pos]
+
 
 class MetaEnv(gym.Wrapper):
     """
@@ -404,13 +1727,21 @@ class MetaEnv(gym.Wrapper):
         """ Augment an observation with the one-hot task index. """
 
         assert len(obs.shape) == 1
-        effective_task_index = self.effective_task_index[self.env.active_task]
-        one_hot = np.zeros(self.env.num_tasks)
-        one_hot[effective_task_index] = 1.0
-        new_obs = np.concatenate([obs, one_hot])
+
+        # Write the observation and one-hot task vector into a single new array.
+        obs_len = obs.shape[0]
+        new_obs = np.zeros(obs_len + self.env.num_tasks)
+        new_obs[:obs_len] = obs
+        new_obs[obs_len + self.task_index] = 1.0
 
         return new_obs
 
+    @property
+    def task_index(self) -> int:
+        """ Index of the active task out of the effective tasks. """
+
+        return self.effective_task_index[self.env.active_task]
+
 
 class SuccessEnv(gym.Wrapper):
     """
@@ -449,6 +1780,41 @@ def get_metaworld_mt_benchmark_names() -> List[str]:
     return ["MT10", "MT50"]
 
 
+def get_mt_benchmark_names() -> List[str]:
+    """
+    Returns a list of multi-task benchmark names, including Metaworld multi-task
+    benchmarks and registered synthetic multi-task benchmarks.
+    """
+
+    return get_metaworld_mt_benchmark_names() + list(SYNTHETIC_BENCHMARKS.keys())
+
+
+def register_synthetic_benchmark(
+    env_name: str,
+    num_tasks: int,
+    obs_dim: int = 9,
+    action_dim: int = 4,
+    compute_cost: int = 0,
+    conflict: float = 1.0,
+    max_path_length: int = 150,
+) -> None:
+    """
+    Register a synthetic multi-task benchmark under the name `env_name`, so that it can
+    be used like a Meta-World multi-task benchmark. See SyntheticMultiTaskEnv for a
+    description of the arguments. Benchmarks must be registered before the
+    environment is created, so that they are inherited by the worker processes.
+    """
+
+    SYNTHETIC_BENCHMARKS[env_name] = {
+        "num_tasks": num_tasks,
+        "obs_dim": obs_dim,
+        "action_dim": action_dim,
+        "compute_cost": compute_cost,
+        "conflict": conflict,
+        "max_path_length": max_path_length,
+    }
+
+
 def get_metaworld_ml_benchmark_names() -> List[str]:
     """ Returns a list of Metaworld meta-learning benchmark names. """
 
@@ -529,6 +1895,255 @@ class UniqueEnv(Env):
         return np.array(obs), reward, done, info
 
 
+class BatchEnv:
+    """
+    Base class for batched environments, which hold the state of `num_envs` copies of
+    an environment in arrays and step every copy at once with array operations.
+    Unlike a vectorized environment, a batched environment doesn't reset copies which
+    are done, doesn't enforce a time limit, and doesn't return info dictionaries. Use
+    `get_env()` with `batched=True` to wrap a batched environment in BatchInfoVecEnv,
+    which provides these along with the interface of the other vectorized environments.
+    """
+
+    def __init__(
+        self, num_envs: int, observation_space: Space, action_space: Space
+    ) -> None:
+        """ Init function for BatchEnv. """
+
+        self.num_envs = num_envs
+        self.observation_space = observation_space
+        self.action_space = action_space
+        self.np_random = np.random.RandomState()
+
+    def seed(self, seed: int = None) -> None:
+        """ Seed the random state shared by every copy of the environment. """
+
+        self.np_random.seed(seed)
+
+    def reset(self) -> np.ndarray:
+        """ Reset every copy of the environment and return their observations. """
+
+        return self.reset_envs(np.arange(self.num_envs))
+
+    def reset_envs(self, env_ids: np.ndarray) -> np.ndarray:
+        """
+        Reset the copies of the environment with indices `env_ids` and return their
+        observations.
+        """
+
+        raise NotImplementedError
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Step every copy of the environment. Returns arrays holding the observation,
+        reward, and done of each copy.
+        """
+
+        raise NotImplementedError
+
+
+class BatchParityEnv(BatchEnv):
+    """
+    Batched implementation of ParityEnv. The observation space is a Box holding the
+    one-hot state vector, since observations of ParityEnv are one-hot vectors despite
+    its Discrete observation space.
+    """
+
+    def __init__(self, num_envs: int) -> None:
+        """ Init function for BatchParityEnv. """
+
+        self.states = np.array([[1, 0], [0, 1]])
+        super(BatchParityEnv, self).__init__(
+            num_envs,
+            Box(low=0, high=1, shape=(len(self.states),)),
+            Discrete(len(self.states)),
+        )
+        self.initial_state_index = 0
+        self.state_index = np.full(num_envs, self.initial_state_index)
+
+    def reset_envs(self, env_ids: np.ndarray) -> np.ndarray:
+        """ Reset copies of environment to initial state. """
+
+        self.state_index[env_ids] = self.initial_state_index
+        return self.states[self.state_index[env_ids]]
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Step function for environment. """
+
+        actions = np.reshape(actions, self.num_envs)
+        rewards = np.where(actions == self.state_index, 1.0, -1.0)
+        self.state_index = (self.state_index + 1) % len(self.states)
+        dones = np.zeros(self.num_envs, dtype=bool)
+
+        return self.states[self.state_index], rewards, dones
+
+
+class BatchUniqueEnv(BatchEnv):
+    """ Batched implementation of UniqueEnv. """
+
+    def __init__(self, num_envs: int) -> None:
+        """ Init function for BatchUniqueEnv. """
+
+        super(BatchUniqueEnv, self).__init__(
+            num_envs, Box(low=0.0, high=np.inf, shape=(1,)), Discrete(2)
+        )
+        self.timestep = np.ones(num_envs, dtype=np.int64)
+
+    def reset_envs(self, env_ids: np.ndarray) -> np.ndarray:
+        """ Reset copies of environment to initial state. """
+
+        self.timestep[env_ids] = 1
+        return self.timestep[env_ids, np.newaxis].astype(np.float32)
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Step function for environment. """
+
+        rewards = self.timestep.astype(np.float64)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        self.timestep += 1
+        obs = self.timestep[:, np.newaxis].astype(np.float32)
+
+        return obs, rewards, dones
+
+
+# Batched implementations of environments, used by `get_env()` with `batched=True`.
+BATCH_ENVS = {"parity-env": BatchParityEnv, "unique-env": BatchUniqueEnv}
+
+
+class SyntheticMultiTaskEnv(Env):
+    """
+    Synthetic multi-task environment with the interface and observation format of a
+    Meta-World multi-task benchmark, which doesn't depend on MuJoCo. Each observation is
+    a random state of `obs_dim` dimensions followed by the one-hot index of the active
+    task, and the reward is the negative squared distance between the action and a
+    target, which is a linear function of the state plus a task-specific offset. The
+    offset of each task is `(1 - conflict) * shared + conflict * specific`, where
+    `shared` is common to all tasks and tasks come in pairs with opposite `specific`
+    directions, so that `conflict` controls how strongly the reward gradients of
+    different tasks conflict. Each step also runs `compute_cost` matrix-vector products
+    to simulate the cost of a physics simulation. Episodes end after `max_path_length`
+    steps, like the episodes of Meta-World environments, so that episodes end and tasks
+    are switched even without a time limit. If `task_ids` is not None, only the tasks
+    of the full benchmark with those indices are held, as in
+    `get_metaworld_task_subset()`.
+    """
+
+    # HARDCODE. Seed used to generate the tasks, so that the tasks are the same in every
+    # process regardless of the environment seed, and the dimension of the simulated
+    # computation.
+    task_seed = 0
+    cost_dim = 64
+
+    def __init__(
+        self,
+        num_tasks: int,
+        obs_dim: int = 9,
+        action_dim: int = 4,
+        compute_cost: int = 0,
+        conflict: float = 1.0,
+        max_path_length: int = 150,
+        task_ids: List[int] = None,
+    ) -> None:
+        """ Init function for SyntheticMultiTaskEnv. """
+
+        if max_path_length < 1:
+            raise ValueError("Invalid max_path_length value: %s" % max_path_length)
+
+        self.task_ids = list(range(num_tasks)) if task_ids is None else list(task_ids)
+        self.num_tasks = len(self.task_ids)
+        self.obs_dim = obs_dim
+        self.compute_cost = compute_cost
+        self.max_path_length = max_path_length
+        self.observation_space = Box(
+            low=-np.inf, high=np.inf, shape=(obs_dim + self.num_tasks,)
+        )
+        self.action_space = Box(low=-1.0, high=1.0, shape=(action_dim,))
+
+        # Generate the offset of each task in the full benchmark and the map from
+        # states to targets.
+        rng = np.random.RandomState(self.task_seed)
+        shared = rng.normal(size=action_dim)
+        shared /= np.linalg.norm(shared)
+        specific = rng.normal(size=((num_tasks + 1) // 2, action_dim))
+        specific /= np.linalg.norm(specific, axis=1, keepdims=True)
+        specific = np.stack([specific, -specific], axis=1).reshape(-1, action_dim)
+        offsets = 0.5 * ((1 - conflict) * shared + conflict * specific[:num_tasks])
+        self.offsets = offsets[self.task_ids]
+        self.state_map = rng.normal(
+            scale=0.5 / np.sqrt(obs_dim), size=(action_dim, obs_dim)
+        )
+        self.cost_matrix = rng.normal(
+            scale=1.0 / np.sqrt(self.cost_dim), size=(self.cost_dim, self.cost_dim)
+        )
+
+        self.np_random = np.random.RandomState()
+        self.active_task = 0
+        self.path_length = 0
+        self.state = np.zeros(obs_dim)
+        self.cost_state = np.ones(self.cost_dim)
+
+    def seed(self, seed: int = None) -> List[int]:
+        """ Seed the random state of the environment. """
+
+        self.np_random.seed(seed)
+        return [seed]
+
+    def sample_tasks(self, num_tasks: int) -> List[Dict[str, int]]:
+        """ Sample tasks uniformly at random, in the format used by `set_task()`. """
+
+        tasks = self.np_random.randint(self.num_tasks, size=num_tasks)
+        return [{"task": int(task)} for task in tasks]
+
+    def set_task(self, task: Dict[str, int]) -> None:
+        """ Set the active task. """
+
+        self.active_task = task["task"]
+
+    def reset(self) -> np.ndarray:
+        """ Reset environment to a random state. """
+
+        self.path_length = 0
+        self.state = self.np_random.uniform(-1.0, 1.0, size=self.obs_dim)
+        return self.get_obs()
+
+    def step(self, action: np.ndarray) -> Tuple[np.ndarray, float, bool, dict]:
+        """
+        Step function for environment. Returns an observation, a reward,
+        whether or not the environment is done, and an info dictionary, as is
+        the standard for OpenAI gym environments.
+        """
+
+        # Simulate the cost of a physics simulation.
+        for _ in range(self.compute_cost):
+            self.cost_state = np.tanh(self.cost_matrix @ self.cost_state)
+
+        # Compute reward and move to a new random state.
+        action = np.clip(action, -1.0, 1.0)
+        target = self.offsets[self.active_task] + self.state_map @ self.state
+        distance = np.linalg.norm(action - target)
+        reward = -float(distance ** 2)
+        info = {"success": float(distance < 0.1)}
+        self.state = self.np_random.uniform(-1.0, 1.0, size=self.obs_dim)
+        self.path_length += 1
+        done = self.path_length >= self.max_path_length
+
+        return self.get_obs(), reward, done, info
+
+    def get_obs(self) -> np.ndarray:
+        """ Construct an observation from the state and the active task. """
+
+        obs = np.zeros(self.obs_dim + self.num_tasks)
+        obs[: self.obs_dim] = self.state
+        obs[self.obs_dim + self.active_task] = 1.0
+        return obs
+
+    @property
+    def task_index(self) -> int:
+        """ Index of the active task in the full benchmark. """
+
+        return self.task_ids[self.active_task]
+
+
 def get_base_env(env: Env) -> Env:
     """
     Very hacky way to return a reference to the base environment underneath a series of
@@ -550,6 +2165,15 @@ def get_base_env(env: Env) -> Env:
     return env
 
 
+# Synthetic multi-task benchmarks registered with `register_synthetic_benchmark()`,
+# mapping the name of each benchmark to the arguments of SyntheticMultiTaskEnv.
+SYNTHETIC_BENCHMARKS: Dict[str, Dict[str, Any]] = {}
+for synthetic_num_tasks in [10, 50, 200]:
+    register_synthetic_benchmark(
+        "synthetic-MT%d" % synthetic_num_tasks, synthetic_num_tasks
+    )
+
+
 # HARDCODE. This is a hard-coding of a reward threshold for some environments. An
 # episode is considered a success when the reward over that episode is greater than the
 # corresponding threshold.
@@ -1,16 +1,17 @@
 """ Definition of PPOPolicy, an object to perform acting and training with PPO. """
 
 import math
-from typing import Tuple, Dict, Any, Generator
+from typing import Tuple, Dict, Any, Generator, Optional
 
 import torch
 import torch.optim as optim
-from torch.distributions import Categorical, Normal
+from torch.distributions import Distribution, Categorical, Normal
 from gym.spaces import Space, Box, Discrete
 
 from meta.networks.actorcritic import ActorCriticNetwork
+from meta.networks.normalize import RunningNormalizer
 from meta.utils.storage import RolloutStorage
-from meta.utils.utils import combine_first_two_dims
+from meta.utils.utils import combine_first_two_dims, sum_by_task, reverse_linear_scan
 
 
 class PPOPolicy:
@@ -39,6 +40,9 @@ class PPOPolicy:
         max_grad_norm: float = 0.5,
         clip_value_loss: bool = True,
         normalize_advantages: float = True,
+        gae_backend: str = "loop",
+        normalize_transition: bool = False,
+        normalize_first_n: int = None,
         device: torch.device = None,
     ) -> None:
         """
@@ -100,12 +104,29 @@ class PPOPolicy:
             Whether or not to clip the value loss.
         normalize_advantages : float
             Whether or not to normalize advantages.
+        gae_backend : str
+            Method used to compute returns with GAE in `compute_returns_advantages()`.
+            Either "loop", which iterates backwards over each step of the rollout, or
+            "scan", which computes the returns for all steps with a parallel reverse
+            scan taking a logarithmic number of vectorized iterations.
+        normalize_transition : bool
+            Whether or not to normalize observations and rewards inside the policy,
+            instead of in the environment. Observations are normalized by the policy
+            network with running statistics that are updated by
+            `update_obs_normalization()`, and rewards are normalized in `get_loss()`
+            with running statistics of discounted returns, as in VecNormalize, which
+            are updated by `update_reward_normalization()`.
+        normalize_first_n : int
+            If not equal to None, only normalize the first ``normalize_first_n``
+            elements of the observation. Ignored if ``normalize_transition`` is False.
         device : torch.device
             Which device to perform update on (forward pass is always on CPU).
         """
 
         # Check for valid arguments.
         assert isinstance(num_tasks, int) and num_tasks >= 1
+        if gae_backend not in ["loop", "scan"]:
+            raise ValueError("Unsupported GAE backend: %s" % str(gae_backend))
 
         # Set policy state.
         self.observation_space = observation_space
@@ -127,6 +148,7 @@ class PPOPolicy:
         self.max_grad_norm = max_grad_norm
         self.clip_value_loss = clip_value_loss
         self.normalize_advantages = normalize_advantages
+        self.gae_backend = gae_backend
         self.device = device if device is not None else torch.device("cpu")
         self.num_tasks = num_tasks
         self.train = True
@@ -139,8 +161,18 @@ class PPOPolicy:
             rollout_length=rollout_length,
             architecture_config=dict(architecture_config),
             device=device,
+            normalize_obs=normalize_transition,
+            normalize_first_n=normalize_first_n,
         )
 
+        # Initialize reward normalization, if necessary. `self.running_returns` holds
+        # the discounted return of each process so far, which is used to compute the
+        # reward normalization statistics.
+        self.reward_normalizer = None
+        self.running_returns = None
+        if normalize_transition:
+            self.reward_normalizer = RunningNormalizer((), device=device)
+
         # Initialize optimizer.
         self.optimizer = optim.Adam(
             self.policy_network.parameters(), lr=initial_lr, eps=eps
@@ -180,8 +212,50 @@ class PPOPolicy:
                 "Unrecognized lr scheduler type: %s" % self.lr_schedule_type
             )
 
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """
+        Restore the policy from a pickled state. If the per-task log standard deviations
+        of the policy network were converted from their legacy layout when it was
+        unpickled (see `ActorCriticNetwork.__setstate__()`), the optimizer still holds
+        one parameter for each task, so we replace them with the converted parameter
+        and stack their optimizer state in the same way.
+        """
+
+        self.__dict__.update(state)
+
+        network_param_ids = set(id(param) for param in self.policy_network.parameters())
+        for group in self.optimizer.param_groups:
+            legacy_params = [
+                param for param in group["params"] if id(param) not in network_param_ids
+            ]
+            if len(legacy_params) == 0:
+                continue
+
+            logstd = self.policy_network.output_logstd
+            group["params"] = [
+                param for param in group["params"] if id(param) in network_param_ids
+            ]
+            group["params"].append(logstd)
+            legacy_states = [
+                self.optimizer.state.pop(param)
+                for param in legacy_params
+                if param in self.optimizer.state
+            ]
+            if len(legacy_states) == len(legacy_params):
+                self.optimizer.state[logstd] = {
+                    key: torch.stack([s[key] for s in legacy_states])
+                    if torch.is_tensor(value) and value.shape == legacy_params[0].shape
+                    else value
+                    for key, value in legacy_states[0].items()
+                }
+
     def act(
-        self, obs: torch.Tensor, hidden_state: torch.Tensor, done: torch.Tensor,
+        self,
+        obs: torch.Tensor,
+        hidden_state: torch.Tensor,
+        done: torch.Tensor,
+        task_indices: torch.Tensor = None,
+        noise: Optional[torch.Tensor] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         """
         Sample action from policy.
@@ -195,6 +269,14 @@ class PPOPolicy:
         done : torch.Tensor
             Whether or not the previous environment step was terminal. We use this to
             clear the hidden state of the policy when necessary, if it is recurrent.
+        task_indices : torch.Tensor
+            Task index of each observation as an integer, if known. If None and the
+            policy is multi-task, the task indices are recovered from `obs`.
+        noise : torch.Tensor
+            Noise to sample actions with, as returned by `sample_noise()`. If None,
+            actions are sampled from the action distribution directly, which gives the
+            same actions as passing noise sampled with the global random number
+            generator.
 
         Returns
         -------
@@ -210,22 +292,25 @@ class PPOPolicy:
 
         # Pass through network to get value prediction and action probabilities.
         value_pred, action_dist, hidden_state = self.policy_network(
-            obs, hidden_state, done
+            obs, hidden_state, done, task_indices
         )
 
         # Sample action and compute log probabilities.
-        if self.train:
-            action = action_dist.sample()
-        else:
-            # If evaluating, select action with highest probability.
+        if self.train and noise is not None:
+            # This matches the way that `action_dist.sample()` transforms its noise.
             if isinstance(action_dist, Categorical):
-                action = action_dist.probs.argmax(dim=-1)
+                action = (action_dist.probs / noise).argmax(dim=-1)
             elif isinstance(action_dist, Normal):
-                action = action_dist.mean
+                action = noise * action_dist.stddev + action_dist.mean
             else:
                 raise ValueError(
                     "Unsupported distribution type '%s'." % type(action_dist)
                 )
+        elif self.train:
+            action = action_dist.sample()
+        else:
+            # If evaluating, select action with highest probability.
+            action = self.greedy_action(action_dist)
         action_log_prob = action_dist.log_prob(action)
 
         # We sum over ``action_log_prob`` to convert element-wise log probs into a joint
@@ -243,12 +328,68 @@ class PPOPolicy:
 
         return value_pred, action, action_log_prob, hidden_state
 
+    def act_greedy(
+        self,
+        obs: torch.Tensor,
+        hidden_state: torch.Tensor,
+        done: torch.Tensor,
+        task_indices: torch.Tensor = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Select the action with highest probability under the policy, without computing
+        a value prediction or log probability. The arguments are the same as those of
+        `act()`. Returns the action and the new hidden state.
+        """
+
+        action_dist, hidden_state = self.policy_network.action_dist(
+            obs, hidden_state, done, task_indices
+        )
+        return self.greedy_action(action_dist), hidden_state
+
+    def greedy_action(self, action_dist: Distribution) -> torch.Tensor:
+        """ Return the action with highest probability under `action_dist`. """
+
+        if isinstance(action_dist, Categorical):
+            return action_dist.probs.argmax(dim=-1)
+        elif isinstance(action_dist, Normal):
+            return action_dist.mean
+        else:
+            raise ValueError("Unsupported distribution type '%s'." % type(action_dist))
+
+    def sample_noise(
+        self, batch_size: int, generator: torch.Generator = None
+    ) -> Optional[torch.Tensor]:
+        """
+        Sample the noise used to sample a batch of actions in `act()`, consuming random
+        numbers exactly as `act()` does when sampling a batch of size `batch_size`. If
+        `generator` is not None, the noise is drawn from `generator` instead of the
+        global random number generator. Returns None if the policy is in evaluation
+        mode, since actions are then chosen deterministically.
+        """
+
+        if not self.train:
+            return None
+
+        if isinstance(self.action_space, Discrete):
+            noise = torch.empty(batch_size, self.action_space.n, device=self.device)
+            noise.exponential_(generator=generator)
+        elif isinstance(self.action_space, Box):
+            noise = torch.empty(
+                batch_size, *self.action_space.shape, device=self.device
+            )
+            noise.normal_(generator=generator)
+        else:
+            raise ValueError("Action space '%r' unsupported." % type(self.action_space))
+
+        return noise
+
     def evaluate_actions(
         self,
         obs_batch: torch.Tensor,
         hidden_states_batch: torch.Tensor,
         actions_batch: torch.Tensor,
         dones_batch: torch.Tensor,
+        task_indices_batch: torch.Tensor = None,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         """
         Get values, log probabilities, and action distribution entropies for a batch of
@@ -264,6 +405,8 @@ class PPOPolicy:
             Hidden states to use for recurrent layer of policy, if necessary.
         dones_batch : torch.Tensor
             Whether or not each environment step in the batch is terminal.
+        task_indices_batch : torch.Tensor
+            Task index of each observation in the batch as an integer, if known.
 
         Returns
         -------
@@ -279,7 +422,7 @@ class PPOPolicy:
         """
 
         value, action_dist, hidden_states_batch = self.policy_network(
-            obs_batch, hidden_states_batch, dones_batch
+            obs_batch, hidden_states_batch, dones_batch, task_indices_batch
         )
 
         # Create action distribution object from probabilities and compute log
@@ -307,7 +450,11 @@ class PPOPolicy:
         return value, action_log_probs, action_dist_entropy, hidden_states_batch
 
     def get_value(
-        self, obs: torch.Tensor, hidden_state: torch.Tensor, done: torch.Tensor
+        self,
+        obs: torch.Tensor,
+        hidden_state: torch.Tensor,
+        done: torch.Tensor,
+        task_indices: torch.Tensor = None,
     ) -> torch.Tensor:
         """
         Get value prediction from an observation.
@@ -321,6 +468,8 @@ class PPOPolicy:
         done : torch.Tensor
             Whether or not the previous environment step was terminal. We use this to
             clear the hidden state when necessary.
+        task_indices : torch.Tensor
+            Task index of each observation as an integer, if known.
 
         Returns
         -------
@@ -328,7 +477,7 @@ class PPOPolicy:
             Value prediction from critic portion of policy.
         """
 
-        value_pred, _, _ = self.policy_network(obs, hidden_state, done)
+        value_pred, _ = self.policy_network.value(obs, hidden_state, done, task_indices)
         return value_pred
 
     def compute_returns_advantages(
@@ -351,38 +500,26 @@ class PPOPolicy:
             Tensor holding advantage estimates using GAE.
         """
 
-        returns = torch.zeros(
-            rollout.rollout_step, rollout.num_processes, 1, device=self.device
-        )
-        advantages = torch.zeros(
-            rollout.rollout_step, rollout.num_processes, 1, device=self.device
-        )
-
         # Get value prediction of very last observation for return computation.
         with torch.no_grad():
             rollout.value_preds[rollout.rollout_step] = self.get_value(
                 rollout.obs[rollout.rollout_step],
                 rollout.hidden_states[rollout.rollout_step],
                 rollout.dones[rollout.rollout_step],
+                rollout.get_task_indices(rollout.rollout_step),
             )
 
-        # Compute returns.
-        gae = 0
-        for t in reversed(range(rollout.rollout_step)):
-
-            # We initially set delta = 0 to avoid setting delta = rollout.rewards[t],
-            # and coupling delta with rollout.rewards[t].
-            delta = 0
-            delta += rollout.rewards[t]
-            delta += (
-                self.gamma * rollout.value_preds[t + 1] * (1 - rollout.dones[t + 1])
-            )
-            delta -= rollout.value_preds[t]
-
-            gae = (
-                1 - rollout.dones[t + 1]
-            ) * self.gamma * self.gae_lambda * gae + delta
-            returns[t] = gae + rollout.value_preds[t]
+        # Compute returns, with normalized rewards if necessary. The rewards in
+        # ``rollout`` are left unnormalized.
+        rewards = rollout.rewards[: rollout.rollout_step]
+        if self.reward_normalizer is not None:
+            rewards = self.reward_normalizer.scale(rewards)
+        if self.gae_backend == "loop":
+            returns = self.compute_returns_loop(rollout, rewards)
+        elif self.gae_backend == "scan":
+            returns = self.compute_returns_scan(rollout, rewards)
+        else:
+            raise NotImplementedError
 
         # Compute advantages.
         advantages = returns - rollout.value_preds[: rollout.rollout_step]
@@ -402,6 +539,80 @@ class PPOPolicy:
 
         return returns, advantages
 
+    def compute_returns_loop(
+        self, rollout: RolloutStorage, rewards: torch.Tensor = None
+    ) -> torch.Tensor:
+        """
+        Compute returns with GAE by iterating backwards over each step of the rollout.
+        Assumes that the value prediction for the last observation of the rollout has
+        already been computed.
+
+        Arguments
+        ---------
+        rollout : RolloutStorage
+            Storage container for rollout information.
+        rewards : torch.Tensor
+            Reward of each step of the rollout, to use in place of the rewards stored in
+            ``rollout``. If None, the stored rewards are used.
+
+        Returns
+        -------
+        returns : torch.Tensor
+            Tensor of shape `(rollout.rollout_step, rollout.num_processes, 1)` holding
+            returns.
+        """
+
+        if rewards is None:
+            rewards = rollout.rewards[: rollout.rollout_step]
+        returns = torch.zeros(
+            rollout.rollout_step, rollout.num_processes, 1, device=self.device
+        )
+
+        gae = 0
+        for t in reversed(range(rollout.rollout_step)):
+
+            # We initially set delta = 0 to avoid setting delta = rewards[t], and
+            # coupling delta with rewards[t].
+            delta = 0
+            delta += rewards[t]
+            delta += (
+                self.gamma * rollout.value_preds[t + 1] * (1 - rollout.dones[t + 1])
+            )
+            delta -= rollout.value_preds[t]
+
+            gae = (
+                1 - rollout.dones[t + 1]
+            ) * self.gamma * self.gae_lambda * gae + delta
+            returns[t] = gae + rollout.value_preds[t]
+
+        return returns
+
+    def compute_returns_scan(
+        self, rollout: RolloutStorage, rewards: torch.Tensor = None
+    ) -> torch.Tensor:
+        """
+        Compute returns with GAE using a parallel reverse scan over the steps of the
+        rollout (see `reverse_linear_scan()`). The GAE satisfies the linear recurrence
+        gae_t = a_t * gae_{t+1} + delta_t, where a_t = gamma * lambda * (1 -
+        done_{t+1}) and delta_t is the TD error at step t, so it is computed for all
+        steps in ceil(log2(rollout_step)) vectorized iterations. Assumes that the value
+        prediction for the last observation of the rollout has already been computed.
+        See `compute_returns_loop()` for a description of the inputs and outputs.
+        """
+
+        rollout_step = rollout.rollout_step
+        if rewards is None:
+            rewards = rollout.rewards[:rollout_step]
+
+        # Compute TD errors and recurrence coefficients for each step of the rollout.
+        values = rollout.value_preds[: rollout_step + 1]
+        not_dones = 1 - rollout.dones[1 : rollout_step + 1]
+        deltas = rewards + self.gamma * values[1:] * not_dones - values[:-1]
+        coeffs = self.gamma * self.gae_lambda * not_dones
+
+        returns = reverse_linear_scan(deltas, coeffs) + values[:-1]
+        return returns
+
     def get_loss(self, rollout: RolloutStorage) -> Generator[torch.Tensor, None, None]:
         """
         Train policy with PPO from rollout information in ``rollouts``.
@@ -451,6 +662,7 @@ class PPOPolicy:
                     old_action_log_probs_batch,
                     dones_batch,
                     hidden_states_batch,
+                    task_indices_batch,
                 ) = minibatch
                 if self.recurrent:
                     returns_batch = combine_first_two_dims(
@@ -470,7 +682,11 @@ class PPOPolicy:
                     action_dist_entropy_batch,
                     _,
                 ) = self.evaluate_actions(
-                    obs_batch, hidden_states_batch, actions_batch, dones_batch
+                    obs_batch,
+                    hidden_states_batch,
+                    actions_batch,
+                    dones_batch,
+                    task_indices_batch,
                 )
 
                 values_batch = values_batch.squeeze(-1)
@@ -513,19 +729,59 @@ class PPOPolicy:
                     loss = minibatch_loss.sum()
                 else:
 
-                    # Here we assume that each observation is a flat vector that ends
-                    # with a one-hot vector of length `self.num_tasks`. We do NOT
-                    # explicitly check these conditions.
-                    loss = torch.zeros(self.num_tasks)
-                    task_indices = obs_batch[:, -self.num_tasks :].nonzero()[:, 1]
-                    for task in range(self.num_tasks):
-                        task_specific_indices = (
-                            (task_indices == task).nonzero().squeeze(-1)
-                        )
-                        loss[task] = minibatch_loss[task_specific_indices].sum()
+                    # If the rollout doesn't hold task indices, we assume that each
+                    # observation is a flat vector that ends with a one-hot vector of
+                    # length `self.num_tasks`. We do NOT explicitly check these
+                    # conditions.
+                    if task_indices_batch is None:
+                        one_hots = obs_batch[:, -self.num_tasks :]
+                        task_indices_batch = one_hots.nonzero()[:, 1]
+                    loss = sum_by_task(
+                        minibatch_loss, task_indices_batch, self.num_tasks
+                    )
 
                 yield loss
 
+    def update_reward_normalization(self, rollout: RolloutStorage) -> None:
+        """
+        Update the reward normalization statistics with the discounted returns of each
+        step of ``rollout``, if the policy normalizes rewards. This should be called
+        exactly once for each rollout, before `get_loss()` is called for it. The
+        rewards of ``rollout`` are not modified, and are normalized in `get_loss()`.
+        """
+
+        if self.reward_normalizer is None:
+            return
+        if self.running_returns is None:
+            self.running_returns = torch.zeros(
+                rollout.num_processes, 1, device=rollout.rewards.device
+            )
+
+        # Compute the discounted return of each process at each step, which satisfies
+        # the linear recurrence R_t = r_t + gamma * (1 - done_t) * R_{t-1}, by solving
+        # it backwards in time over the flipped rollout. The running return from the
+        # last rollout was already reset for episodes that ended at its last step.
+        rollout_step = rollout.rollout_step
+        rewards = rollout.rewards[:rollout_step].clone()
+        rewards[0] += self.gamma * self.running_returns
+        coeffs = self.gamma * (1 - rollout.dones[:rollout_step])
+        step_returns = reverse_linear_scan(rewards.flip(0), coeffs.flip(0)).flip(0)
+        self.running_returns = step_returns[-1] * (1 - rollout.dones[rollout_step])
+
+        self.reward_normalizer.update(step_returns)
+
+    def update_obs_normalization(self, obs: torch.Tensor) -> None:
+        """
+        Update the observation normalization statistics of the policy network with a
+        batch of unnormalized observations, if the policy normalizes observations. This
+        should be called after each update step with the observations of the rollout
+        that was trained on, so that the observations of a rollout are normalized the
+        same way when acting and when training.
+        """
+
+        if self.policy_network.obs_normalizer is not None:
+            self.policy_network.obs_normalizer.update(obs)
+
     def after_step(self) -> None:
         """ Perform any post training step actions. """
 
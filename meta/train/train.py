@@ -1,9 +1,12 @@
 """ Run PPO training on OpenAI Gym/MetaWorld environment. """
 
 import os
+import copy
 import pickle
 import json
-from typing import Any, List, Tuple, Dict
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Tuple, Dict, Optional
 
 import numpy as np
 import torch
@@ -12,7 +15,7 @@ import gym
 from gym import Env
 
 from meta.train.ppo import PPOPolicy
-from meta.train.env import get_env, get_num_tasks
+from meta.train.env import get_env, get_num_tasks, acquire_env, release_env
 from meta.utils.storage import RolloutStorage
 from meta.utils.logger import logger
 from meta.utils.metrics import Metrics
@@ -52,6 +55,70 @@ def train(
         Number of mini batches per update step for PPO.
     num_processes : int
         Number of asynchronous environments to run at once.
+    envs_per_worker : int
+        Number of environments run sequentially by each worker process, when
+        num_processes > 1.
+    task_assignment : str
+        For multi-task benchmarks (Meta-World or synthetic), either None,
+        "round_robin", or "contiguous". If not None, each process is pinned to a
+        subset of the tasks and only constructs those tasks. See
+        `meta.train.env.get_task_assignment()`.
+    env_templates : bool
+        Whether or not to construct each environment once as a template which is kept
+        between calls to `train()` and inherited by the worker processes, instead of
+        constructing the environment from scratch in each worker. Only used when
+        num_processes > 1. Templates should be discarded with
+        `meta.train.env.shutdown_env_pool()` once they are no longer needed.
+    reuse_envs : bool
+        Whether or not to borrow the environment from a pool which is kept between calls
+        to `train()`, so that consecutive calls with the same environment settings
+        reuse the same worker processes instead of starting new ones. The pool should
+        be closed with `meta.train.env.shutdown_env_pool()` once it is no longer needed.
+    batched_env : bool
+        Whether or not to use the batched implementation of the environment, which
+        steps all num_processes copies at once with array operations in the current
+        process. See `meta.train.env.BatchEnv`.
+    shared_obs : bool
+        Whether or not observations are passed from the worker processes as float32
+        tensors which are views of shared memory, so that each observation is only
+        copied once, into the rollout storage. Only used when num_processes > 1 and
+        observations aren't normalized by the environment (normalize_transition =
+        False or policy_normalization = True).
+    pipeline_rollout : bool
+        Whether or not to collect training rollouts with `collect_rollout_pipelined()`,
+        which processes the results of one half of the environments while the other
+        half is still stepping. Policy inference isn't overlapped with environment
+        steps, so that rollouts are the same as without pipelining. This requires at
+        least two worker processes, and normalize_transition = False or
+        policy_normalization = True.
+    num_ready_workers : int
+        If not None, training rollouts are collected with `collect_rollout_ready()`,
+        which doesn't wait for the slowest worker at each step. Instead, each step only
+        waits for the first num_ready_workers workers to finish. Each worker still
+        takes rollout_length steps per rollout, so the fast workers wait for the
+        slowest one at the end of the rollout instead of at each step, and rollouts
+        depend on timing. This requires normalize_transition = False or policy_normalization = True, and can't be used
+        with pipeline_rollout.
+    async_rollout : bool
+        Whether or not to collect each training rollout during the update step on the
+        previous rollout, with a copy of the policy whose weights are updated after each
+        update step. The stored log probabilities and value predictions are then those
+        of the policy from before the previous update.
+    eval_processes : int
+        If not None, evaluation runs in a background thread on a separate environment
+        with eval_processes processes, instead of on the training environment. Each
+        evaluation uses a snapshot of the policy weights, and its results are recorded
+        in the metrics once it finishes, under the iteration at which it started (see
+        `Metric.iterations`), so training isn't interrupted and in-progress training
+        and evaluation episodes aren't discarded. This requires
+        normalize_transition = False or policy_normalization = True.
+    fast_eval : bool
+        Whether or not to run evaluation with `evaluate_fast()`, which only runs the
+        actor of the policy, doesn't write into rollout storage, and stops as soon as
+        evaluation_episodes episodes have finished. When evaluating on the training
+        environment, the environment is then reset at the start of each evaluation
+        instead of before it. With eval_processes, the evaluation environment is still
+        never reset between evaluations.
     lr_schedule_type : str
         Either None, "exponential", "cosine", or "linear". If None is given, the
         learning rate will stay at initial_lr for the duration of training.
@@ -69,8 +136,18 @@ def train(
         Discount factor for rewards.
     gae_lambda : float
         Lambda parameter for GAE (used in equation (11) of PPO paper).
+    gae_backend : str
+        Method used to compute GAE returns. Either "loop", which iterates backwards
+        over each step of the rollout, or "scan", which computes returns for all steps
+        with a parallel reverse scan taking a logarithmic number of iterations.
     max_grad_norm : float
         Max norm of gradients
+    reuse_task_grads : bool
+        Whether or not to reuse the task-specific gradients computed by splitting
+        networks and gradient-monitoring trunk networks as the gradient of the total
+        loss for those networks, instead of computing it with another backward pass.
+        Only the remaining parameters (such as output heads) will receive a separate
+        backward pass.
     clip_param : float
         Clipping parameter for PPO surrogate loss.
     clip_value_loss : False
@@ -79,6 +156,10 @@ def train(
         Whether or not to normalize advantages after computation.
     normalize_transition : bool
         Whether or not to normalize observations and rewards.
+    policy_normalization : bool
+        Whether or not observations and rewards are normalized by the policy in torch
+        (see `PPOPolicy`), with statistics that are saved with the policy, instead of
+        by the environment. Only used when normalize_transition = True.
     architecture_config: Dict[str, Any]
         Config dictionary for the architecture. Should contain an entry for "type",
         which is either "vanilla", "trunk", "splitting_v1" or "splitting_v2", and all
@@ -165,16 +246,45 @@ def train(
     else:
         device = torch.device("cpu")
 
+    # Check rollout collection settings.
+    if config["num_ready_workers"] is not None:
+        if config["pipeline_rollout"]:
+            raise ValueError(
+                "pipeline_rollout and num_ready_workers can't be used together."
+            )
+        if config["num_ready_workers"] < 1:
+            raise ValueError(
+                "Invalid num_ready_workers value: %s" % config["num_ready_workers"]
+            )
+
+    # Check evaluation settings.
+    if config["eval_processes"] is not None:
+        if config["normalize_transition"] and not config["policy_normalization"]:
+            raise ValueError(
+                "eval_processes requires normalize_transition = False or "
+                "policy_normalization = True."
+            )
+        if config["eval_processes"] < 1:
+            raise ValueError(
+                "Invalid eval_processes value: %s" % config["eval_processes"]
+            )
+
     # Set environment and policy.
     num_tasks = get_num_tasks(config["env_name"])
-    env = get_env(
+    env_fn = acquire_env if config["reuse_envs"] else get_env
+    env = env_fn(
         config["env_name"],
         config["num_processes"],
         config["seed"],
         config["time_limit"],
-        config["normalize_transition"],
+        config["normalize_transition"] and not config["policy_normalization"],
         config["normalize_first_n"],
         allow_early_resets=True,
+        envs_per_worker=config["envs_per_worker"],
+        task_assignment=config["task_assignment"],
+        env_templates=config["env_templates"],
+        batched=config["batched_env"],
+        shared_obs=config["shared_obs"],
     )
     if policy is None:
         policy = PPOPolicy(
@@ -195,10 +305,14 @@ def train(
             entropy_loss_coeff=config["entropy_loss_coeff"],
             gamma=config["gamma"],
             gae_lambda=config["gae_lambda"],
+            gae_backend=config["gae_backend"],
             clip_param=config["clip_param"],
             max_grad_norm=config["max_grad_norm"],
             clip_value_loss=config["clip_value_loss"],
             normalize_advantages=config["normalize_advantages"],
+            normalize_transition=config["normalize_transition"]
+            and config["policy_normalization"],
+            normalize_first_n=config["normalize_first_n"],
             device=device,
         )
 
@@ -215,7 +329,7 @@ def train(
     )
 
     # Initialize environment and set first observation.
-    rollout.set_initial_obs(env.reset())
+    rollout.set_initial_obs(env.reset(), env.task_indices)
 
     # Construct metrics object to hold performance metrics.
     metrics = Metrics()
@@ -237,48 +351,182 @@ def train(
         metrics = checkpoint["metrics"]
         update_iteration = checkpoint["update_iteration"]
 
+    else:
+
+        # Update observation normalization statistics of a new policy with the initial
+        # observations, as VecNormalize does on reset.
+        policy.update_obs_normalization(rollout.obs[0])
+
     # Training loop.
     policy.train = True
+    collect_train_rollout = (
+        collect_rollout_pipelined if config["pipeline_rollout"] else collect_rollout
+    )
+    if config["num_ready_workers"] is not None:
+        collect_train_rollout = partial(
+            collect_rollout_ready, num_ready_workers=config["num_ready_workers"]
+        )
 
-    while update_iteration < config["num_updates"]:
+    # In async mode, training rollouts are collected by a frozen copy of the policy,
+    # which is updated after each update step. The next rollout is collected into a
+    # second RolloutStorage by a background thread during each update step, and
+    # actions are sampled with a separate random number generator so that training
+    # is deterministic.
+    acting_policy = policy
+    collector = None
+    collection = None
+    generator = None
+    if config["async_rollout"]:
+        acting_policy = copy.copy(policy)
+        acting_policy.policy_network = copy.deepcopy(policy.policy_network)
+        next_rollout = copy.deepcopy(rollout)
+        collector = ThreadPoolExecutor(max_workers=1)
+        generator = torch.Generator(device=device)
+        generator.manual_seed(config["seed"])
 
-        # Sample rollout.
-        rollout, episode_rewards, episode_successes = collect_rollout(
-            rollout, env, policy
+    # When evaluating in the background, evaluation runs on a separate environment in
+    # another thread, with a snapshot of the policy taken when the evaluation starts.
+    # The evaluation environment is never reset between evaluations, so episodes which
+    # are in progress at the end of one evaluation are continued by the next. The
+    # state of these episodes is kept in a separate rollout storage, or in
+    # `eval_state` for evaluate_fast().
+    evaluator = None
+    evaluation = None
+    evaluation_iteration = None
+    if config["eval_processes"] is not None:
+        eval_env = env_fn(
+            config["env_name"],
+            config["eval_processes"],
+            config["seed"] + config["num_processes"],
+            config["time_limit"],
+            normalize_transition=False,
+            allow_early_resets=True,
+            envs_per_worker=config["envs_per_worker"],
+            task_assignment=config["task_assignment"],
+            env_templates=config["env_templates"],
+            batched=config["batched_env"],
+            shared_obs=config["shared_obs"],
         )
+        eval_state = {}
+        if not config["fast_eval"]:
+            eval_rollout = RolloutStorage(
+                rollout_length=config["rollout_length"],
+                observation_space=eval_env.observation_space,
+                action_space=eval_env.action_space,
+                num_processes=config["eval_processes"],
+                hidden_state_size=policy.policy_network.recurrent_hidden_size
+                if policy.recurrent
+                else 1,
+                device=device,
+            )
+            eval_rollout.set_initial_obs(eval_env.reset(), eval_env.task_indices)
+        evaluator = ThreadPoolExecutor(max_workers=1)
+
+    while update_iteration < config["num_updates"]:
+        evaluating = (
+            update_iteration % config["evaluation_freq"] == 0
+            or update_iteration == config["num_updates"] - 1
+        )
+
+        # Sample rollout, unless it was collected during the last update step.
+        if collection is None:
+            rollout, episode_rewards, episode_successes = collect_train_rollout(
+                rollout, env, acting_policy, generator
+            )
+        else:
+            rollout, next_rollout = next_rollout, rollout
+            _, episode_rewards, episode_successes = collection.result()
+            collection = None
+
+        # Start collecting the next rollout in the background, if necessary. We don't
+        # do this before an evaluation on the training environment, since evaluation
+        # resets the environment.
+        if (
+            collector is not None
+            and not (evaluating and evaluator is None)
+            and update_iteration < config["num_updates"] - 1
+        ):
+            next_rollout.reset(rollout)
+            collection = collector.submit(
+                collect_train_rollout, next_rollout, env, acting_policy, generator
+            )
 
         # Compute update.
+        policy.update_reward_normalization(rollout)
         for step_loss in policy.get_loss(rollout):
 
+            # When reusing task-specific gradients, the networks below accumulate the
+            # gradient of the total loss into their parameters, so we zero the
+            # gradients beforehand and keep track of which parameters are covered.
+            reuse_grads = config["reuse_task_grads"]
+            if reuse_grads:
+                policy.policy_network.zero_grad()
+            reused_params = []
+
             # If we're training a splitting network, pass it the task-specific losses.
             if policy.policy_network.architecture_type in [
                 "splitting_v1",
                 "splitting_v2",
             ]:
-                policy.policy_network.actor.check_for_split(step_loss)
-                policy.policy_network.critic.check_for_split(step_loss)
+                for network in [
+                    policy.policy_network.actor,
+                    policy.policy_network.critic,
+                ]:
+                    if reuse_grads:
+                        reused_params += list(network.regions.parameters())
+                    network.check_for_split(step_loss, accumulate_grads=reuse_grads)
 
             # If we're training a trunk network, check for frequency of conflicting
             # gradients.
             if policy.policy_network.architecture_type == "trunk":
-                if policy.policy_network.actor.monitor_grads:
-                    policy.policy_network.actor.check_conflicting_grads(step_loss)
-                if policy.policy_network.critic.monitor_grads:
-                    policy.policy_network.critic.check_conflicting_grads(step_loss)
+                for network in [
+                    policy.policy_network.actor,
+                    policy.policy_network.critic,
+                ]:
+                    if network.monitor_grads:
+                        if reuse_grads:
+                            reused_params += list(network.trunk.parameters())
+                        network.check_conflicting_grads(
+                            step_loss, accumulate_grads=reuse_grads
+                        )
 
             # If we are multi-task training, consolidate task-losses with weighted sum.
             if num_tasks > 1:
                 step_loss = torch.sum(step_loss)
 
-            # Perform backward pass, clip gradient, and take optimizer step.
-            policy.policy_network.zero_grad()
-            step_loss.backward()
+            # Perform backward pass, clip gradient, and take optimizer step. If we are
+            # reusing task-specific gradients, we only compute gradients for the
+            # parameters that weren't already covered.
+            if reuse_grads:
+                reused_ids = set(id(param) for param in reused_params)
+                remaining_params = [
+                    param
+                    for param in policy.policy_network.parameters()
+                    if param.requires_grad and id(param) not in reused_ids
+                ]
+                if len(remaining_params) > 0:
+                    remaining_grads = torch.autograd.grad(
+                        step_loss, remaining_params, allow_unused=True
+                    )
+                    for param, param_grad in zip(remaining_params, remaining_grads):
+                        if param_grad is not None:
+                            param.grad = param_grad
+            else:
+                policy.policy_network.zero_grad()
+                step_loss.backward()
             if config["max_grad_norm"] is not None:
                 nn.utils.clip_grad_norm_(
                     policy.policy_network.parameters(), config["max_grad_norm"]
                 )
             policy.optimizer.step()
         policy.after_step()
+        policy.update_obs_normalization(rollout.obs[1 : rollout.rollout_step + 1])
+
+        # Wait for the next rollout and update the acting policy, in async mode.
+        if collection is not None:
+            collection.result()
+        if acting_policy is not policy:
+            acting_policy.policy_network = copy.deepcopy(policy.policy_network)
 
         # Reset rollout storage.
         rollout.reset()
@@ -287,30 +535,77 @@ def train(
         step_metrics = {}
         step_metrics["train_reward"] = episode_rewards
         step_metrics["train_success"] = episode_successes
-        if (
-            update_iteration % config["evaluation_freq"] == 0
-            or update_iteration == config["num_updates"] - 1
-        ):
-            # Reset environment and rollout, so we don't cross-contaminate episodes from
-            # training and evaluation.
-            rollout.init_rollout_info()
-            rollout.set_initial_obs(env.reset())
+        if evaluating and evaluator is None:
 
-            # Run evaluation and record metrics.
+            # Run evaluation and record metrics. Unless evaluate_fast() is used, which
+            # resets the environment itself, we first reset environment and rollout so
+            # we don't cross-contaminate episodes from training and evaluation.
             policy.train = False
-            evaluation_rewards, evaluation_successes = evaluate(
-                env, policy, rollout, config["evaluation_episodes"],
-            )
+            if config["fast_eval"]:
+                evaluation_rewards, evaluation_successes = evaluate_fast(
+                    env, policy, config["evaluation_episodes"]
+                )
+            else:
+                rollout.init_rollout_info()
+                rollout.set_initial_obs(env.reset(), env.task_indices)
+                evaluation_rewards, evaluation_successes = evaluate(
+                    env, policy, rollout, config["evaluation_episodes"],
+                )
             policy.train = True
             step_metrics["eval_reward"] = evaluation_rewards
             step_metrics["eval_success"] = evaluation_successes
 
             # Reset environment and rollout, as above.
             rollout.init_rollout_info()
-            rollout.set_initial_obs(env.reset())
+            rollout.set_initial_obs(env.reset(), env.task_indices)
+
+        # Record the results of the background evaluation once it finishes, and start
+        # evaluating a snapshot of the policy, if necessary. We wait for the previous
+        # evaluation to finish before starting another, and for the last evaluation to
+        # finish at the end of training. Results are recorded with the iteration at
+        # which the evaluation was started, i.e. that of the evaluated policy, instead
+        # of the iteration at which they are recorded.
+        if evaluator is not None:
+            eval_results = []
+            if evaluation is not None and (evaluation.done() or evaluating):
+                eval_results.append((evaluation_iteration, evaluation.result()))
+                evaluation = None
+            if evaluating:
+                eval_policy = copy.copy(policy)
+                eval_policy.policy_network = copy.deepcopy(policy.policy_network)
+                eval_policy.train = False
+                if config["fast_eval"]:
+                    evaluation = evaluator.submit(
+                        evaluate_fast,
+                        eval_env,
+                        eval_policy,
+                        config["evaluation_episodes"],
+                        eval_state,
+                    )
+                else:
+                    evaluation = evaluator.submit(
+                        evaluate,
+                        eval_env,
+                        eval_policy,
+                        eval_rollout,
+                        config["evaluation_episodes"],
+                    )
+                evaluation_iteration = update_iteration
+                if update_iteration == config["num_updates"] - 1:
+                    eval_results.append((evaluation_iteration, evaluation.result()))
+                    evaluation = None
+            for eval_iteration, eval_result in eval_results:
+                evaluation_rewards, evaluation_successes = eval_result
+                metrics.update(
+                    {
+                        "eval_reward": evaluation_rewards,
+                        "eval_success": evaluation_successes,
+                    },
+                    eval_iteration,
+                )
 
         # Update and print metrics.
-        metrics.update(step_metrics)
+        metrics.update(step_metrics, update_iteration)
         if (
             update_iteration % config["print_freq"] == 0
             or update_iteration == config["num_updates"] - 1
@@ -347,8 +642,18 @@ def train(
 
         update_iteration += 1
 
-    # Close environment.
-    env.close()
+    # Close environments.
+    if collector is not None:
+        collector.shutdown()
+    envs = [env]
+    if evaluator is not None:
+        evaluator.shutdown()
+        envs.append(eval_env)
+    for open_env in envs:
+        if config["reuse_envs"]:
+            release_env(open_env)
+        else:
+            open_env.close()
 
     # Save metrics if necessary.
     if config["metrics_filename"] is not None:
@@ -388,7 +693,10 @@ def train(
 
 
 def collect_rollout(
-    rollout: RolloutStorage, env: Env, policy: PPOPolicy,
+    rollout: RolloutStorage,
+    env: Env,
+    policy: PPOPolicy,
+    generator: torch.Generator = None,
 ) -> Tuple[RolloutStorage, List[float], List[float]]:
     """
     Run environment and collect rollout information (observations, rewards, actions,
@@ -402,6 +710,9 @@ def collect_rollout(
         Environment to run.
     policy : PPOPolicy
         Policy to sample actions with.
+    generator : torch.Generator
+        Random number generator to sample actions with. If None, actions are sampled
+        with the global random number generator.
 
     Returns
     -------
@@ -423,35 +734,221 @@ def collect_rollout(
     for rollout_step in range(rollout.rollout_length):
 
         # Sample actions.
+        noise: Optional[torch.Tensor] = None
+        if generator is not None:
+            noise = policy.sample_noise(rollout.num_processes, generator)
         with torch.no_grad():
             values, actions, action_log_probs, hidden_states = policy.act(
                 rollout.obs[rollout_step],
                 rollout.hidden_states[rollout_step],
                 rollout.dones[rollout_step],
+                rollout.get_task_indices(rollout_step),
+                noise,
             )
 
         # Perform step and record in ``rollout``.
-        obs, rewards, dones, infos = env.step(actions)
+        obs, rewards, dones, _ = env.step(actions)
         rollout.add_step(
-            obs, actions, dones, action_log_probs, values, rewards, hidden_states
+            obs,
+            actions,
+            dones,
+            action_log_probs,
+            values,
+            rewards,
+            hidden_states,
+            env.task_indices,
         )
 
-        # Determine success or failure.
-        for done, info in zip(dones, infos):
-            if done:
-                if "success" in info:
-                    rollout_successes.append(info["success"])
-                else:
-                    rollout_successes.append(None)
+        # Determine success or failure and total reward of each episode which ended
+        # during the step, from the episode statistics written by the environment.
+        ended = np.asarray(dones, dtype=bool)
+        successes = env.episode_info["success"][ended]
+        rollout_successes += [
+            None if np.isnan(success) else float(success) for success in successes
+        ]
+        episode_rewards = env.episode_info["episode_return"][ended]
+        rollout_episode_rewards += episode_rewards[~np.isnan(episode_rewards)].tolist()
+
+    return rollout, rollout_episode_rewards, rollout_successes
+
+
+def collect_rollout_pipelined(
+    rollout: RolloutStorage,
+    env: Env,
+    policy: PPOPolicy,
+    generator: torch.Generator = None,
+    num_groups: int = 2,
+) -> Tuple[RolloutStorage, List[float], List[float]]:
+    """
+    Pipelined version of `collect_rollout()`. The environments are split into
+    `num_groups` groups which are stepped independently, so that the results of one
+    group (decoding observations and reading the statistics of completed episodes) are
+    processed while the other groups are still stepping. The arguments and return
+    values are the same as those of `collect_rollout()`, and `env` must support grouped
+    stepping (see `VecPyTorchEnv.set_groups()`).
+
+    The contents of `rollout` are exactly the same as with `collect_rollout()`. To this
+    end, the policy samples the actions of each step for all processes with a single
+    forward pass, as in `collect_rollout()`, since the results of the forward pass can
+    depend on the batch size in floating point. Policy inference therefore doesn't
+    overlap with environment steps, only the processing of each group's results does.
+    """
+
+    rollout_episode_rewards = []
+    rollout_successes = []
+    group_slices = env.set_groups(num_groups)
+
+    # Rollout loop.
+    for rollout_step in range(rollout.rollout_length):
+
+        # Sample actions for all processes and send them to each group.
+        noise: Optional[torch.Tensor] = None
+        if generator is not None:
+            noise = policy.sample_noise(rollout.num_processes, generator)
+        with torch.no_grad():
+            values, actions, action_log_probs, hidden_states = policy.act(
+                rollout.obs[rollout_step],
+                rollout.hidden_states[rollout_step],
+                rollout.dones[rollout_step],
+                rollout.get_task_indices(rollout_step),
+                noise,
+            )
+        for group, group_slice in enumerate(group_slices):
+            env.step_async_group(actions[group_slice], group)
+
+        # Wait for each group's step, and read the statistics of any episodes which
+        # ended during the step while the remaining groups are stepping.
+        group_results = []
+        for group, group_slice in enumerate(group_slices):
+            obs, rewards, dones, _ = env.step_wait_group(group)
+            ended = np.asarray(dones, dtype=bool)
+            successes = env.episode_info["success"][group_slice][ended]
+            rollout_successes += [
+                None if np.isnan(success) else float(success) for success in successes
+            ]
+            episode_rewards = env.episode_info["episode_return"][group_slice][ended]
+            rollout_episode_rewards += episode_rewards[
+                ~np.isnan(episode_rewards)
+            ].tolist()
+            group_results.append((obs, rewards, dones))
+
+        # Record step in ``rollout``.
+        rollout.add_step(
+            torch.cat([obs for obs, _, _ in group_results]),
+            actions,
+            [done for _, _, dones in group_results for done in dones],
+            action_log_probs,
+            values,
+            torch.cat([rewards for _, rewards, _ in group_results]),
+            hidden_states,
+            env.task_indices,
+        )
+
+    return rollout, rollout_episode_rewards, rollout_successes
+
+
+def collect_rollout_ready(
+    rollout: RolloutStorage,
+    env: Env,
+    policy: PPOPolicy,
+    generator: torch.Generator = None,
+    num_ready_workers: int = 1,
+) -> Tuple[RolloutStorage, List[float], List[float]]:
+    """
+    Version of `collect_rollout()` which doesn't wait for the slowest environment
+    worker at each step. After the first step, each call to `env.step_wait_ready()`
+    returns the results for the first `num_ready_workers` workers to finish their
+    step, which are written into `rollout` by environment index, and only those
+    workers are sent their next actions. Environments which have completed
+    `rollout.rollout_length` steps stop stepping until the rollout is finished, so that
+    each process has the same number of steps in `rollout`. This means that the idle
+    time of the fast workers isn't removed, only moved to the end of the rollout,
+    where they wait for the stragglers to catch up: the total time of a rollout is
+    still bounded below by the slowest worker's `rollout.rollout_length` steps, and
+    the speedup comes only from spreading the slow steps of different workers across
+    the rollout. Since the order in which steps are recorded and the batches of
+    environments passed through the policy depend on timing, action samples (and
+    so the contents of `rollout`) are not reproducible between runs, even with a
+    fixed `generator`. The other arguments and return values are the same as
+    those of `collect_rollout()`, and `env` must support stepping a subset of
+    environments (see `VecPyTorchEnv.check_partial_steps()`).
+    """
+
+    rollout_episode_rewards = []
+    rollout_successes = []
+
+    # Sample actions for all environments and send them.
+    env_ids = np.arange(rollout.num_processes)
+    outputs = sample_env_actions(rollout, policy, env_ids, generator)
+    env.step_async_envs(outputs[1], env_ids)
+
+    # Rollout loop. ``pending_outputs`` holds the output of the policy for the step that
+    # each environment is currently taking.
+    pending_outputs = [output.clone() for output in outputs]
+    while rollout.rollout_step < rollout.rollout_length:
+
+        # Wait for the first workers to finish their step and record in ``rollout``.
+        obs, rewards, dones, _, env_ids = env.step_wait_ready(num_ready_workers)
+        values, actions, action_log_probs, hidden_states = [
+            output[env_ids] for output in pending_outputs
+        ]
+        rollout.add_step(
+            obs,
+            actions,
+            dones,
+            action_log_probs,
+            values,
+            rewards,
+            hidden_states,
+            env.task_indices[env_ids] if env.task_indices is not None else None,
+            env_ids,
+        )
 
-        # Get total episode reward, if it is given, and check for done.
-        for info in infos:
-            if "episode" in info.keys():
-                rollout_episode_rewards.append(info["episode"]["r"])
+        # Determine success or failure and total reward of each episode which ended
+        # during the step, from the episode statistics written by the environment.
+        ended = np.asarray(dones, dtype=bool)
+        successes = env.episode_info["success"][env_ids][ended]
+        rollout_successes += [
+            None if np.isnan(success) else float(success) for success in successes
+        ]
+        episode_rewards = env.episode_info["episode_return"][env_ids][ended]
+        rollout_episode_rewards += episode_rewards[~np.isnan(episode_rewards)].tolist()
+
+        # Sample actions for environments which haven't finished the rollout, and send
+        # them to their workers.
+        env_ids = env_ids[rollout.env_steps[env_ids].numpy() < rollout.rollout_length]
+        if len(env_ids) > 0:
+            outputs = sample_env_actions(rollout, policy, env_ids, generator)
+            env.step_async_envs(outputs[1], env_ids)
+            for pending_output, output in zip(pending_outputs, outputs):
+                pending_output[env_ids] = output
 
     return rollout, rollout_episode_rewards, rollout_successes
 
 
+def sample_env_actions(
+    rollout: RolloutStorage,
+    policy: PPOPolicy,
+    env_ids: np.ndarray,
+    generator: torch.Generator = None,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Sample actions from `policy` for the processes with indices `env_ids`, each at its
+    current step in `rollout`. Returns the outputs of `policy.act()`.
+    """
+
+    env_ids = torch.as_tensor(env_ids, dtype=torch.long)
+    steps = rollout.env_steps[env_ids]
+    with torch.no_grad():
+        return policy.act(
+            rollout.obs[steps, env_ids],
+            rollout.hidden_states[steps, env_ids],
+            rollout.dones[steps, env_ids],
+            rollout.task_indices[steps, env_ids] if rollout.has_task_indices else None,
+            policy.sample_noise(len(env_ids), generator),
+        )
+
+
 def evaluate(
     env: Env, policy: PPOPolicy, rollout: RolloutStorage, evaluation_episodes: int
 ) -> Tuple[List[float], List[float]]:
@@ -477,3 +974,95 @@ def evaluate(
         num_episodes += len(episode_rewards)
 
     return evaluation_rewards, evaluation_successes
+
+
+def evaluate_fast(
+    env: Env,
+    policy: PPOPolicy,
+    evaluation_episodes: int,
+    eval_state: Dict[str, torch.Tensor] = None,
+) -> Tuple[List[float], List[float]]:
+    """
+    Storage-free version of `evaluate()`, which runs ``env`` until
+    ``evaluation_episodes`` episodes have finished. If ``eval_state`` is None, ``env``
+    is reset at the start of evaluation. Otherwise, ``eval_state`` is a dictionary
+    which holds the observations, hidden states, and dones of each process at the end
+    of the previous call (it should be empty before the first call, in which case
+    ``env`` is reset), and it is updated in place at the end of evaluation, so that
+    the episodes in progress are continued by the next call. Actions are selected with
+    `PPOPolicy.act_greedy()`, so the critic isn't run, and the observations and hidden
+    states are only kept for the current step instead of being written into a
+    RolloutStorage. Each process stops stepping once it has finished its share of the
+    episodes, so that the episodes aren't biased towards processes with short
+    episodes. If ``env`` can't step a subset of environments, finished processes keep
+    stepping but their episodes are ignored. Returns a list of the total reward and
+    success/failure for each episode.
+    """
+
+    num_processes = env.num_envs
+    env_quota = int(np.ceil(evaluation_episodes / num_processes))
+    partial_steps = env.supports_partial_steps()
+    device = policy.policy_network.device
+
+    # Reset environment and initialize the policy inputs for each process, unless we
+    # are continuing from a previous evaluation.
+    if eval_state is not None and len(eval_state) > 0:
+        obs = eval_state["obs"]
+        hidden_states = eval_state["hidden_states"]
+        dones = eval_state["dones"]
+    else:
+        obs = env.reset().clone()
+        hidden_size = (
+            policy.policy_network.recurrent_hidden_size if policy.recurrent else 1
+        )
+        hidden_states = torch.zeros(num_processes, hidden_size, device=device)
+        dones = torch.zeros(num_processes, 1)
+    env_episodes = np.zeros(num_processes, dtype=int)
+
+    evaluation_rewards = []
+    evaluation_successes = []
+    while len(evaluation_rewards) < evaluation_episodes:
+
+        # Select actions for the processes which haven't finished their episodes, along
+        # with any other processes run by the same workers.
+        env_ids = np.arange(num_processes)
+        if partial_steps:
+            env_ids = env.get_worker_envs(np.nonzero(env_episodes < env_quota)[0])
+        ids = torch.as_tensor(env_ids, dtype=torch.long)
+        task_indices = env.task_indices[ids] if env.task_indices is not None else None
+        with torch.no_grad():
+            actions, hidden_states[ids] = policy.act_greedy(
+                obs[ids].to(device),
+                hidden_states[ids],
+                dones[ids].to(device),
+                task_indices,
+            )
+
+        # Perform step.
+        if partial_steps:
+            env.step_async_envs(actions, env_ids)
+            step_obs, _, step_dones, _, env_ids = env.step_wait_ready(len(env_ids))
+        else:
+            step_obs, _, step_dones, _ = env.step(actions)
+        ended = np.asarray(step_dones, dtype=bool)
+        obs[env_ids] = step_obs
+        dones[env_ids] = torch.from_numpy(ended).float().unsqueeze(-1)
+
+        # Record the total reward and success of each episode which ended during the
+        # step, for processes which haven't finished their episodes.
+        for env_id in env_ids[ended]:
+            episode_reward = env.episode_info["episode_return"][env_id]
+            if env_episodes[env_id] >= env_quota or np.isnan(episode_reward):
+                continue
+            success = env.episode_info["success"][env_id]
+            evaluation_rewards.append(float(episode_reward))
+            evaluation_successes.append(None if np.isnan(success) else float(success))
+            env_episodes[env_id] += 1
+
+    # Save the policy inputs of each process for the next evaluation, if necessary.
+    if eval_state is not None:
+        eval_state["obs"] = obs
+        eval_state["hidden_states"] = hidden_states
+        eval_state["dones"] = dones
+
+    return evaluation_rewards, evaluation_successes
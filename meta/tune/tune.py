@@ -14,6 +14,7 @@ import itertools
 from typing import Dict, Any, Tuple, Callable
 
 from meta.train.train import train
+from meta.train.env import shutdown_env_pool
 from meta.tune.mutate import mutate_train_config
 from meta.tune.utils import check_name_uniqueness, strip_config, get_start_pos
 from meta.tune.params import (
@@ -189,6 +190,9 @@ def tune(tune_config: Dict[str, Any]) -> Dict[str, Any]:
         checkpoint,
     )
 
+    # Close any environments kept between trials.
+    shutdown_env_pool()
+
     # Save results and config.
     if base_name is not None:
 
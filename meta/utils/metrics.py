@@ -38,13 +38,17 @@ class Metrics:
 
         return message
 
-    def update(self, update_values: Dict[str, List[float]]) -> None:
+    def update(
+        self, update_values: Dict[str, List[float]], iteration: int = None
+    ) -> None:
         """
         Update performance metrics with a sequence of the most recent episode rewards.
+        `iteration` is the training iteration at which the values were produced, which
+        is stored along with each value (see `Metric.update()`).
         """
 
         for metric_name, metric_values in update_values.items():
-            getattr(self, metric_name).update(metric_values)
+            getattr(self, metric_name).update(metric_values, iteration)
 
     def current_values(self) -> Dict[str, float]:
         """
@@ -84,7 +88,8 @@ class Metric:
         moving average of the past `window_len` values, a moving standard deviation of
         the past `window_len` values, and a maximum average so far. If `point_avg` is
         True, then `update` will condense the list of given values into their average
-        and treat it as a single update for the metric.
+        and treat it as a single update for the metric. For each value in the history,
+        we also keep the training iteration at which it was produced.
         """
 
         self.window_len = window_len
@@ -92,11 +97,12 @@ class Metric:
 
         # Metric values.
         self.history: List[float] = []
+        self.iterations: List[int] = []
         self.mean: List[float] = []
         self.stdev: List[float] = []
         self.maximum: float = None
 
-        self.state_vars = ["history", "mean", "stdev", "maximum"]
+        self.state_vars = ["history", "iterations", "mean", "stdev", "maximum"]
 
     def __repr__(self) -> str:
         """ String representation of ``self``. """
@@ -110,8 +116,11 @@ class Metric:
 
         return message
 
-    def update(self, values: List[float]) -> None:
-        """ Update history, mean, and stdev with new values. """
+    def update(self, values: List[float], iteration: int = None) -> None:
+        """
+        Update history, mean, and stdev with new values, which were produced at
+        training iteration `iteration`.
+        """
 
         # Replace ``values`` with average of ``values`` if self.point_avg, using recent
         # history to fill in if ``values`` is empty.
@@ -130,6 +139,7 @@ class Metric:
         # Add each new value to history and update running estimates.
         for value in values:
             self.history.append(value)
+            self.iterations.append(iteration)
 
             # Update moving average and standard deviation.
             self.mean.append(np.mean(self.history[-self.window_len :]))
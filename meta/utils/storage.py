@@ -2,7 +2,7 @@
 Definition of RolloutStorage, an object to hold rollout information for one or more episodes.
 """
 
-from typing import Dict, Tuple, Generator, List
+from typing import Dict, Tuple, Generator, List, Union
 
 import torch
 from torch.utils.data.sampler import BatchSampler, SubsetRandomSampler
@@ -56,6 +56,7 @@ class RolloutStorage:
         self.hidden_state_size = hidden_state_size
         self.device = device if device is not None else torch.device("cpu")
         self.rollout_step = 0
+        self.feedforward_hidden_states = None
         self.members = [
             "obs",
             "value_preds",
@@ -64,6 +65,7 @@ class RolloutStorage:
             "rewards",
             "hidden_states",
             "dones",
+            "task_indices",
         ]
 
         # Initialize rollout information.
@@ -97,6 +99,14 @@ class RolloutStorage:
         self.hidden_states = torch.zeros(
             self.rollout_length + 1, self.num_processes, self.hidden_state_size
         )
+        self.task_indices = torch.zeros(
+            self.rollout_length + 1, self.num_processes, dtype=torch.long
+        )
+        self.has_task_indices = False
+
+        # Number of steps added for each process, which can differ between processes
+        # when steps are added for a subset of processes with `add_step()`.
+        self.env_steps = torch.zeros(self.num_processes, dtype=torch.long)
 
         # Set device.
         self.to(self.device)
@@ -110,9 +120,14 @@ class RolloutStorage:
         value_pred: torch.Tensor,
         reward: torch.Tensor,
         hidden_state: torch.Tensor,
+        task_indices: torch.Tensor = None,
+        env_ids: torch.Tensor = None,
     ) -> None:
         """
-        Add an environment step to storage.
+        Add an environment step to storage. If `env_ids` is None, the step is added for
+        all processes at once. Otherwise, the step is only added for the processes with
+        indices `env_ids`, each at its own step (see `self.env_steps`), and each of the
+        other arguments holds the values for these processes only.
 
         obs : torch.Tensor
             Observation returned from environment after step was taken.
@@ -128,8 +143,27 @@ class RolloutStorage:
             Reward earned from environment step.
         hidden_state : torch.Tensor,
             Hidden state of recurrent layer of policy at step.
+        task_indices : torch.Tensor,
+            Integer task index of each process for the observation returned from the
+            environment step, if the environment provides them.
+        env_ids : torch.Tensor,
+            Indices of the processes to add the step for, or None for all processes.
         """
 
+        if env_ids is not None:
+            self.add_env_steps(
+                obs,
+                action,
+                dones,
+                action_log_prob,
+                value_pred,
+                reward,
+                hidden_state,
+                task_indices,
+                env_ids,
+            )
+            return
+
         if self.rollout_step >= self.rollout_length:
             raise ValueError("RolloutStorage object is full.")
 
@@ -147,10 +181,56 @@ class RolloutStorage:
         self.value_preds[self.rollout_step] = value_pred
         self.rewards[self.rollout_step] = reward
         self.hidden_states[self.rollout_step + 1] = hidden_state
+        if task_indices is not None:
+            self.task_indices[self.rollout_step + 1] = task_indices
 
         self.rollout_step += 1
+        self.env_steps += 1
+
+    def add_env_steps(
+        self,
+        obs: torch.Tensor,
+        action: torch.Tensor,
+        dones: List[bool],
+        action_log_prob: torch.Tensor,
+        value_pred: torch.Tensor,
+        reward: torch.Tensor,
+        hidden_state: torch.Tensor,
+        task_indices: torch.Tensor,
+        env_ids: torch.Tensor,
+    ) -> None:
+        """
+        Add an environment step to storage for the processes with indices `env_ids`.
+        Each process is written at its own step, and `self.rollout_step` is the number
+        of steps which have been added for every process.
+        """
+
+        env_ids = torch.as_tensor(env_ids, dtype=torch.long)
+        steps = self.env_steps[env_ids]
+        if torch.any(steps >= self.rollout_length):
+            raise ValueError("RolloutStorage object is full.")
+
+        if action.shape == torch.Size([len(env_ids)]):
+            action = action.unsqueeze(-1)
 
-    def set_initial_obs(self, obs: torch.Tensor) -> None:
+        self.obs[steps + 1, env_ids] = obs.to(self.device)
+        self.actions[steps, env_ids] = action.to(self.device, self.actions.dtype)
+        self.dones[steps + 1, env_ids] = torch.Tensor(
+            [[1.0] if done else [0.0] for done in dones]
+        ).to(self.device)
+        self.action_log_probs[steps, env_ids] = action_log_prob.to(self.device)
+        self.value_preds[steps, env_ids] = value_pred.to(self.device)
+        self.rewards[steps, env_ids] = reward.to(self.device)
+        self.hidden_states[steps + 1, env_ids] = hidden_state.to(self.device)
+        if task_indices is not None:
+            self.task_indices[steps + 1, env_ids] = task_indices.to(self.device)
+
+        self.env_steps[env_ids] += 1
+        self.rollout_step = int(self.env_steps.min())
+
+    def set_initial_obs(
+        self, obs: torch.Tensor, task_indices: torch.Tensor = None
+    ) -> None:
         """
         Set the first observation in storage.
 
@@ -158,22 +238,45 @@ class RolloutStorage:
         ---------
         obs : torch.Tensor
             Observation returned from the environment.
+        task_indices : torch.Tensor
+            Integer task index of each process for `obs`, if the environment provides
+            them. If given, the task indices of each step will be stored and returned
+            with each minibatch, and they should also be passed to `add_step()`.
         """
 
         self.obs[0].copy_(obs)
+        if task_indices is not None:
+            self.task_indices[0].copy_(task_indices)
+            self.has_task_indices = True
+
+    def get_task_indices(self, step: int) -> torch.Tensor:
+        """
+        Return the task indices of each process at step `step`, or None if the rollout
+        doesn't hold task indices.
+        """
+
+        return self.task_indices[step] if self.has_task_indices else None
 
-    def reset(self) -> None:
+    def reset(self, source: "RolloutStorage" = None) -> None:
         """
         Bring obs, hidden state, and done from last step into first step for next
-        rollout.
+        rollout. If `source` is not None, these are taken from the last step of
+        `source` instead, so that the next rollout can be collected into this object
+        while `source` is still in use.
         """
 
-        self.obs[0].copy_(self.obs[self.rollout_step])
-        self.hidden_states[0].copy_(self.hidden_states[self.rollout_step])
-        self.dones[0].copy_(self.dones[self.rollout_step])
+        source = self if source is None else source
+        self.obs[0].copy_(source.obs[source.rollout_step])
+        self.hidden_states[0].copy_(source.hidden_states[source.rollout_step])
+        self.dones[0].copy_(source.dones[source.rollout_step])
+        self.task_indices[0].copy_(source.task_indices[source.rollout_step])
+        self.has_task_indices = source.has_task_indices
         self.rollout_step = 0
+        self.env_steps.zero_()
 
-    def feedforward_minibatch_generator(self, num_minibatch: int) -> Generator:
+    def feedforward_minibatch_generator(
+        self, num_minibatch: int, mode: str = "gather"
+    ) -> Generator:
         """
         Generates minibatches from rollout to train a feedforward policy network. Note
         that this samples from the entire RolloutStorage object, even if only a small
@@ -183,11 +286,21 @@ class RolloutStorage:
         ---------
         num_minibatch : int
             Number of minibatches to return.
+        mode : str
+            How minibatches are constructed. With "sampler", a list of indices is
+            sampled for each minibatch, and each member is indexed with this list. With
+            "gather", a single permutation of all steps is drawn, each member is
+            gathered once into a contiguous permuted buffer, and each minibatch is a
+            slice of these buffers, which avoids a copy for each minibatch. Both modes
+            draw the same permutation, so they produce identical minibatches.
 
         Yields
         ------
-        minibatch: Tuple[List[int], torch.Tensor, ...]
-            Tuple of batch indices with tensors containing rollout minibatch info.
+        minibatch: Tuple[Union[List[int], torch.Tensor], torch.Tensor, ...]
+            Tuple of batch indices with tensors containing rollout minibatch info. The
+            batch indices are a list in "sampler" mode and a tensor in "gather" mode.
+            The last element holds the task index of each step, or None if the rollout
+            doesn't hold task indices.
         """
 
         # Compute minibatch size.
@@ -200,12 +313,6 @@ class RolloutStorage:
                 % (num_minibatch, self.rollout_length, self.num_processes)
             )
 
-        sampler = BatchSampler(
-            sampler=SubsetRandomSampler(range(total_steps)),
-            batch_size=minibatch_size,
-            drop_last=True,
-        )
-
         # Here we aggregate the obs, value_preds, etc. from each process into one
         # dimension.
         agg_obs = self.obs[:-1].view(total_steps, *self.space_shapes["obs"])
@@ -213,21 +320,71 @@ class RolloutStorage:
         agg_actions = self.actions.view(total_steps, *self.space_shapes["action"])
         agg_action_log_probs = self.action_log_probs.view(total_steps)
         agg_dones = self.dones[:-1].view(total_steps)
+        agg_task_indices = self.task_indices[:-1].view(total_steps)
 
-        # We need to return some hidden state, so just return zeros every time.
-        hidden_states_batch = torch.zeros(total_steps, self.hidden_state_size)
+        # We need to return some hidden state, so just return zeros every time. The
+        # zeros are allocated once and reused across calls.
+        if self.feedforward_hidden_states is None:
+            self.feedforward_hidden_states = torch.zeros(
+                total_steps, self.hidden_state_size
+            )
+        hidden_states_batch = self.feedforward_hidden_states
 
-        for batch_indices in sampler:
+        if mode == "sampler":
+            sampler = BatchSampler(
+                sampler=SubsetRandomSampler(range(total_steps)),
+                batch_size=minibatch_size,
+                drop_last=True,
+            )
+
+            for batch_indices in sampler:
+
+                # Yield a minibatch corresponding to indices from sampler.
+                # The -1 here is to exclude the obs/value_pred from after the last step.
+                obs_batch = agg_obs[batch_indices]
+                value_preds_batch = agg_value_preds[batch_indices]
+                actions_batch = agg_actions[batch_indices]
+                action_log_probs_batch = agg_action_log_probs[batch_indices]
+                dones_batch = agg_dones[batch_indices]
+                task_indices_batch = (
+                    agg_task_indices[batch_indices] if self.has_task_indices else None
+                )
+
+                yield batch_indices, obs_batch, value_preds_batch, actions_batch, action_log_probs_batch, dones_batch, hidden_states_batch, task_indices_batch
+
+        elif mode == "gather":
+
+            # Draw a permutation of steps (the same one that the sampler above draws)
+            # and gather each member into a permuted buffer, dropping the steps that
+            # don't fill a whole minibatch.
+            permutation = torch.randperm(total_steps)[: num_minibatch * minibatch_size]
+            device_permutation = permutation.to(self.device)
+            perm_obs = agg_obs[device_permutation]
+            perm_value_preds = agg_value_preds[device_permutation]
+            perm_actions = agg_actions[device_permutation]
+            perm_action_log_probs = agg_action_log_probs[device_permutation]
+            perm_dones = agg_dones[device_permutation]
+            perm_task_indices = agg_task_indices[device_permutation]
+
+            for minibatch in range(num_minibatch):
+
+                # Yield a minibatch as a slice of the permuted buffers.
+                start = minibatch * minibatch_size
+                end = start + minibatch_size
+                batch_indices = permutation[start:end]
+                obs_batch = perm_obs[start:end]
+                value_preds_batch = perm_value_preds[start:end]
+                actions_batch = perm_actions[start:end]
+                action_log_probs_batch = perm_action_log_probs[start:end]
+                dones_batch = perm_dones[start:end]
+                task_indices_batch = (
+                    perm_task_indices[start:end] if self.has_task_indices else None
+                )
 
-            # Yield a minibatch corresponding to indices from sampler.
-            # The -1 here is to exclude the obs/value_pred from after the last step.
-            obs_batch = agg_obs[batch_indices]
-            value_preds_batch = agg_value_preds[batch_indices]
-            actions_batch = agg_actions[batch_indices]
-            action_log_probs_batch = agg_action_log_probs[batch_indices]
-            dones_batch = agg_dones[batch_indices]
+                yield batch_indices, obs_batch, value_preds_batch, actions_batch, action_log_probs_batch, dones_batch, hidden_states_batch, task_indices_batch
 
-            yield batch_indices, obs_batch, value_preds_batch, actions_batch, action_log_probs_batch, dones_batch, hidden_states_batch
+        else:
+            raise ValueError("Unsupported minibatch mode: %s" % str(mode))
 
     def recurrent_minibatch_generator(self, num_minibatch: int) -> Generator:
         """
@@ -242,8 +399,11 @@ class RolloutStorage:
 
         Yields
         ------
-        minibatch: Tuple[List[int], torch.Tensor, ...]
-            Tuple of batch indices with tensors containing rollout minibatch info.
+        minibatch: Tuple[torch.Tensor, ...]
+            Tuple of the indices of the processes in the minibatch with tensors
+            containing rollout minibatch info. Each tensor holds the steps of each
+            process, ordered by step and then process. The last element holds the task
+            index of each step, or None if the rollout doesn't hold task indices.
         """
 
         # Compute number trajectories (single process rollout) per minibatch.
@@ -259,39 +419,23 @@ class RolloutStorage:
 
         # Each loop iteration constructs one minibatch.
         for minibatch in range(num_minibatch):
-            batch_indices = []
-            obs_batch_list = []
-            value_preds_batch_list = []
-            actions_batch_list = []
-            action_log_probs_batch_list = []
-            dones_batch_list = []
-            hidden_states_batch_list = []
-
-            # Add trajectory info to list. We only take the first hidden_state from each
-            # trajectory, since hidden states for later steps will be computed during
-            # the training step.
-            for trajectory_index in range(trajectory_per_minibatch):
-                process = trajectory_permutation[
-                    minibatch * trajectory_per_minibatch + trajectory_index
-                ]
-                batch_indices.append(process)
-                obs_batch_list.append(self.obs[: self.rollout_step, process])
-                value_preds_batch_list.append(
-                    self.value_preds[: self.rollout_step, process]
-                )
-                actions_batch_list.append(self.actions[:, process])
-                action_log_probs_batch_list.append(self.action_log_probs[:, process])
-                dones_batch_list.append(self.dones[: self.rollout_step, process])
-                hidden_states_batch_list.append(self.hidden_states[0:1, process])
-
-            # Stack each list into a single tensor of size (self.rollout_step,
-            # trajectory_per_minibatch, ...).
-            obs_batch = torch.stack(obs_batch_list, 1)
-            value_preds_batch = torch.stack(value_preds_batch_list, 1)
-            actions_batch = torch.stack(actions_batch_list, 1)
-            action_log_probs_batch = torch.stack(action_log_probs_batch_list, 1)
-            dones_batch = torch.stack(dones_batch_list, 1)
-            hidden_states_batch = torch.stack(hidden_states_batch_list, 1)
+
+            # Gather trajectory info for the processes in the minibatch, each of size
+            # (self.rollout_step, trajectory_per_minibatch, ...). We only take the first
+            # hidden_state from each trajectory, since hidden states for later steps
+            # will be computed during the training step.
+            start = minibatch * trajectory_per_minibatch
+            batch_indices = trajectory_permutation[
+                start : start + trajectory_per_minibatch
+            ]
+            processes = batch_indices.to(self.device)
+            obs_batch = self.obs[: self.rollout_step, processes]
+            value_preds_batch = self.value_preds[: self.rollout_step, processes]
+            actions_batch = self.actions[:, processes]
+            action_log_probs_batch = self.action_log_probs[:, processes]
+            dones_batch = self.dones[: self.rollout_step, processes]
+            hidden_states_batch = self.hidden_states[0:1, processes]
+            task_indices_batch = self.task_indices[: self.rollout_step, processes]
 
             # Combine first two dimensions of each tensor, so that they are each of size
             # (self.rollout_step * trajectory_per_minibatch, ...).
@@ -301,6 +445,9 @@ class RolloutStorage:
             action_log_probs_batch = combine_first_two_dims(action_log_probs_batch)
             dones_batch = combine_first_two_dims(dones_batch)
             hidden_states_batch = combine_first_two_dims(hidden_states_batch)
+            task_indices_batch = combine_first_two_dims(task_indices_batch)
+            if not self.has_task_indices:
+                task_indices_batch = None
 
             # Reshape tensors whose elements are necessarily single numbers (like value
             # preds) by squeezing the singleton dimension.
@@ -308,7 +455,7 @@ class RolloutStorage:
             action_log_probs_batch = action_log_probs_batch.squeeze(-1)
             dones_batch = dones_batch.squeeze(-1)
 
-            yield batch_indices, obs_batch, value_preds_batch, actions_batch, action_log_probs_batch, dones_batch, hidden_states_batch
+            yield batch_indices, obs_batch, value_preds_batch, actions_batch, action_log_probs_batch, dones_batch, hidden_states_batch, task_indices_batch
 
     def to(self, device: torch.device) -> None:
         """ Move tensor members to ``device``. """
@@ -337,6 +484,9 @@ class RolloutStorage:
         ]
         self.rewards[pos:end] = new_rollout.rewards[: new_rollout.rollout_step]
         self.hidden_states[pos:end] = new_rollout.rewards[: new_rollout.rollout_step]
+        self.task_indices[pos:end] = new_rollout.task_indices[
+            : new_rollout.rollout_step
+        ]
 
     def print_devices(self) -> None:
         """ Print devices of tensor members. """
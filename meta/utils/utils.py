@@ -100,6 +100,72 @@ def combine_first_two_dims(t: torch.Tensor) -> torch.Tensor:
     return t.view(t.shape[0] * t.shape[1], *t.shape[2:])
 
 
+def sum_by_task(
+    values: torch.Tensor, task_indices: torch.Tensor, num_tasks: int
+) -> torch.Tensor:
+    """
+    Sum the entries of ``values`` that belong to each task with a single scatter
+    operation. Can be used for any per-task reduction of per-example quantities, such
+    as task-specific losses or metrics.
+
+    Arguments
+    ---------
+    values : torch.Tensor
+        Tensor of shape `(N, ...)` holding a value for each of N examples.
+    task_indices : torch.Tensor
+        Tensor of shape `(N,)` holding the index of the task of each example.
+    num_tasks : int
+        Total number of tasks.
+
+    Returns
+    -------
+    task_sums : torch.Tensor
+        Tensor of shape `(num_tasks, ...)` on the same device as ``values``, whose i-th
+        element is the sum of the values for examples from task i (zero for tasks
+        without any examples).
+    """
+
+    task_sums = torch.zeros(
+        num_tasks, *values.shape[1:], dtype=values.dtype, device=values.device
+    )
+    return task_sums.index_add(0, task_indices.to(values.device), values)
+
+
+def reverse_linear_scan(values: torch.Tensor, coeffs: torch.Tensor) -> torch.Tensor:
+    """
+    Solve the linear recurrence x_t = values_t + coeffs_t * x_{t+1} along the first
+    dimension, with x_{T-1} = values_{T-1}, using a parallel reverse scan. At iteration
+    i of the scan, the entry for step t holds the recurrence unrolled over steps t to t
+    + 2^i - 1, and combining it with the entry for step t + 2^i doubles this window, so
+    the whole sequence is covered after ceil(log2(T)) vectorized iterations. The last
+    element of ``coeffs`` is unused. A forward recurrence can be solved by flipping the
+    inputs and the result along the first dimension.
+
+    Arguments
+    ---------
+    values : torch.Tensor
+        Tensor of shape `(T, ...)` holding the additive term of each step.
+    coeffs : torch.Tensor
+        Tensor of shape `(T, ...)` holding the coefficient of each step.
+
+    Returns
+    -------
+    x : torch.Tensor
+        Tensor of shape `(T, ...)` holding the solution of the recurrence.
+    """
+
+    # Combine the entry for each step with the entry `offset` steps later. Steps within
+    # `offset` of the end of the sequence are already complete.
+    x = values
+    offset = 1
+    while offset < len(x):
+        x = torch.cat([x[:-offset] + coeffs[:-offset] * x[offset:], x[-offset:]])
+        coeffs = torch.cat([coeffs[:-offset] * coeffs[offset:], coeffs[-offset:]])
+        offset *= 2
+
+    return x
+
+
 def save_dir_from_name(name: str) -> str:
     """
     Return the name of the directory to store results of training run with name
@@ -121,14 +187,33 @@ def aligned_train_configs(config1: Dict[str, Any], config2: Dict[str, Any]) -> b
         "final_lr",
         "normalize_transition",
         "normalize_first_n",
+        "policy_normalization",
         "architecture_config",
         "evaluation_freq",
         "evaluation_episodes",
+        "eval_processes",
+        "fast_eval",
         "time_limit",
     ]
+
+    # Settings which were added after checkpoints could already be saved are read
+    # with a default value that matches the behavior from before they were added, so
+    # that older checkpoints can still be resumed.
+    added_settings = {
+        "policy_normalization": False,
+        "eval_processes": None,
+        "fast_eval": False,
+    }
+
     equal = True
     for setting in aligned_settings:
-        equal = equal and config1[setting] == config2[setting]
+        if setting in added_settings:
+            value1 = config1.get(setting, added_settings[setting])
+            value2 = config2.get(setting, added_settings[setting])
+        else:
+            value1 = config1[setting]
+            value2 = config2[setting]
+        equal = equal and value1 == value2
 
     return equal
 
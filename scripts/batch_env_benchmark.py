@@ -0,0 +1,63 @@
+"""
+Micro-benchmark comparing the environment step throughput of the batched and
+multi-process implementations of the built-in test environments over a range of
+numbers of environment copies.
+"""
+
+import time
+
+import torch
+
+from meta.train.env import get_env
+
+
+ENV_NAME = "unique-env"
+NUM_PROCESSES = [1, 8, 64, 1024, 4096]
+MAX_WORKERS = 64
+NUM_STEPS = 100
+TIME_LIMIT = 50
+
+
+def main() -> None:
+    """ Main function. """
+
+    print(
+        "%15s %18s %18s %10s"
+        % ("num_processes", "batched (steps/s)", "workers (steps/s)", "speedup")
+    )
+    for num_processes in NUM_PROCESSES:
+
+        # Time stepping each implementation. The multi-process implementation runs at
+        # most MAX_WORKERS worker processes.
+        throughputs = {}
+        for batched in [True, False]:
+            env = get_env(
+                ENV_NAME,
+                num_processes,
+                time_limit=TIME_LIMIT,
+                normalize_transition=False,
+                envs_per_worker=-(-num_processes // MAX_WORKERS),
+                batched=batched,
+            )
+            env.reset()
+            actions = torch.zeros(num_processes, 1, dtype=torch.long)
+            start = time.perf_counter()
+            for _ in range(NUM_STEPS):
+                env.step(actions)
+            elapsed = time.perf_counter() - start
+            throughputs[batched] = num_processes * NUM_STEPS / elapsed
+            env.close()
+
+        print(
+            "%15d %18.0f %18.0f %10.2f"
+            % (
+                num_processes,
+                throughputs[True],
+                throughputs[False],
+                throughputs[True] / throughputs[False],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
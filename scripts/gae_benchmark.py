@@ -0,0 +1,97 @@
+"""
+Micro-benchmark comparing the loop and scan GAE backends of PPOPolicy over a grid
+of rollout lengths and numbers of processes.
+"""
+
+import time
+
+import numpy as np
+import torch
+from gym.spaces import Box
+
+from meta.train.ppo import PPOPolicy
+from meta.utils.storage import RolloutStorage
+
+
+ROLLOUT_LENGTHS = [32, 128, 512, 2048]
+NUM_PROCESSES = [1, 8, 32, 128]
+NUM_TRIALS = 10
+DONE_PROB = 0.01
+
+OBS_SPACE = Box(low=-np.inf, high=np.inf, shape=(4,))
+ACTION_SPACE = Box(low=-1, high=1, shape=(2,))
+ARCHITECTURE_CONFIG = {
+    "type": "mlp",
+    "recurrent": False,
+    "recurrent_hidden_size": None,
+    "actor_config": {"num_layers": 2, "hidden_size": 8},
+    "critic_config": {"num_layers": 2, "hidden_size": 8},
+}
+
+
+def main() -> None:
+    """ Main function. """
+
+    print(
+        "%15s %15s %12s %12s %10s %12s"
+        % (
+            "rollout_length",
+            "num_processes",
+            "loop (ms)",
+            "scan (ms)",
+            "speedup",
+            "max diff",
+        )
+    )
+    for rollout_length in ROLLOUT_LENGTHS:
+        for num_processes in NUM_PROCESSES:
+
+            # Construct policy and fill rollout with random rewards, value
+            # predictions, and dones.
+            policy = PPOPolicy(
+                observation_space=OBS_SPACE,
+                action_space=ACTION_SPACE,
+                num_minibatch=1,
+                num_processes=num_processes,
+                rollout_length=rollout_length,
+                num_updates=1,
+                architecture_config=ARCHITECTURE_CONFIG,
+            )
+            rollout = RolloutStorage(
+                rollout_length=rollout_length,
+                observation_space=OBS_SPACE,
+                action_space=ACTION_SPACE,
+                num_processes=num_processes,
+                hidden_state_size=1,
+            )
+            rollout.rollout_step = rollout_length
+            rollout.rewards.copy_(torch.randn_like(rollout.rewards))
+            rollout.value_preds.copy_(torch.randn_like(rollout.value_preds))
+            rollout.dones.copy_((torch.rand_like(rollout.dones) < DONE_PROB).float())
+
+            # Time each backend.
+            times = {}
+            returns = {}
+            for backend in ["loop", "scan"]:
+                compute_returns = getattr(policy, "compute_returns_%s" % backend)
+                start = time.perf_counter()
+                for _ in range(NUM_TRIALS):
+                    returns[backend] = compute_returns(rollout)
+                times[backend] = (time.perf_counter() - start) / NUM_TRIALS * 1000
+
+            max_diff = float(torch.max(torch.abs(returns["loop"] - returns["scan"])))
+            print(
+                "%15d %15d %12.3f %12.3f %10.2f %12.2e"
+                % (
+                    rollout_length,
+                    num_processes,
+                    times["loop"],
+                    times["scan"],
+                    times["loop"] / times["scan"],
+                    max_diff,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Micro-benchmark comparing the "sampler" and "gather" modes of
+RolloutStorage.feedforward_minibatch_generator over a grid of rollout lengths and
+numbers of processes.
+"""
+
+import time
+
+import numpy as np
+import torch
+from gym.spaces import Box
+
+from meta.utils.storage import RolloutStorage
+
+
+ROLLOUT_LENGTHS = [128, 512, 2048]
+NUM_PROCESSES = [8, 32, 128]
+NUM_MINIBATCH = 32
+NUM_TRIALS = 5
+
+OBS_SPACE = Box(low=-np.inf, high=np.inf, shape=(49,))
+ACTION_SPACE = Box(low=-1, high=1, shape=(4,))
+
+
+def main() -> None:
+    """ Main function. """
+
+    print(
+        "%15s %15s %14s %14s %10s"
+        % ("rollout_length", "num_processes", "sampler (ms)", "gather (ms)", "speedup")
+    )
+    for rollout_length in ROLLOUT_LENGTHS:
+        for num_processes in NUM_PROCESSES:
+
+            # Construct rollout and fill with random values.
+            rollout = RolloutStorage(
+                rollout_length=rollout_length,
+                observation_space=OBS_SPACE,
+                action_space=ACTION_SPACE,
+                num_processes=num_processes,
+                hidden_state_size=1,
+            )
+            for member in rollout.members:
+                tensor = getattr(rollout, member)
+                if tensor.is_floating_point():
+                    tensor.copy_(torch.rand_like(tensor))
+            rollout.rollout_step = rollout_length
+
+            # Time one epoch of minibatches in each mode.
+            times = {}
+            for mode in ["sampler", "gather"]:
+                start = time.perf_counter()
+                for _ in range(NUM_TRIALS):
+                    for minibatch in rollout.feedforward_minibatch_generator(
+                        NUM_MINIBATCH, mode=mode
+                    ):
+                        pass
+                times[mode] = (time.perf_counter() - start) / NUM_TRIALS * 1000
+
+            print(
+                "%15d %15d %14.3f %14.3f %10.2f"
+                % (
+                    rollout_length,
+                    num_processes,
+                    times["sampler"],
+                    times["gather"],
+                    times["sampler"] / times["gather"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
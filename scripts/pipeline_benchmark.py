@@ -0,0 +1,123 @@
+"""
+Benchmark comparing the serial and pipelined rollout collection of train.py on
+synthetic multi-task benchmarks over a range of simulated environment costs, so that
+the time of an environment step ranges from below to above the time of a forward pass
+of the policy.
+"""
+
+import time
+
+import torch
+
+from meta.train.env import get_env, register_synthetic_benchmark
+from meta.train.ppo import PPOPolicy
+from meta.train.train import collect_rollout, collect_rollout_pipelined
+from meta.utils.storage import RolloutStorage
+
+
+COMPUTE_COSTS = [0, 10, 30, 100]
+NUM_TASKS = 10
+NUM_PROCESSES = 16
+ENVS_PER_WORKER = 2
+ROLLOUT_LENGTH = 128
+NUM_TRIALS = 3
+TIME_LIMIT = 150
+
+ARCHITECTURE_CONFIG = {
+    "type": "mlp",
+    "recurrent": False,
+    "recurrent_hidden_size": None,
+    "actor_config": {"num_layers": 3, "hidden_size": 512},
+    "critic_config": {"num_layers": 3, "hidden_size": 512},
+}
+
+
+def main() -> None:
+    """ Main function. """
+
+    print(
+        "%13s %10s %10s %14s %16s %10s"
+        % (
+            "compute_cost",
+            "step (ms)",
+            "act (ms)",
+            "serial (ms)",
+            "pipelined (ms)",
+            "speedup",
+        )
+    )
+    for compute_cost in COMPUTE_COSTS:
+
+        # Construct environment, policy, and rollout.
+        env_name = "synthetic-benchmark-%d" % compute_cost
+        register_synthetic_benchmark(env_name, NUM_TASKS, compute_cost=compute_cost)
+        env = get_env(
+            env_name,
+            NUM_PROCESSES,
+            time_limit=TIME_LIMIT,
+            normalize_transition=False,
+            allow_early_resets=True,
+            envs_per_worker=ENVS_PER_WORKER,
+        )
+        policy = PPOPolicy(
+            observation_space=env.observation_space,
+            action_space=env.action_space,
+            num_minibatch=1,
+            num_processes=NUM_PROCESSES,
+            rollout_length=ROLLOUT_LENGTH,
+            num_updates=1,
+            architecture_config=ARCHITECTURE_CONFIG,
+            num_tasks=NUM_TASKS,
+        )
+        rollout = RolloutStorage(
+            rollout_length=ROLLOUT_LENGTH,
+            observation_space=env.observation_space,
+            action_space=env.action_space,
+            num_processes=NUM_PROCESSES,
+            hidden_state_size=1,
+        )
+        rollout.set_initial_obs(env.reset(), env.task_indices)
+
+        # Time an environment step and a forward pass of the policy separately.
+        actions = torch.zeros(NUM_PROCESSES, *env.action_space.shape)
+        start = time.perf_counter()
+        for _ in range(ROLLOUT_LENGTH):
+            env.step(actions)
+        step_time = (time.perf_counter() - start) / ROLLOUT_LENGTH * 1000
+        start = time.perf_counter()
+        with torch.no_grad():
+            for _ in range(ROLLOUT_LENGTH):
+                policy.act(
+                    rollout.obs[0],
+                    rollout.hidden_states[0],
+                    rollout.dones[0],
+                    rollout.get_task_indices(0),
+                )
+        act_time = (time.perf_counter() - start) / ROLLOUT_LENGTH * 1000
+
+        # Time each rollout collection method, per rollout step.
+        times = {}
+        for collect in [collect_rollout, collect_rollout_pipelined]:
+            start = time.perf_counter()
+            for _ in range(NUM_TRIALS):
+                collect(rollout, env, policy)
+                rollout.reset()
+            elapsed = time.perf_counter() - start
+            times[collect] = elapsed / (NUM_TRIALS * ROLLOUT_LENGTH) * 1000
+        env.close()
+
+        print(
+            "%13d %10.3f %10.3f %14.3f %16.3f %10.2f"
+            % (
+                compute_cost,
+                step_time,
+                act_time,
+                times[collect_rollout],
+                times[collect_rollout_pipelined],
+                times[collect_rollout] / times[collect_rollout_pipelined],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
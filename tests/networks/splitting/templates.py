@@ -24,15 +24,96 @@ from tests.helpers import DEFAULT_SETTINGS, get_obs_batch
 TOL = 2e-3
 
 
-def gradients_template(
+def forward_backend_template(
     settings: Dict[str, Any], splits_args: List[Dict[str, Any]]
+) -> None:
+    """
+    Template to test that the batched forward backend computes the same outputs and
+    gradients as the loop forward backend. The splits in `splits_args` are performed
+    after an initial forward pass, to check that the routing plan of the batched
+    backend is rebuilt when the splitting map changes.
+    """
+
+    # Set up case.
+    dim = settings["obs_dim"] + settings["num_tasks"]
+    observation_subspace = Box(low=-np.inf, high=np.inf, shape=(settings["obs_dim"],))
+    observation_subspace.seed(DEFAULT_SETTINGS["seed"])
+    hidden_size = dim
+
+    # Construct networks.
+    networks = {}
+    for backend in ["loop", "batched"]:
+        networks[backend] = BaseMultiTaskSplittingNetwork(
+            input_size=dim,
+            output_size=dim,
+            num_tasks=settings["num_tasks"],
+            num_layers=settings["num_layers"],
+            hidden_size=hidden_size,
+            forward_backend=backend,
+            device=settings["device"],
+        )
+
+    # Construct batch of observations concatenated with one-hot task vectors.
+    obs, task_indices = get_obs_batch(
+        batch_size=settings["num_processes"],
+        obs_space=observation_subspace,
+        num_tasks=settings["num_tasks"],
+    )
+
+    # Perform a forward pass with the batched network before splitting, so that the
+    # routing plan is built for the unsplit network. The plan shouldn't be rebuilt
+    # unless the splitting map changes.
+    networks["batched"](obs, task_indices)
+    routing_plan = networks["batched"].routing_plan
+    networks["batched"](obs, task_indices)
+    assert networks["batched"].routing_plan is routing_plan
+
+    # Split the networks according to `splits_args`.
+    for split_args in splits_args:
+        for network in networks.values():
+            network.split(**split_args)
+
+    # Re-initialize the new copies so different tasks will actually have different
+    # corresponding functions, and share the weights between the two networks.
+    state_dict = networks["loop"].state_dict()
+    for region in range(networks["loop"].num_regions):
+        for copy in range(1, int(networks["loop"].splitting_map.num_copies[region])):
+            weight_name = "regions.%d.%d.0.weight" % (region, copy)
+            bias_name = "regions.%d.%d.0.bias" % (region, copy)
+            state_dict[weight_name] = torch.rand(state_dict[weight_name].shape)
+            state_dict[bias_name] = torch.rand(state_dict[bias_name].shape)
+    for network in networks.values():
+        network.load_state_dict(state_dict)
+
+    # Compute outputs and gradients of each network.
+    outputs = {}
+    grads = {}
+    for backend, network in networks.items():
+        network.zero_grad()
+        outputs[backend] = network(obs, task_indices)
+        torch.sum(outputs[backend] ** 2).backward()
+        grads[backend] = [
+            param.grad if param.grad is not None else torch.zeros_like(param)
+            for param in network.parameters()
+        ]
+
+    # Compare outputs and gradients.
+    assert torch.allclose(outputs["loop"], outputs["batched"], atol=1e-6)
+    for loop_grad, batched_grad in zip(grads["loop"], grads["batched"]):
+        assert torch.allclose(loop_grad, batched_grad, atol=1e-5)
+
+
+def gradients_template(
+    settings: Dict[str, Any],
+    splits_args: List[Dict[str, Any]],
+    task_grads_backend: str = "loop",
 ) -> None:
     """
     Template to test that `get_task_grads()` correctly computes task-specific gradients
-    at each region of the network. For simplicity we compute the loss as half of the
-    squared norm of the output, and we make the following assumptions: each layer has
-    the same size, the activation function is Tanh for each layer, and the final layer
-    has no activation.
+    at each region of the network, using the backend `task_grads_backend`. For
+    simplicity we compute the loss as half of the squared norm of the output, and we
+    make the following assumptions: each layer has the same size, the activation
+    function is Tanh for each layer, and the final layer has no activation.
     """
 
     # Set up case.
@@ -48,6 +129,7 @@ def gradients_template(
         num_tasks=settings["num_tasks"],
         num_layers=settings["num_layers"],
         hidden_size=hidden_size,
+        task_grads_backend=task_grads_backend,
         device=settings["device"],
     )
 
@@ -246,6 +328,83 @@ def backward_template(
                         assert torch.allclose(param.grad, zero)
 
 
+def accumulate_grads_template(
+    settings: Dict[str, Any],
+    splits_args: List[Dict[str, Any]],
+    task_grads_backend: str = "loop",
+) -> None:
+    """
+    Template to test that `accumulate_task_grads()` leaves the same gradients in the
+    parameters of each region as a backward pass on the sum of the task losses. We
+    define each task loss as the squared norm of the output for inputs from the given
+    task.
+    """
+
+    # Set up case.
+    dim = settings["obs_dim"] + settings["num_tasks"]
+    observation_subspace = Box(low=-np.inf, high=np.inf, shape=(settings["obs_dim"],))
+    observation_subspace.seed(DEFAULT_SETTINGS["seed"])
+    hidden_size = dim
+
+    # Construct network.
+    network = BaseMultiTaskSplittingNetwork(
+        input_size=dim,
+        output_size=dim,
+        num_tasks=settings["num_tasks"],
+        num_layers=settings["num_layers"],
+        hidden_size=hidden_size,
+        task_grads_backend=task_grads_backend,
+        device=settings["device"],
+    )
+
+    # Split the network according to `splits_args`.
+    for split_args in splits_args:
+        network.split(**split_args)
+
+    # Re-initialize the new copies so different tasks will actually have different
+    # corresponding functions.
+    state_dict = network.state_dict()
+    for region in range(network.num_regions):
+        for copy in range(1, int(network.splitting_map.num_copies[region])):
+            weight_name = "regions.%d.%d.0.weight" % (region, copy)
+            bias_name = "regions.%d.%d.0.bias" % (region, copy)
+            state_dict[weight_name] = torch.rand(state_dict[weight_name].shape)
+            state_dict[bias_name] = torch.rand(state_dict[bias_name].shape)
+    network.load_state_dict(state_dict)
+
+    # Construct batch of observations concatenated with one-hot task vectors.
+    obs, task_indices = get_obs_batch(
+        batch_size=settings["num_processes"],
+        obs_space=observation_subspace,
+        num_tasks=settings["num_tasks"],
+    )
+
+    # Get output of network and compute task losses.
+    output = network(obs, task_indices)
+    task_losses = torch.stack(
+        [
+            torch.sum(output[task_indices == task] ** 2)
+            for task in range(settings["num_tasks"])
+        ]
+    )
+
+    # Accumulate gradients from task-specific gradients.
+    network.zero_grad()
+    task_grads = network.get_task_grads(task_losses)
+    network.accumulate_task_grads(task_grads)
+    accumulated_grads = [
+        param.grad.clone() if param.grad is not None else torch.zeros_like(param)
+        for param in network.parameters()
+    ]
+
+    # Compute gradients with a backward pass and compare.
+    network.zero_grad()
+    torch.sum(task_losses).backward()
+    for param, accumulated_grad in zip(network.parameters(), accumulated_grads):
+        grad = param.grad if param.grad is not None else torch.zeros_like(param)
+        assert torch.allclose(accumulated_grad, grad, atol=1e-6)
+
+
 def grad_diffs_template(settings: Dict[str, Any], grad_type: str) -> None:
     """
     Test that `get_task_grad_diffs()` correctly computes the pairwise difference between
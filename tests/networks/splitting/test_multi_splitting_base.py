@@ -20,8 +20,10 @@ from tests.helpers import DEFAULT_SETTINGS, get_obs_batch
 from tests.networks.splitting import BASE_SETTINGS
 from tests.networks.splitting.templates import (
     TOL,
+    forward_backend_template,
     gradients_template,
     backward_template,
+    accumulate_grads_template,
     grad_diffs_template,
     split_stats_template,
     split_v1_template,
@@ -234,6 +236,43 @@ def test_forward_multiple() -> None:
     assert torch.allclose(output, expected_output)
 
 
+def test_forward_batched_shared() -> None:
+    """
+    Test that the batched forward backend matches the loop forward backend when all
+    regions of the splitting network are fully shared.
+    """
+
+    splits_args = []
+    forward_backend_template(BASE_SETTINGS, splits_args)
+
+
+def test_forward_batched_single() -> None:
+    """
+    Test that the batched forward backend matches the loop forward backend when a
+    single region of the splitting network is split.
+    """
+
+    splits_args = [
+        {"region": 1, "copy": 0, "group1": [0, 3], "group2": [1, 2]},
+    ]
+    forward_backend_template(BASE_SETTINGS, splits_args)
+
+
+def test_forward_batched_multiple() -> None:
+    """
+    Test that the batched forward backend matches the loop forward backend when none
+    of the regions of the splitting network are fully shared.
+    """
+
+    splits_args = [
+        {"region": 0, "copy": 0, "group1": [0, 1], "group2": [2, 3]},
+        {"region": 1, "copy": 0, "group1": [0, 2], "group2": [1, 3]},
+        {"region": 1, "copy": 0, "group1": [0], "group2": [2]},
+        {"region": 2, "copy": 0, "group1": [0, 3], "group2": [1, 2]},
+    ]
+    forward_backend_template(BASE_SETTINGS, splits_args)
+
+
 def test_split_single() -> None:
     """
     Test that split() correctly sets new parameters when we perform a single split.
@@ -396,6 +435,87 @@ def test_task_grads_multiple() -> None:
     gradients_template(BASE_SETTINGS, splits_args)
 
 
+def test_task_grads_batched_shared() -> None:
+    """
+    Test that `get_task_grads()` correctly computes task-specific gradients at each
+    region of the network with the batched backend, in the case of a fully shared
+    network.
+    """
+
+    splits_args = []
+    gradients_template(BASE_SETTINGS, splits_args, task_grads_backend="batched")
+
+
+def test_task_grads_batched_single() -> None:
+    """
+    Test that `get_task_grads()` correctly computes task-specific gradients at each
+    region of the network with the batched backend, in the case of a single split
+    network.
+    """
+
+    splits_args = [
+        {"region": 1, "copy": 0, "group1": [0, 3], "group2": [1, 2]},
+    ]
+    gradients_template(BASE_SETTINGS, splits_args, task_grads_backend="batched")
+
+
+def test_task_grads_batched_multiple() -> None:
+    """
+    Test that `get_task_grads()` correctly computes task-specific gradients at each
+    region of the network with the batched backend, in the case of a multiple split
+    network.
+    """
+
+    splits_args = [
+        {"region": 0, "copy": 0, "group1": [0, 1], "group2": [2, 3]},
+        {"region": 1, "copy": 0, "group1": [0, 2], "group2": [1, 3]},
+        {"region": 1, "copy": 0, "group1": [0], "group2": [2]},
+        {"region": 2, "copy": 0, "group1": [0, 3], "group2": [1, 2]},
+    ]
+    gradients_template(BASE_SETTINGS, splits_args, task_grads_backend="batched")
+
+
+def test_accumulate_grads_shared() -> None:
+    """
+    Test that `accumulate_task_grads()` correctly accumulates the gradient of the total
+    loss from the task-specific gradients, in the case of a fully shared network.
+    """
+
+    splits_args = []
+    accumulate_grads_template(BASE_SETTINGS, splits_args)
+
+
+def test_accumulate_grads_multiple() -> None:
+    """
+    Test that `accumulate_task_grads()` correctly accumulates the gradient of the total
+    loss from the task-specific gradients, in the case of a multiple split network.
+    """
+
+    splits_args = [
+        {"region": 0, "copy": 0, "group1": [0, 1], "group2": [2, 3]},
+        {"region": 1, "copy": 0, "group1": [0, 2], "group2": [1, 3]},
+        {"region": 1, "copy": 0, "group1": [0], "group2": [2]},
+        {"region": 2, "copy": 0, "group1": [0, 3], "group2": [1, 2]},
+    ]
+    accumulate_grads_template(BASE_SETTINGS, splits_args)
+
+
+def test_accumulate_grads_batched_multiple() -> None:
+    """
+    Test that `accumulate_task_grads()` correctly accumulates the gradient of the total
+    loss from the task-specific gradients computed by the batched backend, in the case
+    of a multiple split network.
+    """
+
+    splits_args = [
+        {"region": 0, "copy": 0, "group1": [0, 1], "group2": [2, 3]},
+        {"region": 1, "copy": 0, "group1": [0, 2], "group2": [1, 3]},
+        {"region": 1, "copy": 0, "group1": [0], "group2": [2]},
+        {"region": 2, "copy": 0, "group1": [0, 3], "group2": [1, 2]},
+    ]
+    accumulate_grads_template(BASE_SETTINGS, splits_args, task_grads_backend="batched")
+
+
 def test_task_grad_diffs_zero() -> None:
     """
     Test that `get_task_grad_diffs()` correctly computes the pairwise difference between
@@ -6,14 +6,25 @@ from typing import Dict, Any
 
 import numpy as np
 import torch
+import torch.nn as nn
+from gym.spaces import Box
 
 from meta.networks.actorcritic import ActorCriticNetwork
 from meta.train.env import get_env
 from meta.utils.utils import get_space_size
-from tests.helpers import DEFAULT_SETTINGS, one_hot_tensor
+from tests.helpers import DEFAULT_SETTINGS, one_hot_tensor, get_obs_batch
 
 
 TOL = 1e-5
+TRUNK_CONFIG = {
+    "type": "trunk",
+    "recurrent": False,
+    "recurrent_hidden_size": None,
+    "include_task_index": True,
+    "num_tasks": 4,
+    "actor_config": {"num_shared_layers": 1, "num_task_layers": 1, "hidden_size": 8},
+    "critic_config": {"num_shared_layers": 1, "num_task_layers": 1, "hidden_size": 8},
+}
 
 
 def test_actorcritic_exclude_task():
@@ -190,3 +201,179 @@ def actorcritic_exclude_task_template(settings: Dict[str, any]):
     print(action_dist.mean - expected_mean)
     assert torch.allclose(action_dist.mean, expected_mean, atol=TOL)
     assert torch.allclose(value_pred, expected_value_pred, atol=TOL)
+
+
+def test_actorcritic_task_logstd() -> None:
+    """
+    Test that the standard deviation of the action distribution for each input is
+    computed from the log standard deviation of the input's task.
+    """
+
+    # Set up case.
+    num_tasks = TRUNK_CONFIG["num_tasks"]
+    obs_dim = 5
+    action_dim = 3
+    observation_space = Box(low=-np.inf, high=np.inf, shape=(obs_dim + num_tasks,))
+    action_space = Box(low=-1.0, high=1.0, shape=(action_dim,))
+    network = ActorCriticNetwork(
+        observation_space=observation_space,
+        action_space=action_space,
+        num_processes=DEFAULT_SETTINGS["num_processes"],
+        rollout_length=DEFAULT_SETTINGS["rollout_length"],
+        architecture_config=dict(TRUNK_CONFIG),
+        device=DEFAULT_SETTINGS["device"],
+    )
+    assert network.output_logstd.shape == (num_tasks, action_dim)
+
+    # Set log standard deviations so that they differ for each task.
+    logstd = torch.arange(num_tasks * action_dim, dtype=torch.float32) / 10.0
+    network.output_logstd.data.copy_(logstd.view(num_tasks, action_dim))
+
+    # Construct batch of observations and compute action distribution.
+    obs_subspace = Box(low=-np.inf, high=np.inf, shape=(obs_dim,))
+    obs_subspace.seed(DEFAULT_SETTINGS["seed"])
+    obs, task_indices = get_obs_batch(
+        batch_size=DEFAULT_SETTINGS["num_processes"],
+        obs_space=obs_subspace,
+        num_tasks=num_tasks,
+    )
+    _, action_dist, _ = network(obs, hidden_state=None, done=None)
+
+    # Test standard deviation of distribution.
+    for i, task in enumerate(task_indices):
+        expected_std = torch.exp(network.output_logstd[task])
+        assert torch.allclose(action_dist.stddev[i], expected_std)
+
+
+def test_actorcritic_load_legacy_logstd() -> None:
+    """
+    Test that a state dict which holds the per-task log standard deviations as a list
+    of `AddBias` modules is correctly loaded into the network.
+    """
+
+    # Set up case.
+    num_tasks = TRUNK_CONFIG["num_tasks"]
+    action_dim = 3
+    observation_space = Box(low=-np.inf, high=np.inf, shape=(5 + num_tasks,))
+    action_space = Box(low=-1.0, high=1.0, shape=(action_dim,))
+    network = ActorCriticNetwork(
+        observation_space=observation_space,
+        action_space=action_space,
+        num_processes=DEFAULT_SETTINGS["num_processes"],
+        rollout_length=DEFAULT_SETTINGS["rollout_length"],
+        architecture_config=dict(TRUNK_CONFIG),
+        device=DEFAULT_SETTINGS["device"],
+    )
+
+    # Construct legacy state dict.
+    legacy_logstds = [torch.rand(action_dim) for _ in range(num_tasks)]
+    legacy_state_dict = network.state_dict()
+    del legacy_state_dict["output_logstd"]
+    for task in range(num_tasks):
+        legacy_state_dict["output_logstd.%d._bias" % task] = legacy_logstds[task]
+
+    # Load state dict and test log standard deviations.
+    network.load_state_dict(legacy_state_dict)
+    for task in range(num_tasks):
+        assert torch.allclose(network.output_logstd[task], legacy_logstds[task])
+
+    # Load state dict into the network as a submodule of another module, and test log
+    # standard deviations again.
+    network.output_logstd.data.zero_()
+    parent = nn.ModuleDict({"network": network})
+    parent.load_state_dict(
+        {"network." + key: value for key, value in legacy_state_dict.items()}
+    )
+    for task in range(num_tasks):
+        assert torch.allclose(network.output_logstd[task], legacy_logstds[task])
+
+
+def test_actorcritic_task_indices() -> None:
+    """
+    Test that passing task indices to forward() gives the same output as recovering
+    them from the one-hot task vectors in the observations.
+    """
+
+    # Set up case.
+    num_tasks = TRUNK_CONFIG["num_tasks"]
+    obs_dim = 5
+    observation_space = Box(low=-np.inf, high=np.inf, shape=(obs_dim + num_tasks,))
+    action_space = Box(low=-1.0, high=1.0, shape=(3,))
+    network = ActorCriticNetwork(
+        observation_space=observation_space,
+        action_space=action_space,
+        num_processes=DEFAULT_SETTINGS["num_processes"],
+        rollout_length=DEFAULT_SETTINGS["rollout_length"],
+        architecture_config=dict(TRUNK_CONFIG),
+        device=DEFAULT_SETTINGS["device"],
+    )
+    network.output_logstd.data.copy_(torch.rand(network.output_logstd.shape))
+
+    # Construct batch of observations.
+    obs_subspace = Box(low=-np.inf, high=np.inf, shape=(obs_dim,))
+    obs_subspace.seed(DEFAULT_SETTINGS["seed"])
+    obs, task_indices = get_obs_batch(
+        batch_size=DEFAULT_SETTINGS["num_processes"],
+        obs_space=obs_subspace,
+        num_tasks=num_tasks,
+    )
+
+    # Compare outputs with and without task indices.
+    value_pred, action_dist, _ = network(obs, None, None)
+    given_value_pred, given_action_dist, _ = network(obs, None, None, task_indices)
+    assert torch.allclose(value_pred, given_value_pred)
+    assert torch.allclose(action_dist.mean, given_action_dist.mean)
+    assert torch.allclose(action_dist.stddev, given_action_dist.stddev)
+
+
+def test_actorcritic_heads() -> None:
+    """
+    Test that computing only the value prediction or only the action distribution with
+    `value()` and `action_dist()` gives the same outputs as a full forward pass, for a
+    recurrent multi-task network.
+    """
+
+    # Set up case.
+    num_tasks = TRUNK_CONFIG["num_tasks"]
+    obs_dim = 5
+    hidden_size = 8
+    num_processes = 6
+    architecture_config = dict(TRUNK_CONFIG)
+    architecture_config["recurrent"] = True
+    architecture_config["recurrent_hidden_size"] = hidden_size
+    observation_space = Box(low=-np.inf, high=np.inf, shape=(obs_dim + num_tasks,))
+    action_space = Box(low=-1.0, high=1.0, shape=(3,))
+    network = ActorCriticNetwork(
+        observation_space=observation_space,
+        action_space=action_space,
+        num_processes=num_processes,
+        rollout_length=DEFAULT_SETTINGS["rollout_length"],
+        architecture_config=architecture_config,
+        device=DEFAULT_SETTINGS["device"],
+    )
+    network.output_logstd.data.copy_(torch.rand(network.output_logstd.shape))
+
+    # Construct batch of observations and recurrent inputs.
+    obs_subspace = Box(low=-np.inf, high=np.inf, shape=(obs_dim,))
+    obs_subspace.seed(DEFAULT_SETTINGS["seed"])
+    obs, _ = get_obs_batch(
+        batch_size=num_processes, obs_space=obs_subspace, num_tasks=num_tasks,
+    )
+    hidden_state = torch.rand(num_processes, hidden_size)
+    done = torch.Tensor([[float(i % 2)] for i in range(num_processes)])
+
+    # Compare outputs of each head against full forward pass.
+    value_pred, action_dist, new_hidden_state = network(obs, hidden_state, done)
+    head_value_pred, value_hidden_state = network.value(obs, hidden_state, done)
+    head_action_dist, actor_hidden_state = network.action_dist(obs, hidden_state, done)
+    assert torch.allclose(value_pred, head_value_pred)
+    assert torch.allclose(action_dist.mean, head_action_dist.mean)
+    assert torch.allclose(action_dist.stddev, head_action_dist.stddev)
+    assert torch.allclose(new_hidden_state, value_hidden_state)
+    assert torch.allclose(new_hidden_state, actor_hidden_state)
+
+    # Test that skipped heads produce no output.
+    skipped_value_pred, _, _ = network(obs, hidden_state, done, heads=("actor",))
+    _, skipped_action_dist, _ = network(obs, hidden_state, done, heads=("critic",))
+    assert skipped_value_pred is None
+    assert skipped_action_dist is None
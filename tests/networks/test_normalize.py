@@ -0,0 +1,53 @@
+"""
+Unit tests for meta/networks/normalize.py.
+"""
+
+import numpy as np
+import torch
+
+from meta.networks.normalize import RunningNormalizer
+
+
+TOL = 1e-5
+OBS_DIM = 5
+NUM_BATCHES = 4
+BATCH_SIZE = 16
+
+
+def test_update_statistics() -> None:
+    """
+    Test that the running statistics of RunningNormalizer match the mean and variance
+    of all inputs seen so far after several updates.
+    """
+
+    normalizer = RunningNormalizer((OBS_DIM,))
+    batches = [
+        torch.randn(BATCH_SIZE, OBS_DIM) * 3.0 + 2.0 for _ in range(NUM_BATCHES)
+    ]
+    for batch in batches:
+        normalizer.update(batch)
+
+    inputs = torch.cat(batches).numpy()
+    assert np.allclose(normalizer.mean.numpy(), inputs.mean(axis=0), atol=TOL)
+    assert np.allclose(normalizer.var.numpy(), inputs.var(axis=0), atol=1e-3)
+
+
+def test_normalize_first_n() -> None:
+    """
+    Test that RunningNormalizer with `first_n` normalizes only the first `first_n`
+    elements of each input and leaves the rest unchanged.
+    """
+
+    first_n = 3
+    normalizer = RunningNormalizer((OBS_DIM,), first_n=first_n)
+    for _ in range(NUM_BATCHES):
+        normalizer.update(torch.randn(BATCH_SIZE, OBS_DIM) * 3.0 + 2.0)
+
+    x = torch.randn(BATCH_SIZE, OBS_DIM) * 3.0 + 2.0
+    normalized = normalizer(x)
+    mean = normalizer.mean.float()
+    std = torch.sqrt(normalizer.var + normalizer.epsilon).float()
+    expected = torch.clamp((x[:, :first_n] - mean) / std, -10.0, 10.0)
+    assert normalized.shape == x.shape
+    assert torch.allclose(normalized[:, :first_n], expected, atol=TOL)
+    assert torch.equal(normalized[:, first_n:], x[:, first_n:])
@@ -142,6 +142,72 @@ def test_forward_obs_only() -> None:
     assert torch.allclose(output, expected_output)
 
 
+def test_forward_missing_tasks() -> None:
+    """
+    Test that forward() gives the same outputs and gradients as passing each input
+    through its task-specific output head individually, when some tasks have no inputs
+    in the batch.
+    """
+
+    # Set up case.
+    dim = SETTINGS["obs_dim"] + SETTINGS["num_tasks"]
+    observation_subspace = Box(low=-np.inf, high=np.inf, shape=(SETTINGS["obs_dim"],))
+    observation_subspace.seed(DEFAULT_SETTINGS["seed"])
+    hidden_size = dim
+
+    # Construct network.
+    network = MultiTaskTrunkNetwork(
+        input_size=dim,
+        output_size=dim,
+        num_tasks=SETTINGS["num_tasks"],
+        num_shared_layers=SETTINGS["num_shared_layers"],
+        num_task_layers=SETTINGS["num_task_layers"],
+        hidden_size=hidden_size,
+        downscale_last_layer=False,
+        device=SETTINGS["device"],
+    )
+
+    # Construct batch of observations, and remove all inputs from task 1.
+    obs, task_indices = get_obs_batch(
+        batch_size=SETTINGS["num_processes"] * 2,
+        obs_space=observation_subspace,
+        num_tasks=SETTINGS["num_tasks"],
+    )
+    task_indices[task_indices == 1] = 0
+    obs[:, SETTINGS["obs_dim"] :] = 0.0
+    obs[torch.arange(len(obs)), SETTINGS["obs_dim"] + task_indices] = 1.0
+
+    # Get output and gradients of network.
+    network.zero_grad()
+    output = network(obs, task_indices)
+    torch.sum(output ** 2).backward()
+    check_gradients(network.output_heads[1], nonzero=False)
+    grads = [
+        param.grad.clone() if param.grad is not None else torch.zeros_like(param)
+        for param in network.parameters()
+    ]
+
+    # Construct expected output and gradients of network.
+    network.zero_grad()
+    trunk_output = network.trunk(obs)
+    expected_output = torch.stack(
+        [
+            network.output_heads[task](trunk_output[i : i + 1])[0]
+            for i, task in enumerate(task_indices.tolist())
+        ]
+    )
+    torch.sum(expected_output ** 2).backward()
+    expected_grads = [
+        param.grad if param.grad is not None else torch.zeros_like(param)
+        for param in network.parameters()
+    ]
+
+    # Test output and gradients of network.
+    assert torch.allclose(output, expected_output)
+    for grad, expected_grad in zip(grads, expected_grads):
+        assert torch.allclose(grad, expected_grad, atol=1e-6)
+
+
 def test_backward() -> None:
     """
     Test backward(). We just want to make sure that the gradient with respect to the
@@ -331,6 +397,61 @@ def test_check_conflicting_grads() -> None:
         )
 
 
+def test_check_conflicting_grads_accumulate() -> None:
+    """
+    Test that `check_conflicting_grads()` with `accumulate_grads=True` leaves the same
+    gradients in the shared trunk as a backward pass on the sum of the task losses, and
+    doesn't modify the gradients of the output heads.
+    """
+
+    # Set up case.
+    dim = SETTINGS["obs_dim"] + SETTINGS["num_tasks"]
+    observation_subspace = Box(low=-np.inf, high=np.inf, shape=(SETTINGS["obs_dim"],))
+    observation_subspace.seed(DEFAULT_SETTINGS["seed"])
+    hidden_size = dim
+
+    # Construct network.
+    network = MultiTaskTrunkNetwork(
+        input_size=dim,
+        output_size=dim,
+        num_tasks=SETTINGS["num_tasks"],
+        num_shared_layers=SETTINGS["num_shared_layers"],
+        num_task_layers=SETTINGS["num_task_layers"],
+        hidden_size=hidden_size,
+        downscale_last_layer=True,
+        device=SETTINGS["device"],
+        monitor_grads=True,
+    )
+
+    # Construct batch of observations concatenated with one-hot task vectors.
+    obs, task_indices = get_obs_batch(
+        batch_size=SETTINGS["num_processes"],
+        obs_space=observation_subspace,
+        num_tasks=SETTINGS["num_tasks"],
+    )
+
+    # Get output of network and compute task losses.
+    output = network(obs, task_indices)
+    task_losses = torch.stack(
+        [
+            torch.sum(output[task_indices == task] ** 2)
+            for task in range(SETTINGS["num_tasks"])
+        ]
+    )
+
+    # Accumulate trunk gradients from task-specific gradients.
+    network.zero_grad()
+    network.check_conflicting_grads(task_losses, accumulate_grads=True)
+    accumulated_grads = [param.grad.clone() for param in network.trunk.parameters()]
+    check_gradients(network.output_heads, nonzero=False)
+
+    # Compute gradients with a backward pass and compare.
+    network.zero_grad()
+    torch.sum(task_losses).backward()
+    for param, accumulated_grad in zip(network.trunk.parameters(), accumulated_grads):
+        assert torch.allclose(accumulated_grad, param.grad, atol=1e-6)
+
+
 def check_gradients(m: torch.nn.Module, nonzero: bool) -> None:
     """ Helper function to test whether gradients are nonzero. """
 
@@ -2,11 +2,32 @@
 Unit tests for meta/train/env.py.
 """
 
+import os
 from typing import Dict, List, Any
 
+import numpy as np
 import torch
+import pytest
 
-from meta.train.env import get_env
+from meta.train.env import (
+    get_env,
+    register_synthetic_benchmark,
+    get_task_assignment,
+    get_num_tasks,
+    get_template_key,
+    build_env,
+    build_env_template,
+    get_task_index,
+    SyntheticMultiTaskEnv,
+    SYNTHETIC_BENCHMARKS,
+    ENV_TEMPLATES,
+    CLAIMED_TEMPLATES,
+    acquire_env,
+    release_env,
+    shutdown_env_pool,
+    ENV_POOL,
+    BORROWED_ENVS,
+)
 from meta.train.train import collect_rollout
 from meta.utils.storage import RolloutStorage
 from tests.helpers import get_policy, DEFAULT_SETTINGS
@@ -82,12 +103,393 @@ def test_collect_rollout_MT10_multi_normalize() -> None:
     check_metaworld_obs(settings)
 
 
+def test_collect_rollout_MT10_multi_pinned() -> None:
+    """
+    Test the values of the returned RolloutStorage objects from train.collect_rollout()
+    on the MetaWorld environment, to ensure that the task indices are returned
+    correctly and that each process only runs its assigned tasks, when each process is
+    pinned to a subset of the tasks.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings["env_name"] = "MT10"
+    settings["num_processes"] = 4
+    settings["rollout_length"] = 512
+    settings["time_limit"] = 150
+    assert settings["normalize_transition"] == False
+
+    for task_assignment in ["round_robin", "contiguous"]:
+        settings["task_assignment"] = task_assignment
+        check_metaworld_obs(settings)
+
+
+def test_collect_rollout_synthetic_single() -> None:
+    """
+    Test the values of the returned RolloutStorage objects from train.collect_rollout()
+    on a synthetic multi-task benchmark, to ensure that the task indices are returned
+    correctly, with a single process and with and without pinning the process to a
+    subset of the tasks.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings["env_name"] = "synthetic-MT10"
+    settings["num_processes"] = 1
+    settings["rollout_length"] = 128
+    settings["time_limit"] = 10
+    assert settings["normalize_transition"] == False
+
+    for task_assignment in [None, "round_robin"]:
+        settings["task_assignment"] = task_assignment
+        check_metaworld_obs(settings)
+
+
+def test_collect_rollout_synthetic_multi() -> None:
+    """
+    Test the values of the returned RolloutStorage objects from train.collect_rollout()
+    on a synthetic multi-task benchmark, to ensure that the task indices are returned
+    correctly, with and without pinning each process to a subset of the tasks.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings["env_name"] = "synthetic-MT50"
+    settings["num_processes"] = 4
+    settings["rollout_length"] = 128
+    settings["time_limit"] = 10
+    assert settings["normalize_transition"] == False
+
+    for task_assignment in [None, "round_robin", "contiguous"]:
+        settings["task_assignment"] = task_assignment
+        check_metaworld_obs(settings)
+
+
+def test_synthetic_episode_length() -> None:
+    """
+    Test that episodes of a synthetic multi-task benchmark end after the benchmark's
+    episode length when there is no time limit, and that each process switches tasks
+    between episodes.
+    """
+
+    env_name = "synthetic-test"
+    num_processes = 4
+    max_path_length = 5
+    num_episodes = 20
+    register_synthetic_benchmark(env_name, 10, max_path_length=max_path_length)
+
+    env = get_env(env_name, num_processes, time_limit=None, normalize_transition=False)
+    env.reset()
+    process_tasks = [set() for _ in range(num_processes)]
+    for step in range(num_episodes * max_path_length):
+        for process, task_index in enumerate(env.task_indices.tolist()):
+            process_tasks[process].add(task_index)
+        actions = torch.zeros(num_processes, *env.action_space.shape)
+        _, _, dones, _ = env.step(actions)
+
+        # Check that every episode ends exactly at the episode length.
+        assert all(dones) == ((step + 1) % max_path_length == 0)
+        assert any(dones) == all(dones)
+        if all(dones):
+            assert (env.episode_info["episode_length"] == max_path_length).all()
+            assert not env.episode_info["time_limit_hit"].any()
+
+    env.close()
+    assert all(len(tasks) > 1 for tasks in process_tasks)
+
+
+def test_task_assignment() -> None:
+    """
+    Test that get_task_assignment() assigns every task to some process and balances
+    the number of tasks per process (or processes per task), for more and fewer
+    processes than tasks.
+    """
+
+    num_tasks = 10
+    for num_processes in [1, 3, 10, 25]:
+        for task_assignment in ["round_robin", "contiguous"]:
+            process_task_ids = get_task_assignment(
+                num_tasks, num_processes, task_assignment
+            )
+            assert len(process_task_ids) == num_processes
+
+            # Check that tasks are balanced over processes.
+            counts = [0] * num_tasks
+            for task_ids in process_task_ids:
+                for task_id in task_ids:
+                    counts[task_id] += 1
+            if num_processes <= num_tasks:
+                assert counts == [1] * num_tasks
+                sizes = [len(task_ids) for task_ids in process_task_ids]
+                assert max(sizes) - min(sizes) <= 1
+            else:
+                assert all(len(task_ids) == 1 for task_ids in process_task_ids)
+                assert max(counts) - min(counts) <= 1
+
+    # Round robin assignment interleaves tasks, while contiguous assignment assigns
+    # contiguous blocks.
+    assert get_task_assignment(num_tasks, 3, "round_robin")[0] == [0, 3, 6, 9]
+    assert get_task_assignment(num_tasks, 3, "contiguous")[0] == [0, 1, 2, 3]
+
+
+def test_task_pinned_random_state() -> None:
+    """
+    Test that an environment pinned to a subset of the tasks rotates through its tasks
+    on each reset without consuming random numbers of the wrapped environment, so that
+    it produces the same states as the wrapped environment on its own.
+    """
+
+    env_name = "synthetic-MT10"
+    task_ids = [2, 5]
+    pinned_env = build_env(env_name, task_ids=task_ids)
+    env = SyntheticMultiTaskEnv(task_ids=task_ids, **SYNTHETIC_BENCHMARKS[env_name])
+    pinned_env.seed(0)
+    env.seed(0)
+
+    obs_dim = SYNTHETIC_BENCHMARKS[env_name]["obs_dim"]
+    for reset in range(5):
+        pinned_obs = pinned_env.reset()
+        obs = env.reset()
+        assert np.array_equal(pinned_obs[:obs_dim], obs[:obs_dim])
+        assert get_task_index(pinned_env) == task_ids[reset % len(task_ids)]
+
+
+def test_episode_info_single() -> None:
+    """
+    Test that the episode statistics written by the environment match the info
+    dictionaries returned from env.step(), with a single process.
+    """
+
+    check_episode_info(num_processes=1)
+
+
+def test_episode_info_multi() -> None:
+    """
+    Test that the episode statistics written by the environment match the info
+    dictionaries returned from env.step(), when running a multi-process environment.
+    """
+
+    check_episode_info(num_processes=4)
+
+
+def test_envs_per_worker() -> None:
+    """
+    Test that running multiple environments per worker process produces the same
+    transitions as running one environment per process.
+    """
+
+    num_processes = 7
+    transitions = []
+    for envs_per_worker in [1, 3]:
+        env = get_env(
+            "CartPole-v1",
+            num_processes,
+            time_limit=20,
+            normalize_transition=False,
+            envs_per_worker=envs_per_worker,
+        )
+        assert len(env.procs) == -(-num_processes // envs_per_worker)
+
+        torch.manual_seed(0)
+        current_transitions = [env.reset()]
+        for _ in range(50):
+            actions = torch.randint(env.action_space.n, (num_processes,))
+            obs, rewards, dones, _ = env.step(actions)
+            episode_rewards = env.episode_info["episode_return"][dones].copy()
+            current_transitions.append((obs, rewards, dones, episode_rewards))
+        transitions.append(current_transitions)
+        env.close()
+
+    # Compare transitions.
+    assert torch.equal(transitions[0][0], transitions[1][0])
+    for transition_1, transition_2 in zip(transitions[0][1:], transitions[1][1:]):
+        assert torch.equal(transition_1[0], transition_2[0])
+        assert torch.equal(transition_1[1], transition_2[1])
+        assert (transition_1[2] == transition_2[2]).all()
+        assert (transition_1[3] == transition_2[3]).all()
+
+
+def test_step_wait_ready() -> None:
+    """
+    Test that stepping environments with step_async_envs() and step_wait_ready()
+    produces the same transitions for each environment as stepping all environments at
+    once.
+    """
+
+    num_processes = 7
+    num_steps = 30
+    torch.manual_seed(0)
+    all_actions = torch.randint(2, (num_steps, num_processes))
+
+    # Step all environments at once.
+    env = get_env(
+        "CartPole-v1",
+        num_processes,
+        time_limit=20,
+        normalize_transition=False,
+        envs_per_worker=2,
+    )
+    env.reset()
+    transitions = []
+    for step in range(num_steps):
+        obs, rewards, dones, _ = env.step(all_actions[step])
+        transitions.append((obs, rewards, dones))
+    env.close()
+
+    # Step environments as their workers become ready, and compare transitions.
+    env = get_env(
+        "CartPole-v1",
+        num_processes,
+        time_limit=20,
+        normalize_transition=False,
+        envs_per_worker=2,
+    )
+    env.reset()
+    env_steps = np.zeros(num_processes, dtype=int)
+    env_ids = np.arange(num_processes)
+    while len(env_ids) > 0:
+        env.step_async_envs(all_actions[env_steps[env_ids], env_ids], env_ids)
+        obs, rewards, dones, _, env_ids = env.step_wait_ready(1)
+        assert len(env_ids) in [1, 2]
+        for i, env_id in enumerate(env_ids):
+            step = env_steps[env_id]
+            assert torch.equal(obs[i], transitions[step][0][env_id])
+            assert torch.equal(rewards[i], transitions[step][1][env_id])
+            assert dones[i] == transitions[step][2][env_id]
+        env_steps[env_ids] += 1
+        env_ids = env_ids[env_steps[env_ids] < num_steps]
+
+    env.close()
+
+
+def test_env_templates() -> None:
+    """
+    Test that constructing environments from environment templates produces the same
+    transitions as constructing them from scratch, that the template is only built
+    once over multiple calls to get_env(), that building it doesn't affect the global
+    NumPy random state, and that shutting down the environment pool discards it.
+    """
+
+    num_processes = 4
+    time_limit = 20
+    key = get_template_key("CartPole-v1", time_limit)
+    ENV_TEMPLATES.pop(key, None)
+
+    # Build template and check random state.
+    np.random.seed(0)
+    expected_int = np.random.randint(1000)
+    np.random.seed(0)
+    build_env_template("CartPole-v1", time_limit)
+    assert np.random.randint(1000) == expected_int
+
+    transitions = []
+    templates = []
+    for env_templates in [False, True, True]:
+        env = get_env(
+            "CartPole-v1",
+            num_processes,
+            time_limit=time_limit,
+            normalize_transition=False,
+            env_templates=env_templates,
+        )
+        if env_templates:
+            templates.append(ENV_TEMPLATES[key][1])
+
+        torch.manual_seed(0)
+        current_transitions = [env.reset()]
+        for _ in range(50):
+            actions = torch.randint(env.action_space.n, (num_processes,))
+            obs, rewards, dones, _ = env.step(actions)
+            current_transitions.append((obs, rewards, dones))
+        transitions.append(current_transitions)
+        env.close()
+
+    # Compare transitions and templates, then discard the template.
+    assert templates[0] is templates[1]
+    shutdown_env_pool()
+    assert key not in ENV_TEMPLATES and len(CLAIMED_TEMPLATES) == 0
+    for current_transitions in transitions[1:]:
+        assert torch.equal(transitions[0][0], current_transitions[0])
+        for transition_1, transition_2 in zip(
+            transitions[0][1:], current_transitions[1:]
+        ):
+            assert torch.equal(transition_1[0], transition_2[0])
+            assert torch.equal(transition_1[1], transition_2[1])
+            assert (transition_1[2] == transition_2[2]).all()
+
+
+def test_env_templates_spaces() -> None:
+    """
+    Test that get_env() raises an error when the environment templates of different
+    processes have different observation spaces, instead of using the spaces of
+    whichever template was built last.
+    """
+
+    env_name = "synthetic-MT10"
+    num_processes = 2
+    time_limit = 10
+    process_task_ids = get_task_assignment(
+        get_num_tasks(env_name), num_processes, "round_robin"
+    )
+
+    # Replace the template of the last process with an environment whose observation
+    # space is different.
+    key = get_template_key(env_name, time_limit, process_task_ids[-1])
+    ENV_TEMPLATES[key] = (os.getpid(), build_env("CartPole-v1", time_limit))
+    try:
+        with pytest.raises(ValueError):
+            get_env(
+                env_name,
+                num_processes,
+                time_limit=time_limit,
+                normalize_transition=False,
+                task_assignment="round_robin",
+                env_templates=True,
+            )
+    finally:
+        ENV_TEMPLATES.pop(key)
+
+
+def check_episode_info(num_processes: int) -> None:
+    """
+    Run CartPole with random actions and a short time limit, and compare the episode
+    statistics in `env.episode_info` against the info dictionary from each step.
+    """
+
+    env = get_env(
+        "CartPole-v1",
+        num_processes,
+        time_limit=20,
+        normalize_transition=False,
+        return_infos=True,
+    )
+    env.reset()
+
+    num_episodes = 0
+    for _ in range(100):
+        actions = torch.randint(env.action_space.n, (num_processes,))
+        _, _, dones, infos = env.step(actions)
+
+        for process, (done, info) in enumerate(zip(dones, infos)):
+            if not done:
+                continue
+            num_episodes += 1
+            episode_info = {
+                key: value[process] for key, value in env.episode_info.items()
+            }
+            assert episode_info["episode_return"] == info["episode"]["r"]
+            assert episode_info["episode_length"] == info["episode"]["l"]
+            assert episode_info["success"] == info["success"]
+            assert episode_info["time_limit_hit"] == info.get("time_limit_hit", False)
+
+    env.close()
+    assert num_episodes > 0
+
+
 def check_metaworld_obs(settings: Dict[str, Any]) -> Any:
     """
     Verify that an observation is a valid observation from a MetaWorld multi-task
     benchmark, i.e. a vector with length at least 9, and the dimensions after 9 form a
     one-hot vector denoting the task index. We make sure that this is indeed a one-hot
-    vector and that the set bit only changes when we encounter a done=True.
+    vector, that the set bit only changes when we encounter a done=True, and that the
+    task indices provided by the environment match the one-hot vectors.
     """
 
     env = get_env(
@@ -98,6 +500,7 @@ def check_metaworld_obs(settings: Dict[str, Any]) -> Any:
         normalize_transition=settings["normalize_transition"],
         normalize_first_n=settings["normalize_first_n"],
         allow_early_resets=True,
+        task_assignment=settings["task_assignment"],
     )
     policy = get_policy(env, settings)
     rollout = RolloutStorage(
@@ -108,7 +511,7 @@ def check_metaworld_obs(settings: Dict[str, Any]) -> Any:
         hidden_state_size=1,
         device=settings["device"],
     )
-    rollout.set_initial_obs(env.reset())
+    rollout.set_initial_obs(env.reset(), env.task_indices)
 
     # Get the tasks indexed by the one-hot vectors in the latter part of the observation
     # from each environment.
@@ -139,6 +542,18 @@ def check_metaworld_obs(settings: Dict[str, Any]) -> Any:
         dones = rollout.dones[step]
         new_task_indices = get_task_indices(obs)
 
+        # Make sure that the stored task indices match the one-hot vectors, and that
+        # each process only runs its assigned tasks.
+        assert rollout.task_indices[step].tolist() == new_task_indices
+        if settings["task_assignment"] is not None:
+            process_task_ids = get_task_assignment(
+                get_num_tasks(settings["env_name"]),
+                settings["num_processes"],
+                settings["task_assignment"],
+            )
+            for process, task_index in enumerate(new_task_indices):
+                assert task_index in process_task_ids[process]
+
         # Make sure that task indices are the same if we haven't reached a done.
         # Otherwise set new task indices.
         assert len(obs) == len(dones)
@@ -150,3 +565,136 @@ def check_metaworld_obs(settings: Dict[str, Any]) -> Any:
                 assert task_indices[process] == new_task_indices[process]
 
     env.close()
+
+
+def test_env_pool() -> None:
+    """
+    Test that an environment borrowed from the environment pool reuses the worker
+    processes of a returned environment, that it produces the same transitions as a
+    newly constructed environment with the same seed, and that shutting down the pool
+    closes all environments.
+    """
+
+    num_processes = 4
+    settings = {
+        "env_name": "CartPole-v1",
+        "num_processes": num_processes,
+        "time_limit": 20,
+        "normalize_transition": False,
+        "allow_early_resets": True,
+    }
+
+    def get_transitions(env: Any) -> List[Any]:
+        torch.manual_seed(0)
+        transitions = [env.reset()]
+        for _ in range(50):
+            actions = torch.randint(env.action_space.n, (num_processes,))
+            obs, rewards, dones, _ = env.step(actions)
+            transitions.append((obs, rewards, dones))
+        return transitions
+
+    # Collect transitions from a new environment.
+    env = get_env(seed=3, **settings)
+    transitions = [get_transitions(env)]
+    env.close()
+
+    # Borrow an environment with a different seed, return it, then borrow it again
+    # with the original seed.
+    env = acquire_env(seed=1, **settings)
+    procs = env.procs
+    get_transitions(env)
+    release_env(env)
+    env = acquire_env(seed=3, **settings)
+    assert env.procs is procs
+    transitions.append(get_transitions(env))
+    release_env(env)
+
+    # Compare transitions.
+    assert torch.equal(transitions[0][0], transitions[1][0])
+    for transition_1, transition_2 in zip(transitions[0][1:], transitions[1][1:]):
+        assert torch.equal(transition_1[0], transition_2[0])
+        assert torch.equal(transition_1[1], transition_2[1])
+        assert (transition_1[2] == transition_2[2]).all()
+
+    # Shut down the pool.
+    shutdown_env_pool()
+    assert len(ENV_POOL) == 0 and len(BORROWED_ENVS) == 0
+    assert not any(proc.is_alive() for proc in procs)
+
+
+def test_batched_env() -> None:
+    """
+    Test that the batched implementation of UniqueEnv produces the same transitions and
+    episode statistics as a multi-process vectorized UniqueEnv.
+    """
+
+    num_processes = 4
+    transitions = []
+    for batched in [False, True]:
+        env = get_env(
+            "unique-env",
+            num_processes,
+            time_limit=7,
+            normalize_transition=False,
+            batched=batched,
+        )
+
+        torch.manual_seed(0)
+        current_transitions = [env.reset()]
+        for _ in range(20):
+            actions = torch.randint(env.action_space.n, (num_processes, 1))
+            obs, rewards, dones, _ = env.step(actions)
+            episode_info = {key: val.copy() for key, val in env.episode_info.items()}
+            current_transitions.append((obs, rewards, dones, episode_info))
+        transitions.append(current_transitions)
+        env.close()
+
+    # Compare transitions.
+    assert torch.equal(transitions[0][0], transitions[1][0])
+    for transition_1, transition_2 in zip(transitions[0][1:], transitions[1][1:]):
+        assert torch.equal(transition_1[0], transition_2[0])
+        assert torch.equal(transition_1[1], transition_2[1])
+        assert (transition_1[2] == transition_2[2]).all()
+        for key in transition_1[3]:
+            assert np.array_equal(
+                transition_1[3][key], transition_2[3][key], equal_nan=True
+            )
+
+
+def test_shared_obs() -> None:
+    """
+    Test that an environment which returns views of the shared observations produces
+    the same observations as one which returns copies, and that the observations are
+    views of the shared memory written by the workers.
+    """
+
+    num_processes = 4
+    transitions = []
+    for shared_obs in [False, True]:
+        env = get_env(
+            "CartPole-v1",
+            num_processes,
+            time_limit=20,
+            normalize_transition=False,
+            envs_per_worker=2,
+            shared_obs=shared_obs,
+        )
+        shared_ptr = env.obs_arrays[None].ctypes.data
+
+        torch.manual_seed(0)
+        obs = env.reset()
+        current_transitions = [obs.clone()]
+        for _ in range(50):
+            actions = torch.randint(env.action_space.n, (num_processes,))
+            obs, rewards, dones, _ = env.step(actions)
+            assert (obs.data_ptr() == shared_ptr) == shared_obs
+            current_transitions.append((obs.clone(), rewards, dones))
+        transitions.append(current_transitions)
+        env.close()
+
+    # Compare transitions.
+    assert torch.equal(transitions[0][0], transitions[1][0])
+    for transition_1, transition_2 in zip(transitions[0][1:], transitions[1][1:]):
+        assert torch.equal(transition_1[0], transition_2[0])
+        assert torch.equal(transition_1[1], transition_2[1])
+        assert (transition_1[2] == transition_2[2]).all()
@@ -3,20 +3,26 @@ Unit tests for meta/train/ppo.py.
 """
 
 import math
+import pickle
 from typing import Dict, Any
 
 import torch
+import torch.nn as nn
 from torch.optim import Optimizer
 import numpy as np
+from gym.spaces import Box, Discrete
 
 from meta.train.ppo import PPOPolicy
+from meta.networks.normalize import RunningNormalizer
 from meta.train.env import get_env, get_num_tasks
 from meta.utils.storage import RolloutStorage
+from meta.utils.utils import AddBias
 from tests.helpers import get_policy, get_rollout, get_task_rollouts, DEFAULT_SETTINGS
 
 
 TOL = 1e-6
 BIG_TOL = 3e-3
+DEFAULT_SEED = 0
 
 
 def test_act_sizes() -> None:
@@ -37,6 +43,109 @@ def test_act_sizes() -> None:
     assert action_log_prob.shape == torch.Size([settings["num_processes"], 1])
 
 
+def test_unpickle_legacy_logstd() -> None:
+    """
+    Test that a multi-task policy pickled before the per-task log standard deviations
+    were stored as a single tensor can be unpickled and used with ppo.act(), and that
+    the optimizer holds the converted parameter along with its optimizer state.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings["env_name"] = "synthetic-MT10"
+    settings["num_processes"] = 4
+    settings["architecture_config"] = {
+        "type": "trunk",
+        "recurrent": False,
+        "recurrent_hidden_size": None,
+        "include_task_index": True,
+        "num_tasks": 10,
+        "actor_config": {"num_shared_layers": 1, "num_task_layers": 1, "hidden_size": 8},
+        "critic_config": {"num_shared_layers": 1, "num_task_layers": 1, "hidden_size": 8},
+    }
+    env = get_env(
+        settings["env_name"], settings["num_processes"], normalize_transition=False
+    )
+    policy = get_policy(env, settings)
+    obs = env.reset()
+
+    # Take an optimizer step, so that the optimizer has state for each parameter.
+    _, _, action_log_probs, _ = policy.act(obs, None, None)
+    policy.optimizer.zero_grad()
+    (-action_log_probs.sum()).backward()
+    policy.optimizer.step()
+
+    # Convert the policy to the legacy layout, with one `AddBias` module and one
+    # optimizer parameter for each task.
+    network = policy.policy_network
+    logstd = network.output_logstd
+    legacy_logstd = nn.ModuleList([AddBias(row.detach().clone()) for row in logstd])
+    del network._parameters["output_logstd"]
+    network.output_logstd = legacy_logstd
+    group = policy.optimizer.param_groups[0]
+    group["params"] = [param for param in group["params"] if param is not logstd]
+    logstd_state = policy.optimizer.state.pop(logstd)
+    for task, module in enumerate(legacy_logstd):
+        group["params"].append(module._bias)
+        policy.optimizer.state[module._bias] = {
+            "step": logstd_state["step"],
+            "exp_avg": logstd_state["exp_avg"][task].clone(),
+            "exp_avg_sq": logstd_state["exp_avg_sq"][task].clone(),
+        }
+
+    # Unpickle policy and check the converted parameter and optimizer.
+    loaded_policy = pickle.loads(pickle.dumps(policy))
+    loaded_logstd = loaded_policy.policy_network.output_logstd
+    assert isinstance(loaded_logstd, nn.Parameter)
+    assert torch.equal(loaded_logstd, logstd)
+    loaded_params = loaded_policy.optimizer.param_groups[0]["params"]
+    assert set(id(param) for param in loaded_params) == set(
+        id(param) for param in loaded_policy.policy_network.parameters()
+    )
+    loaded_state = loaded_policy.optimizer.state[loaded_logstd]
+    assert torch.equal(loaded_state["exp_avg"], logstd_state["exp_avg"])
+    assert torch.equal(loaded_state["exp_avg_sq"], logstd_state["exp_avg_sq"])
+
+    # Act with the unpickled policy.
+    _, action, action_log_prob, _ = loaded_policy.act(obs, None, None)
+    assert action.shape == (settings["num_processes"], *env.action_space.shape)
+    assert action_log_prob.shape == (settings["num_processes"], 1)
+
+    env.close()
+
+
+def test_act_noise() -> None:
+    """
+    Test that sampling actions in ppo.act() with noise from ppo.sample_noise() gives
+    the same actions as sampling from the action distribution, for discrete and
+    continuous action spaces.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    batch_size = 7
+    observation_space = Box(low=-np.inf, high=np.inf, shape=(4,))
+    for action_space in [Discrete(5), Box(low=-1, high=1, shape=(2,))]:
+        policy = PPOPolicy(
+            observation_space=observation_space,
+            action_space=action_space,
+            num_minibatch=1,
+            num_processes=batch_size,
+            rollout_length=settings["rollout_length"],
+            num_updates=1,
+            architecture_config=settings["architecture_config"],
+        )
+        obs = torch.randn(batch_size, 4)
+
+        # Sample actions with and without noise.
+        torch.manual_seed(DEFAULT_SEED)
+        outputs = policy.act(obs, None, None)
+        torch.manual_seed(DEFAULT_SEED)
+        noise = policy.sample_noise(batch_size)
+        noise_outputs = policy.act(obs, None, None, noise=noise)
+
+        for output, noise_output in zip(outputs[:3], noise_outputs[:3]):
+            assert torch.equal(output, noise_output)
+
+
 def test_evaluate_actions_sizes() -> None:
     """ Test the sizes of returned tensors from ppo.evaluate_actions(). """
 
@@ -100,6 +209,123 @@ def compute_returns_advantages_values() -> None:
     raise NotImplementedError
 
 
+def test_compute_returns_scan() -> None:
+    """
+    Tests that the returns computed by the scan GAE backend match those computed by
+    the loop backend, with rollouts that contain episode ends at random steps.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings["num_processes"] = 4
+    env = get_env(settings["env_name"], settings["num_processes"])
+
+    for rollout_length in [1, 2, 37, 150]:
+        settings["rollout_length"] = rollout_length
+        policy = get_policy(env, settings)
+
+        # Fill rollout storage with random rewards, value predictions, and dones.
+        rollout = RolloutStorage(
+            rollout_length=settings["rollout_length"],
+            observation_space=env.observation_space,
+            action_space=env.action_space,
+            num_processes=settings["num_processes"],
+            hidden_state_size=1,
+            device=settings["device"],
+        )
+        rollout.rollout_step = settings["rollout_length"]
+        rollout.rewards.copy_(torch.randn_like(rollout.rewards))
+        rollout.value_preds.copy_(torch.randn_like(rollout.value_preds))
+        rollout.dones.copy_((torch.rand_like(rollout.dones) < 0.1).float())
+
+        # Compare returns from each backend.
+        loop_returns = policy.compute_returns_loop(rollout)
+        scan_returns = policy.compute_returns_scan(rollout)
+        assert torch.allclose(loop_returns, scan_returns, atol=1e-5)
+
+
+def test_update_reward_normalization() -> None:
+    """
+    Tests that the reward normalization statistics computed with a scan over each
+    rollout match those computed by iterating over each step, and that get_loss()
+    normalizes rewards without modifying the rollout or the statistics, so that it
+    gives the same losses when called twice on the same rollout.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings["num_processes"] = 4
+    settings["rollout_length"] = 37
+    num_rollouts = 3
+    env = get_env(settings["env_name"], settings["num_processes"])
+    policy = PPOPolicy(
+        observation_space=env.observation_space,
+        action_space=env.action_space,
+        num_minibatch=settings["num_minibatch"],
+        num_processes=settings["num_processes"],
+        rollout_length=settings["rollout_length"],
+        num_updates=settings["num_updates"],
+        architecture_config=settings["architecture_config"],
+        gamma=settings["gamma"],
+        normalize_transition=True,
+        device=settings["device"],
+    )
+    rollout = RolloutStorage(
+        rollout_length=settings["rollout_length"],
+        observation_space=env.observation_space,
+        action_space=env.action_space,
+        num_processes=settings["num_processes"],
+        hidden_state_size=1,
+        device=settings["device"],
+    )
+    expected_normalizer = RunningNormalizer((), device=settings["device"])
+    running_returns = torch.zeros(settings["num_processes"], 1)
+
+    for _ in range(num_rollouts):
+
+        # Fill rollout storage with random rewards and dones, and update the
+        # normalization statistics.
+        rollout.rollout_step = settings["rollout_length"]
+        rollout.rewards.copy_(torch.randn_like(rollout.rewards))
+        rollout.dones[1:] = (torch.rand_like(rollout.dones[1:]) < 0.1).float()
+        policy.update_reward_normalization(rollout)
+
+        # Compute the discounted return of each step by iterating over each step.
+        step_returns = []
+        for step in range(rollout.rollout_step):
+            running_returns = (
+                running_returns * settings["gamma"] + rollout.rewards[step]
+            )
+            step_returns.append(running_returns)
+            running_returns = running_returns * (1 - rollout.dones[step + 1])
+        expected_normalizer.update(torch.stack(step_returns))
+
+        # Compare statistics.
+        assert torch.allclose(policy.running_returns, running_returns, atol=1e-5)
+        for stat in ["mean", "var", "count"]:
+            assert torch.allclose(
+                getattr(policy.reward_normalizer, stat),
+                getattr(expected_normalizer, stat),
+                atol=1e-5,
+            )
+
+        rollout.reset()
+
+    # Compute losses twice on the same rollout.
+    rollout.rollout_step = settings["rollout_length"]
+    rewards = rollout.rewards.clone()
+    normalizer_state = {
+        key: val.clone() for key, val in policy.reward_normalizer.state_dict().items()
+    }
+    losses = []
+    for _ in range(2):
+        torch.manual_seed(DEFAULT_SEED)
+        with torch.no_grad():
+            losses.append([step_loss.item() for step_loss in policy.get_loss(rollout)])
+    assert losses[0] == losses[1]
+    assert torch.equal(rollout.rewards, rewards)
+    for key, val in policy.reward_normalizer.state_dict().items():
+        assert torch.equal(val, normalizer_state[key])
+
+
 def test_update_values() -> None:
     """
     Tests whether PPOPolicy.get_loss() calculates correct updates in the case of
@@ -4,23 +4,34 @@ Unit tests for meta/train/train.py.
 
 import os
 import json
+from typing import Dict, Any
 
 import torch
 
 from meta.train.env import get_env
-from meta.train.train import collect_rollout, train
+from meta.train.train import (
+    collect_rollout,
+    collect_rollout_pipelined,
+    collect_rollout_ready,
+    evaluate_fast,
+    train,
+)
 from meta.utils.storage import RolloutStorage
 from meta.utils.utils import save_dir_from_name
 from tests.helpers import get_policy, check_results_name, DEFAULT_SETTINGS
 
 
 MP_FACTOR = 4
+TOL = 1e-6
 CARTPOLE_CONFIG_PATH = os.path.join("configs", "cartpole.json")
 LUNAR_LANDER_CONFIG_PATH = os.path.join("configs", "lunar_lander.json")
 MT10_CONFIG_PATH = os.path.join("configs", "mt10.json")
 TRUNK_CONFIG_PATH = os.path.join("configs", "trunk.json")
 SPLITTING_V1_CONFIG_PATH = os.path.join("configs", "splitting_v1.json")
 SPLITTING_V2_CONFIG_PATH = os.path.join("configs", "splitting_v2.json")
+SYNTHETIC_SPLITTING_V2_CONFIG_PATH = os.path.join(
+    "configs", "synthetic_splitting_v2.json"
+)
 
 
 def test_train_cartpole() -> None:
@@ -835,6 +846,158 @@ def test_train_save_load() -> None:
     os.system("rm -rf %s" % save_dir_from_name(save_name))
 
 
+def test_train_cartpole_async() -> None:
+    """
+    Runs training with asynchronous rollout collection for an environment with a
+    discrete action space, running multiple processes, and checks that the resulting
+    metrics are the same over two training runs.
+    """
+
+    # Load default training config.
+    with open(CARTPOLE_CONFIG_PATH, "r") as config_file:
+        config = json.load(config_file)
+
+    # Modify default training config.
+    config["num_updates"] = int(config["num_updates"] / MP_FACTOR)
+    config["num_processes"] *= MP_FACTOR
+    config["evaluation_freq"] = 3
+    config["async_rollout"] = True
+
+    # Run training twice and compare metrics.
+    first_metrics = train(dict(config))["metrics"].state()
+    second_metrics = train(dict(config))["metrics"].state()
+    assert first_metrics == second_metrics
+
+
+def test_train_reuse_task_grads_trunk() -> None:
+    """
+    Runs one update of training for a trunk network which monitors conflicting
+    gradients on a synthetic multi-task benchmark, and checks that the resulting
+    parameters are the same when reusing task-specific gradients as the training
+    gradient and when computing the training gradient with a separate backward pass.
+    """
+
+    # Load default training config.
+    with open(TRUNK_CONFIG_PATH, "r") as config_file:
+        config = json.load(config_file)
+
+    # Modify default training config.
+    config["env_name"] = "synthetic-MT10"
+    config["num_processes"] = 4
+
+    # Call template.
+    reuse_task_grads_template(config)
+
+
+def test_train_reuse_task_grads_splitting_v2() -> None:
+    """
+    Runs one update of training for a splitting network on a synthetic multi-task
+    benchmark, and checks that the resulting parameters are the same when reusing
+    task-specific gradients as the training gradient and when computing the training
+    gradient with a separate backward pass.
+    """
+
+    # Load default training config.
+    with open(SYNTHETIC_SPLITTING_V2_CONFIG_PATH, "r") as config_file:
+        config = json.load(config_file)
+
+    # Call template.
+    reuse_task_grads_template(config)
+
+
+def reuse_task_grads_template(config: Dict[str, Any]) -> None:
+    """ Template for the train_reuse_task_grads tests. """
+
+    # Modify training config.
+    config["num_updates"] = 1
+    config["normalize_transition"] = False
+    config["cuda"] = False
+    config["save_name"] = None
+    config["metrics_filename"] = None
+    config["baseline_metrics_filename"] = None
+
+    # Run one update with and without reusing task-specific gradients.
+    state_dicts = {}
+    for reuse_task_grads in [False, True]:
+        run_config = dict(config)
+        run_config["reuse_task_grads"] = reuse_task_grads
+        checkpoint = train(run_config)
+        state_dicts[reuse_task_grads] = checkpoint["policy"].policy_network.state_dict()
+
+    # Compare parameters.
+    assert state_dicts[False].keys() == state_dicts[True].keys()
+    for name, param in state_dicts[False].items():
+        assert torch.allclose(param, state_dicts[True][name], atol=TOL)
+
+
+def test_train_cartpole_background_eval() -> None:
+    """
+    Runs training with evaluation in the background for an environment with a discrete
+    action space, running multiple processes, and checks that every evaluation is
+    recorded and that the resulting metrics are the same over two training runs.
+    """
+
+    # Load default training config.
+    with open(CARTPOLE_CONFIG_PATH, "r") as config_file:
+        config = json.load(config_file)
+
+    # Modify default training config.
+    config["num_updates"] = int(config["num_updates"] / MP_FACTOR)
+    config["num_processes"] *= MP_FACTOR
+    config["normalize_transition"] = False
+    config["evaluation_freq"] = 3
+    config["eval_processes"] = 2
+
+    # Run training twice and compare metrics.
+    first_metrics = train(dict(config))["metrics"].state()
+    second_metrics = train(dict(config))["metrics"].state()
+    assert first_metrics == second_metrics
+
+    # Check that one evaluation was recorded every evaluation_freq updates and at the
+    # end of training, under the iteration at which it was started.
+    eval_iterations = list(
+        range(0, config["num_updates"] - 1, config["evaluation_freq"])
+    ) + [config["num_updates"] - 1]
+    assert len(first_metrics["eval_reward"]["history"]) == len(eval_iterations)
+    assert first_metrics["eval_reward"]["iterations"] == eval_iterations
+    assert first_metrics["eval_success"]["iterations"] == eval_iterations
+
+
+def test_train_cartpole_policy_normalization() -> None:
+    """
+    Runs training with observation and reward normalization performed by the policy
+    for an environment with a discrete action space, running multiple processes, and
+    checks that the normalization statistics are updated and that the resulting
+    metrics are the same over two training runs.
+    """
+
+    # Load default training config.
+    with open(CARTPOLE_CONFIG_PATH, "r") as config_file:
+        config = json.load(config_file)
+
+    # Modify default training config.
+    config["num_updates"] = int(config["num_updates"] / MP_FACTOR)
+    config["num_processes"] *= MP_FACTOR
+    config["normalize_transition"] = True
+    config["policy_normalization"] = True
+
+    # Run training twice and compare metrics.
+    first_checkpoint = train(dict(config))
+    second_checkpoint = train(dict(config))
+    first_metrics = first_checkpoint["metrics"].state()
+    second_metrics = second_checkpoint["metrics"].state()
+    assert first_metrics == second_metrics
+
+    # Check that normalization statistics were updated with one batch of initial
+    # observations and one batch of observations per update.
+    policy = first_checkpoint["policy"]
+    num_steps = config["rollout_length"] * config["num_updates"]
+    obs_count = policy.policy_network.obs_normalizer.count.item()
+    reward_count = policy.reward_normalizer.count.item()
+    assert abs(obs_count - config["num_processes"] * (num_steps + 1)) < 1
+    assert abs(reward_count - config["num_processes"] * num_steps) < 1
+
+
 def test_collect_rollout_values() -> None:
     """
     Test the values of the returned RolloutStorage objects from train.collect_rollout().
@@ -884,6 +1047,207 @@ def test_collect_rollout_values() -> None:
     env.close()
 
 
+def test_collect_rollout_pipelined() -> None:
+    """
+    Test that train.collect_rollout_pipelined() fills the RolloutStorage with exactly
+    the same values as train.collect_rollout() for the same seed, over multiple
+    rollouts, with actions sampled from either the global random number generator or
+    a separate generator.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings["num_processes"] = 5
+    settings["rollout_length"] = 64
+    num_rollouts = 2
+    seed = 1
+
+    for use_generator in [False, True]:
+        results = []
+        for collect in [collect_rollout, collect_rollout_pipelined]:
+            torch.manual_seed(seed)
+            generator = None
+            if use_generator:
+                generator = torch.Generator()
+                generator.manual_seed(seed)
+            env = get_env(
+                settings["env_name"],
+                settings["num_processes"],
+                seed=seed,
+                normalize_transition=False,
+                allow_early_resets=True,
+            )
+            policy = get_policy(env, settings)
+            rollout = RolloutStorage(
+                rollout_length=settings["rollout_length"],
+                observation_space=env.observation_space,
+                action_space=env.action_space,
+                num_processes=settings["num_processes"],
+                hidden_state_size=1,
+                device=settings["device"],
+            )
+            rollout.set_initial_obs(env.reset())
+
+            collect_results = []
+            for _ in range(num_rollouts):
+                rollout, episode_rewards, episode_successes = collect(
+                    rollout, env, policy, generator
+                )
+                collect_results.append(
+                    (
+                        [
+                            getattr(rollout, member).clone()
+                            for member in rollout.members
+                        ],
+                        episode_rewards,
+                        episode_successes,
+                    )
+                )
+                rollout.reset()
+            results.append(collect_results)
+
+            env.close()
+
+        # Compare rollout contents and episode statistics.
+        for serial_results, pipelined_results in zip(*results):
+            serial_members, serial_rewards, serial_successes = serial_results
+            pipelined_members, pipelined_rewards, pipelined_successes = (
+                pipelined_results
+            )
+            for serial_member, pipelined_member in zip(
+                serial_members, pipelined_members
+            ):
+                assert torch.equal(serial_member, pipelined_member)
+            assert serial_rewards == pipelined_rewards
+            assert serial_successes == pipelined_successes
+
+
+def test_collect_rollout_ready() -> None:
+    """
+    Test that train.collect_rollout_ready() fills every step of the RolloutStorage for
+    each process, and that each stored action log probability and value prediction is
+    that of the policy for the stored observation at the same step and process.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings["num_processes"] = 6
+    settings["rollout_length"] = 64
+    num_rollouts = 2
+
+    env = get_env(
+        settings["env_name"],
+        settings["num_processes"],
+        normalize_transition=False,
+        allow_early_resets=True,
+        envs_per_worker=2,
+    )
+    policy = get_policy(env, settings)
+    rollout = RolloutStorage(
+        rollout_length=settings["rollout_length"],
+        observation_space=env.observation_space,
+        action_space=env.action_space,
+        num_processes=settings["num_processes"],
+        hidden_state_size=1,
+        device=settings["device"],
+    )
+    rollout.set_initial_obs(env.reset())
+
+    for _ in range(num_rollouts):
+        rollout, _, _ = collect_rollout_ready(rollout, env, policy, num_ready_workers=1)
+        assert rollout.rollout_step == settings["rollout_length"]
+        assert (rollout.env_steps == settings["rollout_length"]).all()
+
+        # Compare stored values against the policy's outputs for the stored steps.
+        with torch.no_grad():
+            values, action_log_probs, _, _ = policy.evaluate_actions(
+                rollout.obs[:-1].view(-1, *rollout.obs.shape[2:]),
+                None,
+                rollout.actions.view(-1, *rollout.actions.shape[2:]),
+                None,
+            )
+        assert torch.allclose(
+            values.view(-1), rollout.value_preds[:-1].view(-1), atol=TOL
+        )
+        assert torch.allclose(
+            action_log_probs.view(-1), rollout.action_log_probs.view(-1), atol=TOL
+        )
+        rollout.reset()
+
+    env.close()
+
+
+def test_evaluate_fast() -> None:
+    """
+    Test that train.evaluate_fast() returns an equal number of episodes for each
+    process, and that the returned episodes don't depend on whether processes which
+    have finished their episodes are stepped by workers shared with other processes.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings["num_processes"] = 6
+    evaluation_episodes = 12
+
+    # Run evaluation with one and two environments per worker, with the same policy.
+    episode_rewards = []
+    policy = None
+    for envs_per_worker in [1, 2]:
+        env = get_env(
+            settings["env_name"],
+            settings["num_processes"],
+            normalize_transition=False,
+            allow_early_resets=True,
+            envs_per_worker=envs_per_worker,
+        )
+        if policy is None:
+            policy = get_policy(env, settings)
+            policy.train = False
+        rewards, successes = evaluate_fast(env, policy, evaluation_episodes)
+        assert len(rewards) == evaluation_episodes
+        assert len(successes) == evaluation_episodes
+        episode_rewards.append(sorted(rewards))
+        env.close()
+
+    assert episode_rewards[0] == episode_rewards[1]
+
+
+def test_evaluate_fast_continue() -> None:
+    """
+    Test that consecutive calls to train.evaluate_fast() with an `eval_state` continue
+    the episodes in progress without resetting the environment, so that they return
+    the same episodes as a single call for the total number of episodes.
+    """
+
+    settings = dict(DEFAULT_SETTINGS)
+    settings["num_processes"] = 4
+    evaluation_episodes = 8
+
+    # Run evaluation twice with an `eval_state`, then once for the total number of
+    # episodes on a new environment, with the same policy.
+    episode_rewards = []
+    policy = None
+    for num_calls in [2, 1]:
+        env = get_env(
+            settings["env_name"],
+            settings["num_processes"],
+            normalize_transition=False,
+            allow_early_resets=True,
+        )
+        if policy is None:
+            policy = get_policy(env, settings)
+            policy.train = False
+        eval_state = {}
+        rewards = []
+        for _ in range(num_calls):
+            call_rewards, _ = evaluate_fast(
+                env, policy, evaluation_episodes * 2 // num_calls, eval_state
+            )
+            rewards += call_rewards
+        assert len(rewards) == evaluation_episodes * 2
+        episode_rewards.append(sorted(rewards))
+        env.close()
+
+    assert episode_rewards[0] == episode_rewards[1]
+
+
 def test_save_load() -> None:
     """
     Test saving/loading functionality for training.
@@ -64,3 +64,25 @@ def test_update_point_avg() -> None:
     assert metric.mean == [0.0, 1.0, 0.75]
     assert metric.stdev == [0.0, 1.0, 1.25]
     assert metric.maximum == 1.0
+
+
+def test_update_iterations() -> None:
+    """
+    Test that Metric.update() stores the given training iteration with each value, and
+    with the average of the values when Metric.point_avg=True.
+    """
+
+    # Set up case.
+    metric = Metric(window_len=2)
+    avg_metric = Metric(point_avg=True, window_len=2)
+    data = [[1.0, -1.0], [3.0], [1.0, 0.0]]
+    iterations = [0, 3, 1]
+
+    # Call update.
+    for values, iteration in zip(data, iterations):
+        metric.update(values, iteration)
+        avg_metric.update(values, iteration)
+
+    # Verify stored iterations.
+    assert metric.iterations == [0, 0, 3, 1, 1]
+    assert avg_metric.iterations == iterations
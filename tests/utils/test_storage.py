@@ -0,0 +1,160 @@
+"""
+Unit tests for meta/utils/storage.py.
+"""
+
+import numpy as np
+import torch
+from gym.spaces import Box
+
+from meta.utils.storage import RolloutStorage
+
+
+ROLLOUT_LENGTH = 16
+NUM_PROCESSES = 6
+OBS_SIZE = 5
+ACTION_SIZE = 2
+
+
+def test_feedforward_minibatch_gather() -> None:
+    """
+    Test that feedforward_minibatch_generator() produces the same minibatches in
+    "gather" mode as in "sampler" mode.
+    """
+
+    rollout = get_random_rollout()
+    for num_minibatch in [1, 4, 7]:
+
+        # Generate minibatches in each mode from the same random seed.
+        torch.manual_seed(0)
+        sampler_minibatches = list(
+            rollout.feedforward_minibatch_generator(num_minibatch, mode="sampler")
+        )
+        torch.manual_seed(0)
+        gather_minibatches = list(
+            rollout.feedforward_minibatch_generator(num_minibatch, mode="gather")
+        )
+
+        # Compare minibatches.
+        assert len(sampler_minibatches) == num_minibatch
+        assert len(gather_minibatches) == num_minibatch
+        for sampler_batch, gather_batch in zip(sampler_minibatches, gather_minibatches):
+            assert list(gather_batch[0]) == list(sampler_batch[0])
+            for sampler_member, gather_member in zip(
+                sampler_batch[1:], gather_batch[1:]
+            ):
+                assert torch.equal(sampler_member, gather_member)
+
+
+def test_recurrent_minibatch_values() -> None:
+    """
+    Test that recurrent_minibatch_generator() yields the trajectories of the processes
+    in each minibatch, ordered by step and then process.
+    """
+
+    rollout = get_random_rollout()
+    num_minibatch = 3
+    trajectory_per_minibatch = NUM_PROCESSES // num_minibatch
+
+    seen_processes = []
+    for minibatch in rollout.recurrent_minibatch_generator(num_minibatch):
+        (
+            batch_indices,
+            obs_batch,
+            value_preds_batch,
+            actions_batch,
+            action_log_probs_batch,
+            dones_batch,
+            hidden_states_batch,
+            task_indices_batch,
+        ) = minibatch
+        assert len(batch_indices) == trajectory_per_minibatch
+        seen_processes += list(batch_indices)
+
+        # Compare each step of each trajectory against the rollout.
+        for step in range(ROLLOUT_LENGTH):
+            for i, process in enumerate(batch_indices):
+                pos = step * trajectory_per_minibatch + i
+                assert torch.equal(obs_batch[pos], rollout.obs[step, process])
+                assert value_preds_batch[pos] == rollout.value_preds[step, process, 0]
+                assert torch.equal(actions_batch[pos], rollout.actions[step, process])
+                assert (
+                    action_log_probs_batch[pos]
+                    == rollout.action_log_probs[step, process, 0]
+                )
+                assert dones_batch[pos] == rollout.dones[step, process, 0]
+                assert task_indices_batch[pos] == rollout.task_indices[step, process]
+
+        # Only the first hidden state of each trajectory is returned.
+        expected_hidden_states = rollout.hidden_states[0, batch_indices]
+        assert torch.equal(hidden_states_batch, expected_hidden_states)
+
+    assert sorted(int(process) for process in seen_processes) == list(
+        range(NUM_PROCESSES)
+    )
+
+
+def test_add_step_env_ids() -> None:
+    """
+    Test that adding steps for random subsets of processes with add_step(env_ids=...)
+    fills the rollout with the same values as adding steps for all processes at once.
+    """
+
+    rollout = get_random_rollout()
+    env_rollout = RolloutStorage(
+        rollout_length=ROLLOUT_LENGTH,
+        observation_space=rollout.observation_space,
+        action_space=rollout.action_space,
+        num_processes=NUM_PROCESSES,
+        hidden_state_size=1,
+    )
+    env_rollout.set_initial_obs(rollout.obs[0], rollout.task_indices[0])
+
+    # Add steps for random subsets of the processes which haven't finished.
+    while env_rollout.rollout_step < ROLLOUT_LENGTH:
+        assert env_rollout.rollout_step == int(env_rollout.env_steps.min())
+        remaining = torch.nonzero(env_rollout.env_steps < ROLLOUT_LENGTH).squeeze(-1)
+        env_ids = remaining[torch.randperm(len(remaining))[: np.random.randint(1, 4)]]
+        steps = env_rollout.env_steps[env_ids]
+        env_rollout.add_step(
+            obs=rollout.obs[steps + 1, env_ids],
+            action=rollout.actions[steps, env_ids],
+            dones=[bool(done) for done in rollout.dones[steps + 1, env_ids]],
+            action_log_prob=rollout.action_log_probs[steps, env_ids],
+            value_pred=rollout.value_preds[steps, env_ids],
+            reward=rollout.rewards[steps, env_ids],
+            hidden_state=rollout.hidden_states[steps + 1, env_ids],
+            task_indices=rollout.task_indices[steps + 1, env_ids],
+            env_ids=env_ids,
+        )
+
+    # Compare rollouts.
+    for member in rollout.members:
+        assert torch.equal(getattr(rollout, member), getattr(env_rollout, member))
+
+
+def get_random_rollout() -> RolloutStorage:
+    """ Return a full RolloutStorage filled with random values and task indices. """
+
+    rollout = RolloutStorage(
+        rollout_length=ROLLOUT_LENGTH,
+        observation_space=Box(low=-np.inf, high=np.inf, shape=(OBS_SIZE,)),
+        action_space=Box(low=-1, high=1, shape=(ACTION_SIZE,)),
+        num_processes=NUM_PROCESSES,
+        hidden_state_size=1,
+    )
+    rollout.set_initial_obs(
+        torch.rand(NUM_PROCESSES, OBS_SIZE), torch.randint(0, 3, (NUM_PROCESSES,))
+    )
+    for _ in range(ROLLOUT_LENGTH):
+        rollout.add_step(
+            obs=torch.rand(NUM_PROCESSES, OBS_SIZE),
+            action=torch.rand(NUM_PROCESSES, ACTION_SIZE),
+            dones=list(np.random.rand(NUM_PROCESSES) < 0.2),
+            action_log_prob=torch.rand(NUM_PROCESSES, 1),
+            value_pred=torch.rand(NUM_PROCESSES, 1),
+            reward=torch.rand(NUM_PROCESSES, 1),
+            hidden_state=torch.rand(NUM_PROCESSES, 1),
+            task_indices=torch.randint(0, 3, (NUM_PROCESSES,)),
+        )
+
+    return rollout
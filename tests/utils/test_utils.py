@@ -0,0 +1,78 @@
+"""
+Unit tests for meta/utils/utils.py.
+"""
+
+import os
+import json
+
+import torch
+
+from meta.utils.utils import sum_by_task, aligned_train_configs
+
+
+CARTPOLE_CONFIG_PATH = os.path.join("configs", "cartpole.json")
+
+
+def test_sum_by_task() -> None:
+    """ Test sum_by_task() against a separate sum for each task. """
+
+    # Set up case. Task 3 has no examples.
+    num_tasks = 5
+    values = torch.rand(40, 2)
+    task_indices = torch.randint(0, num_tasks - 1, (40,))
+    task_indices[task_indices == 3] = num_tasks - 1
+
+    # Call sum_by_task().
+    task_sums = sum_by_task(values, task_indices, num_tasks)
+
+    # Verify computed values.
+    assert task_sums.shape == torch.Size([num_tasks, 2])
+    for task in range(num_tasks):
+        expected = values[task_indices == task].sum(dim=0)
+        assert torch.allclose(task_sums[task], expected)
+    assert torch.all(task_sums[3] == 0)
+
+
+def test_sum_by_task_grad() -> None:
+    """ Test that gradients flow through sum_by_task() to each example. """
+
+    # Set up case.
+    values = torch.rand(10, requires_grad=True)
+    task_indices = torch.tensor([0, 1, 1, 2, 0, 2, 2, 1, 0, 0])
+
+    # Call sum_by_task() and backprop through a weighted sum of task sums.
+    task_sums = sum_by_task(values, task_indices, 3)
+    task_weights = torch.tensor([1.0, 2.0, 3.0])
+    torch.sum(task_weights * task_sums).backward()
+
+    # Verify gradients.
+    assert torch.allclose(values.grad, task_weights[task_indices])
+
+
+def test_aligned_train_configs_missing_settings() -> None:
+    """
+    Test that aligned_train_configs() accepts a config saved before settings were
+    added, as long as the current config uses the value that matches the behavior from
+    before the settings were added.
+    """
+
+    # Load default training config, and construct an old config without the settings
+    # that were added later.
+    with open(CARTPOLE_CONFIG_PATH, "r") as config_file:
+        config = json.load(config_file)
+    added_settings = {
+        "policy_normalization": True,
+        "eval_processes": 2,
+        "fast_eval": True,
+    }
+    old_config = dict(config)
+    for setting in added_settings:
+        del old_config[setting]
+
+    # Test alignment with default and non-default values of each added setting.
+    assert aligned_train_configs(config, old_config)
+    assert aligned_train_configs(old_config, config)
+    for setting, value in added_settings.items():
+        new_config = dict(config)
+        new_config[setting] = value
+        assert not aligned_train_configs(new_config, old_config)